@@ -28,6 +28,7 @@ httpx_logger.setLevel(logging.WARNING)
 from eurekaverse.utils.terrain_utils import set_terrain, copy_terrain, setup_generated_terrains_from_file, get_eval_stats_from_file, stat_to_str, get_terrain_descriptions, extract_fixed_terrains, get_num_total_goals
 from eurekaverse.utils.gpt_utils import prepare_prompts, query_gpt_initial, query_gpt_evolution, log_gpt_query
 from eurekaverse.utils.misc_utils import get_freest_gpu, run_subprocess, wait_subprocess
+from eurekaverse.utils.state_utils import RunStateStore
 
 file_dir = os.path.dirname(os.path.abspath(__file__))  # Location of this file
 
@@ -100,9 +101,13 @@ def main(args):
     cfg.train_iterations = int(cfg.train_iterations)
 
     # Load lineage
-    last_it = cfg.iterations - 1
-    with open(f"{load_dir}/parallel_run_lineage_it-{last_it}.pkl", "rb") as f:
-        parallel_run_lineage = pickle.load(f)
+    if os.path.exists(f"{load_dir}/run_state.sqlite"):
+        parallel_run_lineage = RunStateStore(f"{load_dir}/run_state.sqlite").latest("selection")
+    else:
+        # Runs from before the run state store
+        last_it = cfg.iterations - 1
+        with open(f"{load_dir}/parallel_run_lineage_it-{last_it}.pkl", "rb") as f:
+            parallel_run_lineage = pickle.load(f)
     # Assuming the best run is the most common last run across the lineages
     last_parallel_run_ids = [lineage[-1] for lineage in parallel_run_lineage.values()]
     best_run_id = max(set(last_parallel_run_ids), key=last_parallel_run_ids.count)
@@ -10,12 +10,13 @@ import wandb
 import random
 import ast
 import multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait, FIRST_COMPLETED
 import numpy as np
 import threading
 import ast
-import pickle
 import copy
+import functools
+import itertools
 
 # Hide wandb output
 os.environ["WANDB_SILENT"] = "True"
@@ -23,15 +24,28 @@ os.environ["WANDB_SILENT"] = "True"
 httpx_logger = logging.getLogger("httpx")
 httpx_logger.setLevel(logging.WARNING)
 
-from eurekaverse.utils.terrain_utils import set_terrain, copy_terrain, setup_generated_terrains, get_eval_stats_from_file, stat_to_str, get_terrain_descriptions, extract_fixed_terrains, get_num_total_goals, get_terrain_stats_string
-from eurekaverse.utils.gpt_utils import prepare_prompts, query_gpt_initial, query_gpt_evolution, log_gpt_query
-from eurekaverse.utils.misc_utils import get_num_gpus, get_freest_gpu, run_subprocess, wait_subprocess, seeded
+import eurekaverse.utils.terrain_utils as terrain_utils
+from eurekaverse.utils.terrain_utils import set_terrain, copy_terrain, setup_generated_terrains, get_eval_stats_from_file, aggregate_terrain_stats, EvalResultCache, stat_to_str, get_terrain_descriptions, extract_fixed_terrains, get_num_total_goals, get_terrain_stats_string, get_task_terrain_cfg, start_check_pool, stop_check_pool, check_terrain_in_pool
+from eurekaverse.utils.gpt_utils import prepare_prompts, open_response_cache, query_gpt_initial_stream, query_gpt_evolution_stream, log_gpt_query
+from eurekaverse.utils.misc_utils import get_num_gpus, GpuScheduler, GpustatDevices, NvmlDevices, FakeDevices, SuccessiveHalving, run_subprocess, wait_subprocess, seeded, start_tracing, stop_tracing, trace, traced, add_trace_args
+from eurekaverse.utils.state_utils import RunStateStore
+from eurekaverse.utils.dry_run_utils import FakeOpenAIServer
+from legged_gym import LEGGED_GYM_ROOT_DIR
+from legged_gym.utils.helpers import get_checkpoint
+from legged_gym.eval.eval_server import EvalServerPool, EVAL_SERVER_READY_LOG
 
 file_dir = os.path.dirname(os.path.abspath(__file__))  # Location of this file
 
 # Parkour files for training, evaluation, and terrain setting
 train_script = Path(f"{file_dir}/../extreme-parkour/legged_gym/legged_gym/scripts/train.py")
 eval_script = Path(f"{file_dir}/../extreme-parkour/legged_gym/legged_gym/scripts/evaluate.py")
+eval_server_script = Path(f"{file_dir}/../extreme-parkour/legged_gym/legged_gym/scripts/evaluate_server.py")
+logs_dir = Path(LEGGED_GYM_ROOT_DIR) / "logs" / "parkour"  # Where train.py saves the policies
+
+# Replacements for dry runs (see use_dry_run_backends())
+dry_run_train_script = Path(f"{file_dir}/scripts/dry_run_train.py")
+dry_run_eval_script = Path(f"{file_dir}/scripts/dry_run_evaluate.py")
+dry_run_eval_server_script = Path(f"{file_dir}/scripts/dry_run_evaluate_server.py")
 
 # Logging (will be set by hydra)
 run_id = None
@@ -41,6 +55,12 @@ gpt_queries_dir = None
 check_execution_dir = None
 renders_dir = None
 
+# Records every finished job, so a stopped run can be resumed (see restore_run())
+run_state = None
+run_state_filename = "run_state.sqlite"
+completed_trainings = {}                         # Train log file of each (iteration, parallel run id) that finished training
+completed_runs = set()                           # Each (iteration, parallel run id) whose results are recorded
+
 # Global variables, records everything for each iteration and parallel run
 parallel_run_lineage = {}                        # For each current parallel run, records the list of previous runs it resumed from
 
@@ -48,6 +68,13 @@ all_executable_terrains = {}                     # Saves all generated terrains,
 flattened_all_executable_terrains = {}           # Flattened version of all_executable_terrains, used to match all-training stats to terrains
 all_executable_terrains_lock = threading.Lock()  # Lock for all_executable_terrains since it's updated by multiple threads
 num_chunks = 0                                   # Number of chunks all_executable_terrains was split into
+all_training_terrain_weights = {}                # For each terrain in flattened_all_executable_terrains, how many terrains it stands for
+
+eval_server_pool = None                          # Schedules evaluations on persistent servers (if cfg.eval_server)
+eval_server_processes = []                       # Processes of the started evaluation servers
+eval_server_ids = itertools.count()              # Numbers the servers' log files, also when several start at once
+eval_result_cache = None                         # Cached evaluation results (if cfg.eval_cache_file)
+run_culler = None                                # Stops the worst parallel runs early in each iteration (if cfg.cull_rungs)
 
 eval_pre_training_stats = {}                     # (Unused)
 eval_pre_training_stats_per_terrain = {}         # Used as feedback for GPT and to compute learning progress
@@ -58,20 +85,77 @@ eval_all_training_stats_per_terrain = {}         # (Unused)
 eval_testing_stats = {}                          # Logged
 eval_testing_stats_per_terrain = {}              # (Unused)
 
-num_gpus = get_num_gpus()
-
+num_gpus = None                                  # Set in main
+fake_openai_server = None                        # Answers GPT queries in dry runs (see use_dry_run_backends())
+gpu_scheduler = None                             # Assigns GPUs to jobs by their memory (unless cfg.deterministic_gpu)
+
+def use_dry_run_backends(cfg):
+    """Fakes GPT, GPUs, training, evaluation and terrain checks (see utils/dry_run_utils.py), so the whole loop runs on
+    CPU in seconds. The fake processes take the same arguments and print the same logs, so everything else is real.
+    Terrain files and fake checkpoints are written to dry_run/ in the run's output directory, not into legged_gym."""
+    global train_script, eval_script, eval_server_script, fake_openai_server, logs_dir
+
+    logging.info(f"Dry run with {cfg.dry_run_gpus} fake GPUs, nothing is trained or evaluated!")
+    train_script, eval_script, eval_server_script = dry_run_train_script, dry_run_eval_script, dry_run_eval_server_script
+    dry_run_dir = output_dir / "dry_run"
+    logs_dir = dry_run_dir / "logs"
+    terrain_utils.terrain_file_dir = dry_run_dir / "set_terrains"
+    os.makedirs(logs_dir, exist_ok=True)
+    os.makedirs(terrain_utils.terrain_file_dir, exist_ok=True)
+    os.environ["DRY_RUN_DIR"] = str(dry_run_dir)
+    # The OpenAI client reads these when it's created in prepare_prompts()
+    fake_openai_server = FakeOpenAIServer(latency=cfg.dry_run_gpt_latency)
+    os.environ["OPENAI_BASE_URL"] = fake_openai_server.url
+    os.environ["OPENAI_API_KEY"] = "dry-run"
+    for name in ["train_time", "eval_time", "check_time", "check_failure_rate"]:
+        os.environ[f"DRY_RUN_{name.upper()}"] = str(cfg[f"dry_run_{name}"])
+    # Checks go through the fake train script, and there's nothing worth logging
+    cfg.check_in_pool = False
+    cfg.wandb = False
+
+def acquire_gpu(cfg, job_type, job_id):
+    if cfg.deterministic_gpu:
+        gpu = f"cuda:{job_id % num_gpus}"
+    else:
+        with trace("gpu_wait", job_type=job_type) as span_args:
+            gpu = gpu_scheduler.acquire(job_type)
+            span_args["gpu"] = gpu
+    add_trace_args(gpu=gpu)
+    return gpu
+
+def release_gpu(cfg, gpu, job_type, process=None):
+    # With a process, waits until it exits
+    if cfg.deterministic_gpu:
+        return
+    if process is not None:
+        gpu_scheduler.release_on_exit(process, gpu, job_type)
+    else:
+        gpu_scheduler.release(gpu, job_type)
+
+def run_gpu_subprocess(cfg, command, log_file, gpu, job_type):
+    # Starts a job on an acquired GPU, which is released once the process exits, or right away if it fails to start
+    try:
+        process = run_subprocess(command=command, log_file=log_file)
+    except BaseException:
+        release_gpu(cfg, gpu, job_type)
+        raise
+    release_gpu(cfg, gpu, job_type, process)
+    return process
+
+@traced("it", "parallel_run_id")
 def run_training(cfg, it, parallel_run_id, load_exptid):
     log_file = output_dir / f"train_iter-{it}_run-{parallel_run_id}.log"
     if log_file.exists():
         log_file.rename(f"{log_file}.old")
     
-    gpu = get_freest_gpu() if not cfg.deterministic_gpu else f"cuda:{parallel_run_id % num_gpus}"
+    gpu = acquire_gpu(cfg, "train", parallel_run_id)
     command = f"python -u {train_script} --task {cfg.quadruped_model} --exptid {run_id}_{it}_{parallel_run_id} --device {gpu} --max_iterations {cfg.train_iterations} --terrain_type it-{it}_run-{parallel_run_id}"
     command = command + f" --resume --load_run {load_exptid}"
     command = command + f" --use_wandb --wandb_id {wandb_id}_{it}_{parallel_run_id} --wandb_group {run_id}" if cfg.wandb else command
     command = command + f" --render_images" if cfg.render_images else command
+    command = command + f" --terrain_cache" if cfg.terrain_cache else command
 
-    process = run_subprocess(command=command, log_file=log_file)
+    process = run_gpu_subprocess(cfg, command, log_file, gpu, "train")
     success, timeout = wait_subprocess(process, log_file, success_log="Starting training", failure_log="Traceback", timeout=20*60)
     if timeout:
         logging.warning(f"Timeout while training for run {parallel_run_id}!")
@@ -80,40 +164,142 @@ def run_training(cfg, it, parallel_run_id, load_exptid):
         return None, None
     return process, log_file
 
-def run_evaluation(cfg, it, parallel_run_id, exptid, terrain):
-    log_file = output_dir / f"eval_iter-{it}_run-{parallel_run_id}_{terrain}.log"
+def start_eval_server(cfg, device):
+    log_file = output_dir / f"eval_server_{next(eval_server_ids)}_{device.replace(':', '-')}.log"
     if log_file.exists():
         log_file.rename(f"{log_file}.old")
 
-    gpu = get_freest_gpu() if not cfg.deterministic_gpu else f"cuda:{parallel_run_id % num_gpus}"
-    command = f"python -u {eval_script} --task {cfg.quadruped_model} --exptid {exptid} --device {gpu} --headless --max_steps {cfg.eval_steps} --metric_granularity type"
+    command = f"python -u {eval_server_script} --task {cfg.quadruped_model} --device {device} --headless --max_steps {cfg.eval_steps} --metric_granularity type"
+    command = command + f" --terrain_cache" if cfg.terrain_cache else command
+
+    process = run_subprocess(command=command, log_file=log_file)
+    success, timeout = wait_subprocess(process, log_file, success_log=EVAL_SERVER_READY_LOG, failure_log="Traceback", timeout=20*60)
+    if not success or timeout:
+        process.terminate()
+        raise RuntimeError(f"Failed to start evaluation server on {device}, see {log_file}")
+    eval_server_processes.append(process)
+    port = int(process.watch(EVAL_SERVER_READY_LOG).result().split()[-1])
+    logging.info(f"Started evaluation server on {device}, port {port}")
+    return port
+
+def get_eval_cache_key(cfg, exptid, terrain_type):
+    load_dir = logs_dir / exptid
+    if not load_dir.exists():
+        return None
+    eval_config = {"task": cfg.quadruped_model, "max_steps": cfg.eval_steps, "terrain_cache": cfg.terrain_cache}
+    return EvalResultCache.get_key(load_dir / get_checkpoint(load_dir), terrain_type, eval_config)
+
+@traced("it", "parallel_run_id", "exptid", "terrain")
+def run_evaluation(cfg, it, parallel_run_id, exptid, terrain):
+    """Evaluates exptid on the given terrain and waits for it to finish. Returns whether it succeeded and the log file."""
+    log_file = output_dir / f"eval_iter-{it}_run-{parallel_run_id}_{terrain}.log"
+    results_file = log_file.with_suffix(".json")  # Read by get_eval_stats_from_file
+    for file in [log_file, results_file]:
+        if file.exists():
+            file.rename(f"{file}.old")
+
     if terrain == "pre_training" or terrain == "post_training":
-        command = command + f" --terrain_type it-{it}_run-{parallel_run_id}"
+        terrain_type = f"it-{it}_run-{parallel_run_id}"
     elif terrain == "testing":
-        command = command + f" --terrain_type benchmark"
+        terrain_type = "benchmark"
     elif terrain.startswith("all_training"):
         chunk_id = int(terrain.split("_")[-1])
-        command = command + f" --terrain_type it-{it}_run-all_{chunk_id}"
+        terrain_type = f"it-{it}_run-all_{chunk_id}"
     else:
         raise ValueError(f"Invalid terrain type: {terrain}")
 
-    process = run_subprocess(command=command, log_file=log_file)
+    cache_key = get_eval_cache_key(cfg, exptid, terrain_type) if eval_result_cache is not None else None
+    cached = eval_result_cache.get(cache_key) if cache_key is not None else None
+    if cached is not None:
+        logging.info(f"Using cached evaluation of {exptid} on {terrain_type} for run {parallel_run_id}")
+        add_trace_args(cached=True)
+        output, results = cached
+        log_file.write_text(output)
+        results_file.write_text(results)
+        return True, log_file
+
+    gpu = acquire_gpu(cfg, "eval", parallel_run_id)
+    if eval_server_pool is not None:
+        try:
+            result = eval_server_pool.run({"exptid": exptid, "terrain_type": terrain_type, "results_file": str(results_file)}, device=gpu)
+        finally:
+            release_gpu(cfg, gpu, "eval")
+        with open(log_file, "w") as f:
+            f.write(result["output"] if result["success"] else result["error"])
+        if not result["success"]:
+            return False, None
+        if cache_key is not None and results_file.exists():
+            eval_result_cache.put(cache_key, log_file.read_text(), results_file.read_text())
+        return True, log_file
+
+    command = f"python -u {eval_script} --task {cfg.quadruped_model} --exptid {exptid} --device {gpu} --headless --max_steps {cfg.eval_steps} --metric_granularity type"
+    command = command + f" --terrain_type {terrain_type} --results_file {results_file}"
+    command = command + f" --terrain_cache" if cfg.terrain_cache else command
+
+    process = run_gpu_subprocess(cfg, command, log_file, gpu, "eval")
     success, timeout = wait_subprocess(process, log_file, success_log="Loading model", failure_log="Traceback", timeout=20*60)
     if timeout:
         logging.warning(f"Timeout while evaluating for run {parallel_run_id}!")
         process.terminate()
     if not success or timeout:
-        return None, None
-    return process, log_file
-
-def setup_training_all_terrains(it):
-    global num_chunks, flattened_all_executable_terrains
+        return False, None
+    process.communicate()
+    if cache_key is not None and process.returncode == 0 and results_file.exists():
+        eval_result_cache.put(cache_key, log_file.read_text(), results_file.read_text())
+    return True, log_file
+
+def get_train_reward(log_file, train_it):
+    # Mean reward printed in the log block of the given learning iteration, None if it wasn't printed
+    with open(log_file) as f:
+        train_log = f.read()
+    block = re.split(r"Learning iteration \d+/", train_log.split(f"Learning iteration {train_it}/")[-1])[0]
+    match = re.search(r"Mean reward \(total\):\s+(\S+)", block)
+    return float(match.group(1)) if match is not None else None
+
+def cull_training(cfg, parallel_run_id, process, log_file):
+    """Reports the training reward of a parallel run at each rung, returns whether the run should continue training."""
+    run_culler.start(parallel_run_id)
+    first_line = process.watch("Learning iteration ")
+    futures_wait([first_line, process.exited], return_when=FIRST_COMPLETED)
+    if not first_line.done():
+        return True
+    end_it = int(re.search(r"Learning iteration \d+/(\d+)", first_line.result()).group(1))
+    start_it = end_it - cfg.train_iterations
+    for rung in run_culler.rungs:
+        # Wait until the next iteration starts, so the rung's log block is complete
+        next_line = process.watch(f"Learning iteration {start_it + rung + 1}/")
+        futures_wait([next_line, process.exited], return_when=FIRST_COMPLETED)
+        if not next_line.done():
+            return True
+        reward = get_train_reward(log_file, start_it + rung)
+        if reward is None:
+            # Keep the run, and don't let the other runs wait for its later rungs
+            logging.warning(f"No mean reward logged for run {parallel_run_id} at iteration {rung}, it won't be culled")
+            run_culler.stop(parallel_run_id)
+            return True
+        if not run_culler.report(parallel_run_id, rung, reward):
+            logging.info(f"Stopping training of run {parallel_run_id} at iteration {rung}, its mean reward {reward:.2f} is among the worst")
+            return False
+        logging.info(f"Run {parallel_run_id} continues training after iteration {rung} with mean reward {reward:.2f}")
+    return True
+
+def setup_training_all_terrains(cfg, it):
+    global num_chunks, flattened_all_executable_terrains, all_training_terrain_weights
     with all_executable_terrains_lock:
         for i in range(num_chunks):
             if os.path.exists(f"{output_dir}/terrain_iter-{it}_run-all_{i}.py"):
                 os.remove(f"{output_dir}/terrain_iter-{it}_run-all_{i}.py")
         terrain_filename = f"set_terrain_it-{it}_run-all"
-        flattened_all_executable_terrains[it] = list(set([item for sub_dict in all_executable_terrains.values() for sub_list in sub_dict.values() for item in sub_list]))
+        # Ordered (unlike a set) so the chunks stay the same between calls and restarts
+        new_terrains = list(dict.fromkeys(item for sub_list in all_executable_terrains[it].values() for item in sub_list))
+        old_terrains = [item for prev_it in sorted(all_executable_terrains.keys()) if prev_it != it for sub_list in all_executable_terrains[prev_it].values() for item in sub_list]
+        old_terrains = [item for item in dict.fromkeys(old_terrains) if item not in set(new_terrains)]
+        num_old_terrains = len(old_terrains)
+        if 0 <= cfg.eval_all_training_sample < num_old_terrains:
+            # Same sample for every run in this iteration, so their stats stay comparable
+            old_terrains = random.Random(it).sample(old_terrains, cfg.eval_all_training_sample)
+        flattened_all_executable_terrains[it] = new_terrains + old_terrains
+        all_training_terrain_weights[it] = [1.0] * len(new_terrains) + [num_old_terrains / max(len(old_terrains), 1)] * len(old_terrains)
         num_chunks = setup_generated_terrains(
             terrain_filename,
             flattened_all_executable_terrains[it],
@@ -122,6 +308,7 @@ def setup_training_all_terrains(it):
         for i in range(num_chunks):
             copy_terrain(f"{terrain_filename}_{i}", f"{output_dir}/terrain_iter-{it}_run-all_{i}.py")
 
+@traced("it", "parallel_run_id")
 def parallel_run(cfg, it, parallel_run_id):
     """Runs training and evaluation for a parallel run."""
     global all_executable_terrains, all_executable_terrains_lock
@@ -139,68 +326,85 @@ def parallel_run(cfg, it, parallel_run_id):
 
     # Start evaluation (training terrain before training) process
     logging.info(f"> Starting {eval_script.name} subprocess (pre-training) for parallel run {parallel_run_id}...")
-    eval_process, eval_pre_training_log_file = run_evaluation(cfg, it, parallel_run_id, load_exptid, terrain="pre_training")
-    if eval_process is None:
+    eval_success, eval_pre_training_log_file = run_evaluation(cfg, it, parallel_run_id, load_exptid, terrain="pre_training")
+    if not eval_success:
         logging.warning(f"Error in evaluation (pre-training) for run {parallel_run_id}!")
         del all_executable_terrains[it][parallel_run_id]
-        setup_training_all_terrains(it)
+        run_state.append("terrains", None, it=it, parallel_run_id=parallel_run_id)
+        setup_training_all_terrains(cfg, it)
         return
-    logging.info(f"Evaluation (pre-training) started for run {parallel_run_id}...")
-    eval_process.communicate()
-
-    # Start training process, wait for it to print execution success or failure (or timeout)
-    logging.info(f"> Starting {train_script.name} subprocess for parallel run {parallel_run_id}...")
-    train_process, train_log_file = run_training(cfg, it, parallel_run_id, load_exptid)
-    if train_process is None:
-        logging.warning(f"Error in training for run {parallel_run_id}!")
-        del all_executable_terrains[it][parallel_run_id]
-        setup_training_all_terrains(it)
-        return
-    logging.info(f"Training started for run {parallel_run_id}...")
-    with open(train_log_file) as f:
-        train_log = f.read()
+    logging.info(f"Evaluation (pre-training) finished for run {parallel_run_id}...")
 
-    # Copy training renderings to hydra output directory, if they exist
-    log_dir = re.search(r"Starting training, using log directory (.*?)\.\.\.", train_log).group(1)
-    render_log_dir = Path(log_dir) / "renders"
-    if render_log_dir.exists():
-        shutil.copytree(render_log_dir, renders_dir / f"iter-{it}" / f"run-{parallel_run_id}")
-    
-    # Wait for training to complete
-    train_process.communicate()
+    train_log_file = completed_trainings.get((it, parallel_run_id))
+    if train_log_file is not None:
+        logging.info(f"Training already finished for run {parallel_run_id} before resuming, skipping it...")
+    else:
+        with trace("training", it=it, parallel_run_id=parallel_run_id):
+            # Start training process, wait for it to print execution success or failure (or timeout)
+            logging.info(f"> Starting {train_script.name} subprocess for parallel run {parallel_run_id}...")
+            train_process, train_log_file = run_training(cfg, it, parallel_run_id, load_exptid)
+            if train_process is None:
+                logging.warning(f"Error in training for run {parallel_run_id}!")
+                del all_executable_terrains[it][parallel_run_id]
+                run_state.append("terrains", None, it=it, parallel_run_id=parallel_run_id)
+                setup_training_all_terrains(cfg, it)
+                return
+            logging.info(f"Training started for run {parallel_run_id}...")
+            with open(train_log_file) as f:
+                train_log = f.read()
+
+            # Copy training renderings to hydra output directory, if they exist
+            log_dir = re.search(r"Starting training, using log directory (.*?)\.\.\.", train_log).group(1)
+            render_log_dir = Path(log_dir) / "renders"
+            if render_log_dir.exists():
+                shutil.copytree(render_log_dir, renders_dir / f"iter-{it}" / f"run-{parallel_run_id}")
+
+            # Wait for training to complete, unless it's culled
+            try:
+                if run_culler is not None and not cull_training(cfg, parallel_run_id, train_process, train_log_file):
+                    train_process.terminate()
+                    train_process.communicate()
+                    return
+                train_process.communicate()
+            finally:
+                # Rungs stop waiting for this run as soon as its training is over, not after its evaluations
+                if run_culler is not None:
+                    run_culler.stop(parallel_run_id)
+        if train_process.returncode == 0:
+            run_state.append("training", str(train_log_file), it=it, parallel_run_id=parallel_run_id)
 
     # Start evaluation (training terrain after training) process
     logging.info(f"> Starting {eval_script.name} subprocess (post-training) for parallel run {parallel_run_id}...")
-    eval_process, eval_post_training_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain="post_training")
-    if eval_process is None:
+    eval_success, eval_post_training_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain="post_training")
+    if not eval_success:
         logging.warning(f"Error in evaluation (post-training) for run {parallel_run_id}!")
         return
-    logging.info(f"Evaluation (post-training) started for run {parallel_run_id}...")
-    eval_process.communicate()
+    logging.info(f"Evaluation (post-training) finished for run {parallel_run_id}...")
 
     # Start evaluation (all training terrains) process
     eval_all_training_log_files = []
     for i in range(num_chunks):
         logging.info(f"> Starting {eval_script.name} subprocess (all-training_{i}) for parallel run {parallel_run_id}...")
-        eval_process, eval_all_training_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain=f"all_training_{i}")
-        if eval_process is None:
+        eval_success, eval_all_training_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain=f"all_training_{i}")
+        if not eval_success:
             logging.warning(f"Error in evaluation (all-training_{i}) for run {parallel_run_id}!")
             return
-        logging.info(f"Evaluation (all-training_{i}) started for run {parallel_run_id}...")
-        eval_process.communicate()
+        logging.info(f"Evaluation (all-training_{i}) finished for run {parallel_run_id}...")
         eval_all_training_log_files.append(eval_all_training_log_file)
 
     # Start evaluation (testing terrain) process
+    # Not batched with the other runs through evaluate.py --policies, since that would hold each run back until the slowest
+    # one finished training, and runs are recorded (and culled) as they finish. With cfg.eval_server the testing sim is reused anyway.
     logging.info(f"> Starting {eval_script.name} subprocess (testing) for parallel run {parallel_run_id}...")
-    eval_process, eval_testing_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain="testing")
-    if eval_process is None:
+    eval_success, eval_testing_log_file = run_evaluation(cfg, it, parallel_run_id, exptid, terrain="testing")
+    if not eval_success:
         logging.warning(f"Error in evaluation (testing) for run {parallel_run_id}!")
         return parallel_run_id, train_log_file, eval_pre_training_log_file, eval_post_training_log_file, eval_all_training_log_files, None
-    logging.info(f"Evaluation (testing) started for run {parallel_run_id}...")
-    eval_process.communicate()
+    logging.info(f"Evaluation (testing) finished for run {parallel_run_id}...")
 
     return parallel_run_id, train_log_file, eval_pre_training_log_file, eval_post_training_log_file, eval_all_training_log_files, eval_testing_log_file
 
+@traced("it", "parallel_run_id", "sample_id", "terrain_id")
 def check_response(cfg, gpt_response, it, parallel_run_id, sample_id, terrain_id):
     """Checks whether gpt_response is executable."""
     save_dir = check_execution_dir / f"iter_{it}" / f"run-{parallel_run_id}"
@@ -216,6 +420,14 @@ def check_response(cfg, gpt_response, it, parallel_run_id, sample_id, terrain_id
     with open(f"{save_dir}/{filename}.py", "w") as f:
         f.write(gpt_response)
 
+    if cfg.check_in_pool:
+        # Only generate the terrain on CPU, without starting a simulation
+        logging.debug(f"Checking execution of generated terrain {sample_id} in check pool...")
+        success, error = check_terrain_in_pool(gpt_response, timeout=2*cfg.check_cpu_time_limit)
+        with open(save_dir / f"{filename}.log", "w") as f:
+            f.write("Terrain check passed\n" if success else error)
+        return success, sample_id
+
     # Set generated terrain, test execution
     logging.debug(f"Checking execution of generated terrain {sample_id}...")
     terrain_filename = f"set_terrain_{terrain_type}"
@@ -225,33 +437,40 @@ def check_response(cfg, gpt_response, it, parallel_run_id, sample_id, terrain_id
     if log_file.exists():
         log_file.rename(f"{log_file}.old")
     
-    gpu = get_freest_gpu(gpustat_delay=0) if not cfg.deterministic_gpu else (f"cuda:{sample_id % num_gpus}" if terrain_id == -1 else f"cuda:{terrain_id % num_gpus}")
+    gpu = acquire_gpu(cfg, "check", sample_id if terrain_id == -1 else terrain_id)
     command = f"python -u {train_script} --task {cfg.quadruped_model} --exptid {run_id}_{it}_{parallel_run_id} --device {gpu} --max_iterations 0 --terrain_type {terrain_type} --check_terrain_feasibility"
-    process = run_subprocess(command=command, log_file=log_file)
+    process = run_gpu_subprocess(cfg, command, log_file, gpu, "check")
     success, timeout = wait_subprocess(process, log_file, success_log="Converting heightmap to trimesh", failure_log="Traceback", timeout=10*60)
     if timeout:
         logging.warning(f"Timeout while checking response for run {parallel_run_id}, sample {sample_id}!")
     process.terminate()
     return success, sample_id
 
+@traced("parallel_run_id")
 def initial_generation(cfg, parallel_run_id):
     executable_terrains = []
     total_prompt_cost, total_response_cost = 0, 0
     for query_id in range(cfg.max_gpt_queries):
-        query_messages, gpt_responses, gpt_parsed_responses, prompt_cost, response_cost = query_gpt_initial(cfg, num_samples=cfg.initial_query_sample_multiplier*cfg.num_terrain_types)
-        log_gpt_query(query_messages, gpt_responses, save_dir=gpt_queries_dir / f"iter-0" / f"run-{parallel_run_id}" / f"query-{query_id}")
-        total_response_cost += response_cost
-        total_prompt_cost += prompt_cost
-
-        # Parallelize over GPT responses
-        sample_id_start = query_id * len(gpt_responses)
+        # Parallelize over GPT responses, starting checks as soon as each request returns
+        num_samples = cfg.initial_query_sample_multiplier*cfg.num_terrain_types
+        sample_id_start = query_id * num_samples
+        query_key = dict(it=0, parallel_run_id=parallel_run_id, terrain_id=-1, query_id=query_id)
+        gpt_responses, gpt_parsed_responses = [], []
         executor = ThreadPoolExecutor(max_workers=cfg.num_parallel_checks)
         try:
             futures = []
-            for i, response in enumerate(gpt_parsed_responses):
-                sample_id = sample_id_start + i
-                futures.append(executor.submit(check_response, cfg, response, 0, parallel_run_id, sample_id, -1))
-            
+            for query_messages, responses, parsed_responses, prompt_cost, response_cost in query_gpt_initial_stream(cfg, num_samples=num_samples, query_key=query_key):
+                total_response_cost += response_cost
+                total_prompt_cost += prompt_cost
+                for response, parsed_response in zip(responses, parsed_responses):
+                    sample_id = sample_id_start + len(gpt_responses)
+                    gpt_responses.append(response)
+                    gpt_parsed_responses.append(parsed_response)
+                    futures.append(executor.submit(check_response, cfg, parsed_response, 0, parallel_run_id, sample_id, -1))
+            if not gpt_responses:
+                continue
+            log_gpt_query(query_messages, gpt_responses, save_dir=gpt_queries_dir / f"iter-0" / f"run-{parallel_run_id}" / f"query-{query_id}")
+
             for future in as_completed(futures):
                 success, sample_id = future.result()
                 if success:
@@ -271,15 +490,26 @@ def initial_generation(cfg, parallel_run_id):
 def query_and_check_response(cfg, it, parallel_run_id, terrain_id, prev_executable_terrains, prev_eval_strings, all_prev_terrain_descriptions):
     for query_id in range(cfg.max_gpt_queries):
         terrain_stats = get_terrain_stats_string(prev_executable_terrains[terrain_id])
-        query_messages, gpt_responses, gpt_parsed_responses, prompt_cost, response_cost = query_gpt_evolution(cfg, prev_executable_terrains[terrain_id], prev_eval_strings[terrain_id], terrain_stats, all_prev_terrain_descriptions, num_samples=cfg.evolution_query_sample_multiplier)
-        log_gpt_query(query_messages, gpt_responses, save_dir=gpt_queries_dir / f"iter-{it}" / f"run-{parallel_run_id}" / f"terrain-{terrain_id}_query-{query_id}")
-
-        sample_id_start = query_id * len(gpt_responses)
-        for sample_id, response in enumerate(gpt_parsed_responses, start=sample_id_start):
-            success, sample_id = check_response(cfg, response, it, parallel_run_id, sample_id, terrain_id)
-            if success:
-                return terrain_id, response, sample_id, prompt_cost, response_cost
+        # Check each sample as soon as its request returns, stopping at the first executable one
+        sample_id_start = query_id * cfg.evolution_query_sample_multiplier
+        query_key = dict(it=it, parallel_run_id=parallel_run_id, terrain_id=terrain_id, query_id=query_id)
+        gpt_responses = []
+        total_prompt_cost, total_response_cost = 0, 0
+        try:
+            for query_messages, responses, parsed_responses, prompt_cost, response_cost in query_gpt_evolution_stream(cfg, prev_executable_terrains[terrain_id], prev_eval_strings[terrain_id], terrain_stats, all_prev_terrain_descriptions, num_samples=cfg.evolution_query_sample_multiplier, query_key=query_key):
+                total_prompt_cost += prompt_cost
+                total_response_cost += response_cost
+                for response, parsed_response in zip(responses, parsed_responses):
+                    sample_id = sample_id_start + len(gpt_responses)
+                    gpt_responses.append(response)
+                    success, sample_id = check_response(cfg, parsed_response, it, parallel_run_id, sample_id, terrain_id)
+                    if success:
+                        return terrain_id, parsed_response, sample_id, total_prompt_cost, total_response_cost
+        finally:
+            if gpt_responses:
+                log_gpt_query(query_messages, gpt_responses, save_dir=gpt_queries_dir / f"iter-{it}" / f"run-{parallel_run_id}" / f"terrain-{terrain_id}_query-{query_id}")
 
+@traced("it", "parallel_run_id")
 def evolution_generation(cfg, it, parallel_run_id):
     # Load executable terrains, evaluation strings, and learning progress
     all_prev_executable_terrains = []
@@ -333,91 +563,106 @@ def order_best_runs(cfg, stats_for_selection):
     parallel_run_stats = sorted(parallel_run_stats, key=lambda x: x[1], reverse=True)
     return [x[0] for x in parallel_run_stats]
 
+def get_run_results(it, parallel_run_id, res):
+    """Reads the evaluation stats of a finished parallel run from its log files."""
+    _, train_log_file, eval_pre_training_log_file, eval_post_training_log_file, eval_all_training_log_files, eval_testing_log_file = res
+    run_results = {}
+    if eval_pre_training_log_file is not None:
+        run_results["pre_training"] = get_eval_stats_from_file(eval_pre_training_log_file)
+    if eval_post_training_log_file is not None:
+        run_results["post_training"] = get_eval_stats_from_file(eval_post_training_log_file)
+    if eval_all_training_log_files is not None:
+        summary_stats, stats_per_terrain = {}, {}
+        assert len(eval_all_training_log_files) == num_chunks, f"Expected {num_chunks} all-training chunks, got {len(eval_all_training_log_files)}!"
+        global_terrain_id = 0
+        for i, eval_all_training_log_file in enumerate(eval_all_training_log_files):
+            cur_summary_stats, cur_stats_per_terrain = get_eval_stats_from_file(eval_all_training_log_file)
+            for key in cur_summary_stats.keys():
+                if key not in summary_stats:
+                    summary_stats[key] = 0
+                summary_stats[key] += cur_summary_stats[key]
+            for terrain_id in cur_stats_per_terrain.keys():
+                stats_per_terrain[global_terrain_id] = cur_stats_per_terrain[terrain_id]
+                global_terrain_id += 1
+        for key in summary_stats.keys():
+            summary_stats[key] /= num_chunks
+        weights = all_training_terrain_weights[it][:len(stats_per_terrain)]
+        if any(weight > 1 for weight in weights):
+            # Sampled older terrains stand in for the ones that weren't evaluated, so weigh each terrain instead
+            summary_stats, std_errors = aggregate_terrain_stats([stats_per_terrain[i] for i in range(len(weights))], weights)
+            metric_key = "Number of goals reached"
+            logging.info(f"All-training {metric_key} for run {parallel_run_id}: {summary_stats[metric_key]:.2f} +- {std_errors[metric_key]:.2f} (standard error from sampling older terrains)")
+        run_results["all_training"] = (summary_stats, stats_per_terrain)
+    if eval_testing_log_file is not None:
+        run_results["testing"] = get_eval_stats_from_file(eval_testing_log_file)
+    return run_results
+
+def record_run_results(it, parallel_run_id, run_results):
+    stats_dicts = {
+        "pre_training": (eval_pre_training_stats, eval_pre_training_stats_per_terrain),
+        "post_training": (eval_post_training_stats, eval_post_training_stats_per_terrain),
+        "all_training": (eval_all_training_stats, eval_all_training_stats_per_terrain),
+        "testing": (eval_testing_stats, eval_testing_stats_per_terrain),
+    }
+    for eval_name, (summary_stats, stats_per_terrain) in run_results.items():
+        stats_dicts[eval_name][0].setdefault(it, {})[parallel_run_id] = summary_stats
+        stats_dicts[eval_name][1].setdefault(it, {})[parallel_run_id] = stats_per_terrain
+    completed_runs.add((it, parallel_run_id))
+
+def run_and_record(cfg, it, parallel_run_id):
+    # Record each run as soon as it finishes, so it's kept even if another run fails
+    try:
+        res = parallel_run(cfg, it, parallel_run_id)
+    finally:
+        if run_culler is not None:
+            run_culler.stop(parallel_run_id)
+    run_results = get_run_results(it, parallel_run_id, res) if res is not None else {}
+    run_state.append("run_results", run_results, it=it, parallel_run_id=parallel_run_id)
+    record_run_results(it, parallel_run_id, run_results)
+
 def restore_run(cfg):
-    global run_id, wandb_id, output_dir
-    global parallel_run_lineage, all_executable_terrains, flattened_all_executable_terrains
-    global eval_pre_training_stats, eval_pre_training_stats_per_terrain
-    global eval_post_training_stats, eval_post_training_stats_per_terrain
-    global eval_all_training_stats, eval_all_training_stats_per_terrain
-    global eval_testing_stats, eval_testing_stats_per_terrain
+    """Replays the run state of cfg.resume_run, returns the iteration to continue from.
+    Finished generations, trainings and parallel runs of an unfinished iteration are not repeated."""
+    global run_id, wandb_id, output_dir, run_state, parallel_run_lineage
 
     run_id = cfg.resume_run
     output_dir = Path(f"{output_dir}/../{cfg.resume_run}")
 
     logging.info(f"Resuming experiment {run_id}, make sure you're running with the same config!")
 
-    # Get the correct wandb id to resume
-    wandb_api = wandb.Api()
-    runs = wandb_api.runs(path="upenn-pal/parkour", filters={"display_name": cfg.resume_run})
-    assert len(runs) == 1, f"Expected 1 wandb run, got {len(runs)} called {cfg.resume_run}!"
-    wandb_id = runs[0].id
-
-    # Check output directory for saved pickle files
-    load_it = -1
-    for file in os.listdir(output_dir):
-        match = re.search(r"parallel_run_lineage_it-(\d+)\.pkl", file)
-        if match:
-            load_it = max(int(match.group(1)), load_it)
-    if load_it == -1:
-        logging.error(f"Could not find any successful iteration in log!")
-        return
+    state_file = output_dir / run_state_filename
+    if not state_file.exists():
+        raise FileNotFoundError(f"Could not find run state {state_file} to resume from!")
+    run_state = RunStateStore(state_file)
 
-    # Load previous run globals
-    with open(f"{output_dir}/parallel_run_lineage_it-{load_it}.pkl", "rb") as f:
-        parallel_run_lineage = pickle.load(f)
-    with open(f"{output_dir}/all_executable_terrains_it-{load_it}.pkl", "rb") as f:
-        all_executable_terrains = pickle.load(f)
-    with open(f"{output_dir}/flattened_all_executable_terrains_it-{load_it}.pkl", "rb") as f:
-        flattened_all_executable_terrains = pickle.load(f)
-    with open(f"{output_dir}/eval_pre_training_stats_it-{load_it}.pkl", "rb") as f:
-        eval_pre_training_stats = pickle.load(f)
-    with open(f"{output_dir}/eval_pre_training_stats_per_terrain_it-{load_it}.pkl", "rb") as f:
-        eval_pre_training_stats_per_terrain = pickle.load(f)
-    with open(f"{output_dir}/eval_post_training_stats_it-{load_it}.pkl", "rb") as f:
-        eval_post_training_stats = pickle.load(f)
-    with open(f"{output_dir}/eval_post_training_stats_per_terrain_it-{load_it}.pkl", "rb") as f:
-        eval_post_training_stats_per_terrain = pickle.load(f)
-    with open(f"{output_dir}/eval_all_training_stats_it-{load_it}.pkl", "rb") as f:
-        eval_all_training_stats = pickle.load(f)
-    with open(f"{output_dir}/eval_all_training_stats_per_terrain_it-{load_it}.pkl", "rb") as f:
-        eval_all_training_stats_per_terrain = pickle.load(f)
-    with open(f"{output_dir}/eval_testing_stats_it-{load_it}.pkl", "rb") as f:
-        eval_testing_stats = pickle.load(f)
-    with open(f"{output_dir}/eval_testing_stats_per_terrain_it-{load_it}.pkl", "rb") as f:
-        eval_testing_stats_per_terrain = pickle.load(f)
-    
-    start_it = load_it + 1
+    start_it = 0
+    for kind, it, parallel_run_id, value in run_state.records():
+        if kind == "meta":
+            wandb_id = value["wandb_id"]
+        elif kind == "terrains":
+            start_it = max(start_it, it)
+            if value is None:
+                all_executable_terrains.setdefault(it, {}).pop(parallel_run_id, None)
+            else:
+                all_executable_terrains.setdefault(it, {})[parallel_run_id] = value
+        elif kind == "training":
+            completed_trainings[(it, parallel_run_id)] = Path(value)
+        elif kind == "run_results":
+            record_run_results(it, parallel_run_id, value)
+        elif kind == "selection":
+            # Iteration is done
+            parallel_run_lineage = value
+            start_it = it + 1
+    logging.info(f"Resuming from iteration {start_it}, with {len([run for run in completed_runs if run[0] == start_it])} parallel runs already finished")
     return start_it
 
-def save_run(it):
-    with open(f"{output_dir}/parallel_run_lineage_it-{it}.pkl", "wb") as f:
-        pickle.dump(parallel_run_lineage, f)
-    with open(f"{output_dir}/all_executable_terrains_it-{it}.pkl", "wb") as f:
-        pickle.dump(all_executable_terrains, f)
-    with open(f"{output_dir}/flattened_all_executable_terrains_it-{it}.pkl", "wb") as f:
-        pickle.dump(flattened_all_executable_terrains, f)
-    with open(f"{output_dir}/eval_pre_training_stats_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_pre_training_stats, f)
-    with open(f"{output_dir}/eval_pre_training_stats_per_terrain_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_pre_training_stats_per_terrain, f)
-    with open(f"{output_dir}/eval_post_training_stats_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_post_training_stats, f)
-    with open(f"{output_dir}/eval_post_training_stats_per_terrain_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_post_training_stats_per_terrain, f)
-    with open(f"{output_dir}/eval_all_training_stats_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_all_training_stats, f)
-    with open(f"{output_dir}/eval_all_training_stats_per_terrain_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_all_training_stats_per_terrain, f)
-    with open(f"{output_dir}/eval_testing_stats_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_testing_stats, f)
-    with open(f"{output_dir}/eval_testing_stats_per_terrain_it-{it}.pkl", "wb") as f:
-        pickle.dump(eval_testing_stats_per_terrain, f)
-
 @hydra.main(config_path="config", config_name="config", version_base=None)
 def main(cfg):
     global run_id, wandb_id, output_dir, gpt_queries_dir, check_execution_dir, renders_dir
+    global eval_server_pool, eval_result_cache, run_state, gpu_scheduler, run_culler, num_gpus
 
     assert sum(cfg.best_run_proportions) == 1, "Best run proportions must sum to 1!"
+    num_gpus = cfg.dry_run_gpus if cfg.dry_run else get_num_gpus()
 
     working_dir = Path(hydra.utils.get_original_cwd())
     output_dir = Path(os.getcwd())
@@ -427,11 +672,35 @@ def main(cfg):
         start_it = restore_run(cfg)
         with open("resumed_run.txt", "w") as f:
             f.write(run_id)
+    else:
+        run_state = RunStateStore(output_dir / run_state_filename)
+    if cfg.dry_run:
+        use_dry_run_backends(cfg)
 
     gpt_queries_dir = Path(f"{output_dir}/gpt_queries")
     check_execution_dir = Path(f"{output_dir}/check_execution")
     renders_dir = Path(f"{output_dir}/train_renders")
     prepare_prompts(cfg)
+    if cfg.trace_file != "":
+        # View in Perfetto or chrome://tracing
+        start_tracing(output_dir / cfg.trace_file)
+    if cfg.gpt_cache_file != "":
+        # Each run has its own cache, which resumed runs reuse, so repeated queries cost no tokens
+        open_response_cache(output_dir / cfg.gpt_cache_file)
+    if cfg.check_in_pool:
+        # Fork check workers before any other threads are started
+        start_check_pool(cfg.num_parallel_checks, get_task_terrain_cfg(cfg.quadruped_model), cpu_time_limit=cfg.check_cpu_time_limit, memory_limit=cfg.check_memory_limit)
+    if cfg.eval_cache_file != "":
+        eval_result_cache = EvalResultCache(output_dir / cfg.eval_cache_file)
+    if not cfg.deterministic_gpu:
+        if cfg.dry_run:
+            devices = FakeDevices(num_gpus, total_memory=24000)
+        else:
+            devices = NvmlDevices() if cfg.gpu_memory_source == "nvml" else GpustatDevices()
+        gpu_scheduler = GpuScheduler(devices, job_memory=dict(cfg.gpu_job_memory))
+    if cfg.eval_server:
+        # Servers are started on first use
+        eval_server_pool = EvalServerPool(functools.partial(start_eval_server, cfg), servers_per_device=cfg.eval_servers_per_gpu)
 
     logging.info(f"Working directory: {working_dir}")
     logging.info(f"Output directory: {output_dir}")
@@ -463,26 +732,26 @@ def main(cfg):
             wandb.finish(quiet=True)  # Will resume at the end
     else:
         logging.info("Wandb is disabled!")
+    if cfg.resume_run == "":
+        run_state.append("meta", {"run_id": run_id, "wandb_id": wandb_id})
 
     logging.info("Starting iterations...")
     for it in range(start_it, cfg.iterations):
         logging.info("="*10 + f" ITERATION {it:02} " + "="*10)
 
-        all_executable_terrains[it] = {}
-        eval_pre_training_stats[it] = {}
-        eval_pre_training_stats_per_terrain[it] = {}
-        eval_post_training_stats[it] = {}
-        eval_post_training_stats_per_terrain[it] = {}
-        eval_all_training_stats[it] = {}
-        eval_all_training_stats_per_terrain[it] = {}
-        eval_testing_stats[it] = {}
-        eval_testing_stats_per_terrain[it] = {}
+        # Keep anything restored from an unfinished iteration
+        for stats_dict in [all_executable_terrains, eval_pre_training_stats, eval_pre_training_stats_per_terrain, eval_post_training_stats, eval_post_training_stats_per_terrain,
+                           eval_all_training_stats, eval_all_training_stats_per_terrain, eval_testing_stats, eval_testing_stats_per_terrain]:
+            stats_dict.setdefault(it, {})
         if it == 0:
             for parallel_run_id in range(cfg.num_parallel_runs):
                 parallel_run_lineage[parallel_run_id] = []
 
         # Generate terrains in parallel
         for parallel_run_id in range(cfg.num_parallel_runs):
+            if parallel_run_id in all_executable_terrains[it] or (it, parallel_run_id) in completed_runs:
+                logging.info(f"Skipping generation for parallel run {parallel_run_id}, already done before resuming")
+                continue
             logging.info(f"> Starting generation for parallel run {parallel_run_id}...")
             if it == 0:
                 res = initial_generation(cfg, parallel_run_id)
@@ -494,49 +763,22 @@ def main(cfg):
 
             executable_terrains, total_prompt_cost, total_response_cost = res
             all_executable_terrains[it][parallel_run_id] = executable_terrains
+            run_state.append("terrains", executable_terrains, it=it, parallel_run_id=parallel_run_id)
             logging.info(f"Generated {len(executable_terrains)} executable terrains for parallel run {parallel_run_id} (costs ${total_prompt_cost:.2f} prompt, ${total_response_cost:.2f} response)")
 
         # Start parallel runs, each serially running training and evaluation
-        setup_training_all_terrains(it)
+        setup_training_all_terrains(cfg, it)
+        if len(cfg.cull_rungs) > 0:
+            # Keep enough runs to select the best ones from
+            run_culler = SuccessiveHalving(cfg.cull_rungs, cfg.cull_keep_fraction, min_keep=len(cfg.best_run_proportions))
         with ThreadPoolExecutor(max_workers=cfg.num_parallel_runs) as executor:
             futures = []
             for parallel_run_id in range(cfg.num_parallel_runs):
-                futures.append(executor.submit(parallel_run, cfg, it, parallel_run_id))
-            for future in as_completed(futures):
-                res = future.result()
-                if res is None:
+                if (it, parallel_run_id) in completed_runs:
                     continue
-
-                parallel_run_id, train_log_file, eval_pre_training_log_file, eval_post_training_log_file, eval_all_training_log_files, eval_testing_log_file = future.result()
-                if eval_pre_training_log_file is not None:
-                    summary_stats, stats_per_terrain = get_eval_stats_from_file(eval_pre_training_log_file)
-                    eval_pre_training_stats[it][parallel_run_id] = summary_stats
-                    eval_pre_training_stats_per_terrain[it][parallel_run_id] = stats_per_terrain
-                if eval_post_training_log_file is not None:
-                    summary_stats, stats_per_terrain = get_eval_stats_from_file(eval_post_training_log_file)
-                    eval_post_training_stats[it][parallel_run_id] = summary_stats
-                    eval_post_training_stats_per_terrain[it][parallel_run_id] = stats_per_terrain
-                if eval_all_training_log_files is not None:
-                    summary_stats, stats_per_terrain = {}, {}
-                    assert len(eval_all_training_log_files) == num_chunks, f"Expected {num_chunks} all-training chunks, got {len(eval_all_training_log_files)}!"
-                    global_terrain_id = 0
-                    for i, eval_all_training_log_file in enumerate(eval_all_training_log_files):
-                        cur_summary_stats, cur_stats_per_terrain = get_eval_stats_from_file(eval_all_training_log_file)
-                        for key in cur_summary_stats.keys():
-                            if key not in summary_stats:
-                                summary_stats[key] = 0
-                            summary_stats[key] += cur_summary_stats[key]
-                        for terrain_id in cur_stats_per_terrain.keys():
-                            stats_per_terrain[global_terrain_id] = cur_stats_per_terrain[terrain_id]
-                            global_terrain_id += 1
-                    for key in summary_stats.keys():
-                        summary_stats[key] /= num_chunks
-                    eval_all_training_stats[it][parallel_run_id] = summary_stats
-                    eval_all_training_stats_per_terrain[it][parallel_run_id] = stats_per_terrain
-                if eval_testing_log_file is not None:
-                    summary_stats, stats_per_terrain = get_eval_stats_from_file(eval_testing_log_file)
-                    eval_testing_stats[it][parallel_run_id] = summary_stats
-                    eval_testing_stats_per_terrain[it][parallel_run_id] = stats_per_terrain
+                futures.append(executor.submit(run_and_record, cfg, it, parallel_run_id))
+            for future in as_completed(futures):
+                future.result()
 
         # Choose best run
         best_previous_run_ids = order_best_runs(cfg, eval_all_training_stats[it])
@@ -572,8 +814,8 @@ def main(cfg):
         for parallel_run_id in range(cfg.num_parallel_runs):
             parallel_run_lineage[parallel_run_id] = new_parallel_run_lineage[parallel_run_id]
         
-        # Save run
-        save_run(it)
+        # Finish the iteration
+        run_state.append("selection", parallel_run_lineage, it=it)
 
         if cfg.wandb:
             # Update each parallel run's wandb with evaluation stats
@@ -625,6 +867,15 @@ def main(cfg):
                 wandb.log(log, step=step)
         wandb.finish(quiet=True)
 
+    stop_check_pool()
+    stop_tracing()
+    if fake_openai_server is not None:
+        fake_openai_server.shutdown()
+    if eval_server_pool is not None:
+        eval_server_pool.shutdown()
+        for process in eval_server_processes:
+            process.communicate()
+
     if cfg.resume_run != "":
         cur_output_dir = Path(os.getcwd())
         cur_run_id = cur_output_dir.name
@@ -0,0 +1,13 @@
+import argparse
+
+from eurekaverse.utils.dry_run_utils import fake_evaluate
+
+if __name__ == "__main__":
+    # Stands in for legged_gym/scripts/evaluate.py in dry runs, ignoring the arguments it doesn't need
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exptid", type=str)
+    parser.add_argument("--terrain_type", type=str)
+    parser.add_argument("--results_file", type=str)
+    args, _ = parser.parse_known_args()
+
+    fake_evaluate(args.exptid, args.terrain_type, args.results_file)
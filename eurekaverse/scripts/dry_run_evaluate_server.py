@@ -0,0 +1,12 @@
+import argparse
+
+from legged_gym.eval.eval_server import EvalServer
+from eurekaverse.utils.dry_run_utils import DryRunEvalBackend
+
+if __name__ == "__main__":
+    # Stands in for legged_gym/scripts/evaluate_server.py in dry runs, ignoring the arguments it doesn't need
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=0)
+    args, _ = parser.parse_known_args()
+
+    EvalServer(DryRunEvalBackend(), port=args.port).serve_forever()
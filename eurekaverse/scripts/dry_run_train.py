@@ -0,0 +1,18 @@
+import argparse
+
+from eurekaverse.utils.dry_run_utils import fake_check_terrain, fake_train
+
+if __name__ == "__main__":
+    # Stands in for legged_gym/scripts/train.py in dry runs, ignoring the arguments it doesn't need
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exptid", type=str)
+    parser.add_argument("--max_iterations", type=int)
+    parser.add_argument("--terrain_type", type=str)
+    parser.add_argument("--load_run", type=str, default="walk_pretrain")
+    parser.add_argument("--check_terrain_feasibility", action="store_true", default=False)
+    args, _ = parser.parse_known_args()
+
+    if args.check_terrain_feasibility:
+        fake_check_terrain(args.terrain_type)
+    else:
+        fake_train(args.exptid, args.max_iterations, args.load_run)
@@ -24,12 +24,26 @@ def evaluate_model(exptid, ckpt_iter, terrain_type="benchmark"):
     if stderr:
         print(stderr)
 
+def evaluate_models(exptid, ckpt_iters, terrain_type="benchmark"):
+    # One sim for all checkpoints, each evaluated on its own share of the envs
+    print(f"Evaluating {exptid} at checkpoints {ckpt_iters}...")
+    policies = " ".join(f"{exptid}:{ckpt_iter}" for ckpt_iter in ckpt_iters)
+    evaluate_command = f"python3 -u {eval_script} --max_steps 10000 --policies {policies} --device {get_freest_gpu()} --headless --terrain_type {terrain_type}"
+    process = subprocess.Popen(
+        evaluate_command.split(" "),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env={**os.environ.copy(), "TQDM_DISABLE": "1"}
+    )
+    stdout, stderr = process.communicate()
+    if stderr:
+        print(stderr)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--exptid", type=str, required=True)
     parser.add_argument("--ckpt_interval", type=int, default=1000)
     parser.add_argument("--max_workers", type=int, default=1)
     parser.add_argument("--terrain_type", type=str, default="benchmark")
+    parser.add_argument("--single_process", action="store_true", help="Evaluate all checkpoints in one process, splitting the envs between them")
     args = parser.parse_args()
 
     load_dir = f"{LEGGED_GYM_ROOT_DIR}/logs/parkour/{args.exptid}"
@@ -42,6 +56,9 @@ if __name__ == '__main__':
     ckpt_iters = sorted(ckpt_iters)
     
     summary_dicts = {}
+    if args.single_process:
+        evaluate_models(args.exptid, ckpt_iters, args.terrain_type)
+        exit()
     with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
         futures = []
         for i, ckpt_iter in enumerate(ckpt_iters):
@@ -0,0 +1,122 @@
+import json
+import time
+from types import SimpleNamespace
+
+import eurekaverse.utils.gpt_utils as gpt_utils
+from eurekaverse.utils.dry_run_utils import FakeOpenAIServer
+from eurekaverse.utils.misc_utils import start_tracing, stop_tracing, trace
+
+def make_cfg(**kwargs):
+    cfg = dict(gpt_model="gpt-4o-2024-05-13", gpt_samples_per_request=1, gpt_max_concurrent_requests=16,
+               gpt_tokens_per_minute=800000, gpt_estimated_response_tokens=2000, gpt_max_attempts=5)
+    return SimpleNamespace(**{**cfg, **kwargs})
+
+def setup_client(monkeypatch, server, cfg):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    # No jitter, so retries only wait as long as the rate limit headers ask for
+    monkeypatch.setattr(gpt_utils.random, "uniform", lambda low, high: low)
+    gpt_utils.prepare_prompts(cfg)
+
+def test_retry_rate_limits(monkeypatch):
+    server = FakeOpenAIServer(errors=[429, 500, 429])
+    cfg = make_cfg()
+    setup_client(monkeypatch, server, cfg)
+    start = time.time()
+    responses, prompt_cost, _ = gpt_utils.query_gpt_request(cfg, dict(model=cfg.gpt_model, messages=[{"role": "user", "content": "Terrain"}], n=2))
+    assert len(responses) == 2 and prompt_cost > 0
+    assert server.num_requests == 4
+    # Both rate limit errors paused requests for the 50ms given in the headers
+    assert time.time() - start >= 0.1
+    assert gpt_utils.rate_limiter.paused_until > 0
+
+def test_no_retry_client_errors(monkeypatch):
+    for error in [400, 401, 404]:
+        server = FakeOpenAIServer(errors=[error])
+        cfg = make_cfg()
+        setup_client(monkeypatch, server, cfg)
+        responses, _, _ = gpt_utils.query_gpt_request(cfg, dict(model=cfg.gpt_model, messages=[{"role": "user", "content": "Terrain"}], n=1))
+        assert responses is None
+        assert server.num_requests == 1
+
+def test_rate_limiter_concurrency(monkeypatch):
+    server = FakeOpenAIServer(latency=0.2, errors=[429])
+    cfg = make_cfg(gpt_samples_per_request=2, gpt_max_concurrent_requests=2)
+    setup_client(monkeypatch, server, cfg)
+    samples = []
+    for _, responses, parsed_responses, _, _ in gpt_utils.query_gpt_stream(cfg, [{"role": "user", "content": "Terrain"}], num_samples=9):
+        assert len(responses) == len(parsed_responses) <= 2
+        samples.extend(parsed_responses)
+    assert len(samples) == 9
+    assert server.num_requests == 6
+    assert server.max_in_flight == 2
+
+def test_trace_args_in_request_threads(monkeypatch, tmp_path):
+    server = FakeOpenAIServer()
+    cfg = make_cfg()
+    setup_client(monkeypatch, server, cfg)
+    start_tracing(tmp_path / "trace.json")
+    try:
+        with trace("generation", it=1, parallel_run_id=2):
+            list(gpt_utils.query_gpt_stream(cfg, [{"role": "user", "content": "Terrain"}], num_samples=3))
+    finally:
+        stop_tracing()
+    events = [json.loads(line.rstrip(",\n")) for line in (tmp_path / "trace.json").read_text().splitlines()[1:]]
+    request_spans = [event for event in events if event["name"] == "query_gpt_request"]
+    assert len(request_spans) == 3
+    for span in request_spans:
+        assert span["args"]["it"] == 1 and span["args"]["parallel_run_id"] == 2 and span["args"]["samples"] == 1
+
+def test_get_retry_delay():
+    assert gpt_utils.parse_duration("20ms") == 0.02
+    assert gpt_utils.parse_duration("6m0s") == 360
+    assert gpt_utils.parse_duration("1.5") == 1.5
+    assert 0 <= gpt_utils.get_retry_delay(ValueError(), attempt=3) <= 8
+    assert gpt_utils.get_retry_delay(ValueError(), attempt=20) <= 60
+
+def test_response_cache(monkeypatch, tmp_path):
+    server = FakeOpenAIServer()
+    cfg = make_cfg(gpt_samples_per_request=2)
+    setup_client(monkeypatch, server, cfg)
+    monkeypatch.setattr(gpt_utils, "response_cache", None)
+    messages = [{"role": "user", "content": "Terrain"}]
+    query_key = dict(it=1, parallel_run_id=0, terrain_id=2, query_id=0)
+    gpt_utils.open_response_cache(tmp_path / "gpt_cache.sqlite")
+    responses = sorted(gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key=query_key)[1])
+    assert server.num_requests == 2
+
+    # Hits for the same query, misses for another query or without a key
+    assert sorted(gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key=query_key)[1]) == responses
+    assert server.num_requests == 2
+    gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key={**query_key, "query_id": 1})
+    assert server.num_requests == 4
+    gpt_utils.query_gpt(cfg, messages, num_samples=3)
+    assert server.num_requests == 6
+
+    # A resumed run reopens the cache and makes its queries in another order, with other request sizes
+    gpt_utils.open_response_cache(tmp_path / "gpt_cache.sqlite")
+    cfg.gpt_samples_per_request = 1
+    gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key={**query_key, "query_id": 1})
+    assert sorted(gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key=query_key)[1]) == responses
+    assert server.num_requests == 6
+
+def test_replay_run(monkeypatch, tmp_path):
+    server = FakeOpenAIServer()
+    cfg = make_cfg(gpt_samples_per_request=2)
+    setup_client(monkeypatch, server, cfg)
+    monkeypatch.setattr(gpt_utils, "response_cache", None)
+    messages = [{"role": "user", "content": "Terrain"}]
+    gpt_queries_dir = tmp_path / "gpt_queries"
+    gpt_utils.log_gpt_query(messages, ["Initial 0", "Initial 1", "Initial 2"], gpt_queries_dir / "iter-0" / "run-1" / "query-0")
+    gpt_utils.log_gpt_query(messages, ["Evolved 0", "Evolved 1"], gpt_queries_dir / "iter-2" / "run-1" / "terrain-3_query-1")
+    monkeypatch.setattr(gpt_utils, "replay_run", str(gpt_queries_dir))
+    monkeypatch.setattr(gpt_utils, "replay_cache", None)
+
+    responses = gpt_utils.query_gpt(cfg, messages, num_samples=3, query_key=dict(it=0, parallel_run_id=1, terrain_id=-1, query_id=0))[1]
+    assert sorted(responses) == ["Initial 0", "Initial 1", "Initial 2"]
+    responses = gpt_utils.query_gpt(cfg, messages, num_samples=2, query_key=dict(it=2, parallel_run_id=1, terrain_id=3, query_id=1))[1]
+    assert sorted(responses) == ["Evolved 0", "Evolved 1"]
+    assert server.num_requests == 0
+    # Queries the replayed run didn't make are sent to the API
+    gpt_utils.query_gpt(cfg, messages, num_samples=2, query_key=dict(it=2, parallel_run_id=1, terrain_id=3, query_id=2))
+    assert server.num_requests == 1
@@ -0,0 +1,128 @@
+import sys
+import subprocess
+import threading
+from concurrent import futures
+
+from eurekaverse.utils.misc_utils import FakeDevices, GpuScheduler, SuccessiveHalving, WatchedProcess, run_subprocess, wait_subprocess
+
+def python_command(code):
+    return [sys.executable, "-u", "-c", code]
+
+def test_watched_process(tmp_path):
+    for log_file in [tmp_path / "process.log", None]:
+        if log_file is not None:
+            log_file.write_text("Line from an earlier process\n")
+        process = WatchedProcess(python_command("import sys; print('first'); sys.stdin.readline(); print('second')"), log_file=log_file, stdin=subprocess.PIPE)
+        assert process.watch("first").result(timeout=10) == "first\n"
+        # Lines that were already read resolve at once, lines still to come once they are printed
+        assert process.watch("first").done()
+        second = process.watch("second")
+        assert not second.done() and not process.exited.done()
+        assert not process.watch("earlier process").done()
+
+        process.stdin.write(b"\n")
+        process.stdin.close()
+        assert second.result(timeout=10) == "second\n"
+        assert process.exited.result(timeout=10) == 0
+        assert not process.watch("never printed").done()
+        if log_file is not None:
+            assert log_file.read_text() == "Line from an earlier process\nfirst\nsecond\n"
+        else:
+            assert process.output == ["first\n", "second\n"]
+
+def test_wait_subprocess(tmp_path):
+    log_file = tmp_path / "process.log"
+    args = dict(log_file=log_file, success_log="Done", failure_log="Traceback")
+    process = run_subprocess(f"{sys.executable} -u -c print('Done')", log_file)
+    assert wait_subprocess(process, **args) == (True, False)
+    process = run_subprocess(f"{sys.executable} -u -c raise(ValueError)", log_file)
+    assert wait_subprocess(process, **args) == (False, False)
+    process = run_subprocess(f"{sys.executable} -u -c exit(1)", log_file)
+    assert wait_subprocess(process, **args) == (False, False)
+    process = run_subprocess(f"{sys.executable} -u -c __import__('time').sleep(60)", log_file)
+    assert wait_subprocess(process, timeout=0.5, **args) == (False, True)
+    process.kill()
+    assert process.exited.result(timeout=10) != 0
+
+def test_watched_process_wait_timeout():
+    # The shell exits at once, but its background child keeps the output pipe open
+    process = WatchedProcess(["sh", "-c", "sleep 2 & echo started"])
+    try:
+        process.wait(timeout=0.5)
+        assert False, "Expected the wait to time out"
+    except subprocess.TimeoutExpired:
+        pass
+    assert not process.exited.done()
+    assert process.wait(timeout=10) == 0
+    assert process.exited.result(timeout=1) == 0
+
+def make_gpu_scheduler(num_gpus=2):
+    return GpuScheduler(FakeDevices(num_gpus, total_memory=10000), job_memory={"train": 6000, "check": 2000, "huge": 20000}, refresh_interval=0.1)
+
+def test_gpu_scheduler_spreads_jobs():
+    scheduler = make_gpu_scheduler(num_gpus=3)
+    # Jobs that start together go to different GPUs, before any memory usage shows up
+    devices = [scheduler.acquire("train") for _ in range(3)]
+    assert sorted(devices) == ["cuda:0", "cuda:1", "cuda:2"]
+    # Smaller jobs still fit next to them
+    assert scheduler.acquire("check") in devices
+    # Memory used by other processes beyond our reservations counts too
+    scheduler.devices.memory["cuda:1"][0] = 9000
+    scheduler.memory = None
+    assert scheduler.acquire("check") != "cuda:1"
+
+def test_gpu_scheduler_blocks_until_release():
+    scheduler = make_gpu_scheduler(num_gpus=1)
+    device = scheduler.acquire("train")
+    waiting = futures.ThreadPoolExecutor(1).submit(scheduler.acquire, "train")
+    try:
+        waiting.result(timeout=0.5)
+        assert False, "Acquired a GPU without room for the job"
+    except futures.TimeoutError:
+        pass
+    scheduler.release(device, "train")
+    assert waiting.result(timeout=10) == device
+    assert scheduler.reserved[device] == 6000
+
+def test_gpu_scheduler_release_on_exit():
+    scheduler = make_gpu_scheduler(num_gpus=1)
+    device = scheduler.acquire("train")
+    process = WatchedProcess(python_command("import sys; sys.stdin.readline()"), stdin=subprocess.PIPE)
+    scheduler.release_on_exit(process, device, "train")
+    assert scheduler.reserved[device] == 6000
+    released = threading.Event()
+    threading.Thread(target=lambda: (scheduler.acquire("train"), released.set()), daemon=True).start()
+    assert not released.wait(timeout=0.5)
+    process.stdin.write(b"\n")
+    process.stdin.close()
+    assert released.wait(timeout=10)
+
+def test_gpu_scheduler_job_too_large():
+    scheduler = make_gpu_scheduler()
+    try:
+        scheduler.acquire("huge")
+        assert False, "Acquired a GPU for a job larger than any GPU"
+    except ValueError:
+        pass
+
+def test_successive_halving():
+    culler = SuccessiveHalving([10, 20], keep_fraction=0.25, min_keep=2)
+    executor = futures.ThreadPoolExecutor(4)
+    for run_id in range(4):
+        culler.start(run_id)
+    # Reports block until every started run has reported or stopped
+    rung_10 = {run_id: executor.submit(culler.report, run_id, 10, score) for run_id, score in [(0, 1.0), (1, 3.0), (2, 2.0)]}
+    assert not futures.wait(rung_10.values(), timeout=0.5).done
+    culler.stop(3)
+    # A quarter of the runs would be one, but at least min_keep continue
+    assert {run_id: future.result(timeout=10) for run_id, future in rung_10.items()} == {0: False, 1: True, 2: True}
+
+    # Late starters are compared against the worst run kept at the rung
+    for run_id, score, keep in [(4, 2.5, True), (5, 1.5, False)]:
+        culler.start(run_id)
+        assert culler.report(run_id, 10, score) == keep
+
+    rung_20 = {run_id: executor.submit(culler.report, run_id, 20, score) for run_id, score in [(1, 5.0), (4, 6.0)]}
+    assert not futures.wait(rung_20.values(), timeout=0.5).done
+    culler.stop(2)
+    assert {run_id: future.result(timeout=10) for run_id, future in rung_20.items()} == {1: True, 4: True}
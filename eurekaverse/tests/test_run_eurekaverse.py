@@ -0,0 +1,108 @@
+import os
+import copy
+from pathlib import Path
+from omegaconf import OmegaConf
+
+import eurekaverse.run_eurekaverse as run_eurekaverse
+import eurekaverse.utils.terrain_utils as terrain_utils
+from eurekaverse.utils.state_utils import RunStateStore
+from legged_gym import LEGGED_GYM_ROOT_DIR
+
+config_file = Path(__file__).parent.parent / "config" / "config.yaml"
+
+# State that the old save_run() pickled after each iteration, and restore_run() rebuilds from the records
+saved_state = ["parallel_run_lineage", "all_executable_terrains",
+               "eval_pre_training_stats", "eval_pre_training_stats_per_terrain", "eval_post_training_stats", "eval_post_training_stats_per_terrain",
+               "eval_all_training_stats", "eval_all_training_stats_per_terrain", "eval_testing_stats", "eval_testing_stats_per_terrain"]
+
+def reset_run_state(monkeypatch):
+    for name in saved_state + ["completed_trainings", "flattened_all_executable_terrains", "all_training_terrain_weights"]:
+        monkeypatch.setattr(run_eurekaverse, name, {})
+    monkeypatch.setattr(run_eurekaverse, "completed_runs", set())
+
+def dry_run(output_dir, monkeypatch, *dotlist):
+    """Runs the whole loop with the fake backends, with output_dir as the run's output directory"""
+    cfg = OmegaConf.merge(OmegaConf.load(config_file), OmegaConf.from_dotlist([
+        "dry_run=True", "iterations=2", "num_terrain_types=2", "num_parallel_runs=2", "num_parallel_checks=4", "train_iterations=20",
+        "dry_run_gpt_latency=0", "dry_run_train_time=0.1", "dry_run_eval_time=0.05", "dry_run_check_time=0.01", *dotlist,
+    ]))
+    # Dry runs point these elsewhere, restore them for the other tests
+    for name in ["OPENAI_BASE_URL", "OPENAI_API_KEY", "DRY_RUN_DIR"] + [f"DRY_RUN_{name.upper()}" for name in ["train_time", "eval_time", "check_time", "check_failure_rate"]]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(terrain_utils, "terrain_file_dir", terrain_utils.terrain_file_dir)
+    for name in ["train_script", "eval_script", "eval_server_script", "logs_dir"]:
+        monkeypatch.setattr(run_eurekaverse, name, getattr(run_eurekaverse, name))
+    reset_run_state(monkeypatch)
+    # Hydra would make the run's output directory the working directory
+    os.makedirs(output_dir, exist_ok=True)
+    monkeypatch.chdir(output_dir)
+    monkeypatch.setattr(run_eurekaverse.hydra.utils, "get_original_cwd", os.getcwd)
+    run_eurekaverse.main.__wrapped__(cfg)
+    return cfg
+
+def test_dry_run(tmp_path, monkeypatch):
+    """Runs two iterations in a temporary output directory"""
+    cfg = dry_run(tmp_path, monkeypatch)
+
+    records = RunStateStore(tmp_path / run_eurekaverse.run_state_filename).records()
+    assert records[0][0] == "meta"
+    for it in range(2):
+        for kind in ["terrains", "training", "run_results"]:
+            assert sorted(record[2] for record in records if record[:2] == (kind, it)) == [0, 1], (kind, it)
+        assert len([record for record in records if record[:2] == ("selection", it)]) == 1
+        for record in records:
+            if record[:2] == ("terrains", it):
+                assert len(record[3]) == cfg.num_terrain_types
+            if record[:2] == ("run_results", it):
+                assert sorted(record[3].keys()) == ["all_training", "post_training", "pre_training", "testing"]
+                assert "Number of goals reached" in record[3]["testing"][0]
+        assert sorted(run_eurekaverse.eval_all_training_stats[it].keys()) == [0, 1]
+        for parallel_run_id in range(2):
+            assert (tmp_path / f"eval_iter-{it}_run-{parallel_run_id}_testing.json").exists()
+
+    # Terrains and fake checkpoints stay in the run's output directory
+    for it in range(2):
+        for parallel_run_id in range(2):
+            assert list((tmp_path / "dry_run" / "logs" / f"{tmp_path.name}_{it}_{parallel_run_id}").glob("model_*.pt"))
+            assert (tmp_path / "dry_run" / "set_terrains" / f"set_terrain_it-{it}_run-{parallel_run_id}.py").exists()
+            assert not Path(f"{LEGGED_GYM_ROOT_DIR}/legged_gym/utils/set_terrains/set_terrain_it-{it}_run-{parallel_run_id}.py").exists()
+    assert not Path(f"{LEGGED_GYM_ROOT_DIR}/logs/parkour/{tmp_path.name}_0_0").exists()
+
+def test_restore_run(tmp_path, monkeypatch):
+    """Replaying the records of a finished run rebuilds the state the old save_run() saved after the last iteration"""
+    cfg = dry_run(tmp_path / "run", monkeypatch)
+    saved = {name: copy.deepcopy(getattr(run_eurekaverse, name)) for name in saved_state}
+
+    reset_run_state(monkeypatch)
+    (tmp_path / "resumed").mkdir()
+    monkeypatch.setattr(run_eurekaverse, "output_dir", tmp_path / "resumed")
+    cfg.resume_run = "run"
+    assert run_eurekaverse.restore_run(cfg) == cfg.iterations
+    run_eurekaverse.run_state.close()
+    for name in saved_state:
+        assert getattr(run_eurekaverse, name) == saved[name], name
+    assert sorted(run_eurekaverse.completed_runs) == [(it, parallel_run_id) for it in range(2) for parallel_run_id in range(2)]
+    assert sorted(run_eurekaverse.completed_trainings.keys()) == sorted(run_eurekaverse.completed_runs)
+
+def test_resume_partial_iteration(tmp_path, monkeypatch):
+    """Resuming an iteration that stopped after generating its terrains and training one run only trains and evaluates what's missing"""
+    dry_run(tmp_path / "run", monkeypatch)
+
+    # Keep the first iteration, and only the terrains and one training of the second
+    state_file = tmp_path / "run" / run_eurekaverse.run_state_filename
+    records = RunStateStore(state_file).records()
+    kept = [record for record in records if record[1] in [None, 0] or record[0] == "terrains" or record[:3] == ("training", 1, 0)]
+    os.remove(state_file)
+    run_state = RunStateStore(state_file)
+    for kind, it, parallel_run_id, value in kept:
+        run_state.append(kind, value, it=it, parallel_run_id=parallel_run_id)
+    run_state.close()
+
+    (tmp_path / "resumed").mkdir()
+    (tmp_path / "resumed" / "run_eurekaverse.log").touch()
+    dry_run(tmp_path / "resumed", monkeypatch, "resume_run=run")
+    assert run_eurekaverse.fake_openai_server.num_requests == 0
+
+    new_records = RunStateStore(state_file).records()[len(kept):]
+    assert sorted(record[:3] for record in new_records) == [("run_results", 1, 0), ("run_results", 1, 1), ("selection", 1, None), ("training", 1, 1)]
+    assert sorted(run_eurekaverse.eval_testing_stats[1].keys()) == [0, 1]
@@ -0,0 +1,100 @@
+import os
+import copy
+import itertools
+import numpy as np
+
+import eurekaverse.utils.terrain_utils as terrain_utils
+from eurekaverse.utils.terrain_utils import set_terrain, start_check_pool, stop_check_pool, check_terrain_in_pool, aggregate_terrain_stats, EvalResultCache
+from legged_gym.envs.base.legged_robot_config import LeggedRobotCfg
+from legged_gym.utils.terrain_gpt import Terrain
+
+def test_check_pool_limits():
+    start_check_pool(1, LeggedRobotCfg().terrain, cpu_time_limit=1, memory_limit=0.5)
+    try:
+        success, error = check_terrain_in_pool("while True:\n    pass\n", timeout=30)
+        assert not success and "CPU time limit" in error
+        success, error = check_terrain_in_pool("memory = bytearray(int(2e9))\n", timeout=30)
+        assert not success and "MemoryError" in error
+        success, error = check_terrain_in_pool("import time\ntime.sleep(60)\n", timeout=2)
+        assert not success and "timed out" in error
+        # The blocked worker was replaced, so the pool still has a worker for the next check
+        success, error = check_terrain_in_pool("raise ValueError('Broken terrain')\n", timeout=30)
+        assert not success and "Broken terrain" in error
+    finally:
+        stop_check_pool()
+
+def test_check_pool_matches_terrain_check():
+    """The pool must agree with the old check, which built the terrain in train.py with check_feasibility"""
+    terrain_cfg = LeggedRobotCfg().terrain
+    terrain_cfg.num_rows, terrain_cfg.num_cols = 3, 2
+    with open(os.path.join(os.path.dirname(terrain_utils.__file__), "../gpt/terrain_example_initial.py")) as f:
+        valid_terrain = f.read()
+    flat_terrain = "import numpy as np\ndef set_terrain(length, width, field_resolution, difficulty):\n    goals = np.stack([np.linspace(2, length - 1, 8), np.full(8, width / 2)], axis=1)\n    return np.zeros((round(length / field_resolution), round(width / field_resolution))), goals\n"
+
+    start_check_pool(1, terrain_cfg)
+    try:
+        for terrain_code, feasible in [(valid_terrain, True), (flat_terrain, False)]:
+            success, error = check_terrain_in_pool(terrain_code, timeout=60)
+            assert success == feasible, error
+
+            set_terrain("set_terrain_test-check", terrain_code)
+            cfg = copy.deepcopy(terrain_cfg)
+            cfg.type = "test-check"
+            cfg.check_feasibility = True
+            try:
+                Terrain(cfg, 1)
+                assert feasible, "Infeasible terrain passed the old check"
+            except AssertionError as e:
+                assert not feasible, str(e)
+    finally:
+        stop_check_pool()
+        os.remove(terrain_utils.terrain_file_dir / "set_terrain_test-check.py")
+
+def test_aggregate_terrain_stats():
+    stats = [{"Reward": 1.0, "Goals": 2.0}, {"Reward": 3.0, "Goals": None}, {"Reward": 5.0, "Goals": 4.0}]
+    summary, std_errors = aggregate_terrain_stats(stats, [1, 1, 1])
+    assert summary == {"Reward": 3.0, "Goals": 3.0}
+    assert std_errors == {"Reward": 0.0, "Goals": 0.0}
+    # The last two terrains stand for 3 terrains each
+    summary, _ = aggregate_terrain_stats(stats, [1, 3, 3])
+    assert np.isclose(summary["Reward"], (1 + 3 * 3 + 3 * 5) / 7)
+    assert np.isclose(summary["Goals"], (2 + 3 * 4) / 4)
+
+def test_aggregate_terrain_stats_std_error():
+    """Over every possible sample of older terrains, the squared standard error must average to the variance of the mean"""
+    rng = np.random.RandomState(0)
+    recent_values = list(rng.uniform(0, 8, size=4))
+    older_values = list(rng.uniform(0, 8, size=10))
+    num_sampled = 3
+    weight = len(older_values) / num_sampled
+    means, variances = [], []
+    for sampled in itertools.combinations(older_values, num_sampled):
+        stats = [{"Goals": value} for value in recent_values + list(sampled)]
+        summary, std_errors = aggregate_terrain_stats(stats, [1] * len(recent_values) + [weight] * num_sampled)
+        means.append(summary["Goals"])
+        variances.append(std_errors["Goals"] ** 2)
+    # Sampling is unbiased, and so is the variance estimate of sampling without replacement
+    assert np.isclose(np.mean(means), np.mean(recent_values + older_values))
+    assert np.isclose(np.mean(variances), np.var(means))
+
+def test_eval_result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(terrain_utils, "terrain_file_dir", tmp_path)
+    checkpoint_file = tmp_path / "model_100.pt"
+    checkpoint_file.write_bytes(b"weights")
+    for terrain_type in ["it-0_run-0", "it-0_run-0_copy"]:
+        (tmp_path / f"set_terrain_{terrain_type}.py").write_text("def set_terrain(terrain, variation, difficulty):\n    pass\n")
+    eval_config = {"eval_steps": 1000, "metric_granularity": "type"}
+
+    cache = EvalResultCache(tmp_path / "eval_cache.sqlite")
+    key = EvalResultCache.get_key(checkpoint_file, "it-0_run-0", eval_config)
+    assert cache.get(key) is None
+    cache.put(key, "STATISTICS SUMMARY", '{"version": 1}')
+    assert cache.get(key) == ("STATISTICS SUMMARY", '{"version": 1}')
+
+    # Hits for copies of the same terrain and after reopening, misses if the config, policy or terrain changes
+    assert EvalResultCache.get_key(checkpoint_file, "it-0_run-0_copy", eval_config) == key
+    assert EvalResultCache(tmp_path / "eval_cache.sqlite").get(key) is not None
+    assert EvalResultCache.get_key(checkpoint_file, "it-0_run-0", {**eval_config, "eval_steps": 2000}) != key
+    assert EvalResultCache.get_key(checkpoint_file, "benchmark", eval_config) != key
+    checkpoint_file.write_bytes(b"new weights")
+    assert EvalResultCache.get_key(checkpoint_file, "it-0_run-0", eval_config) != key
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fake backends for dry runs of run_eurekaverse.py (cfg.dry_run), which exercise the whole loop on CPU in seconds.
+# Training, evaluation and terrain checks run as the scripts in eurekaverse/scripts/dry_run_*.py, which take the same
+# arguments and print the same logs as the real ones, but only sleep and write synthetic checkpoints and results.
+# GPT is served over HTTP by FakeOpenAIServer, so queries go through the real OpenAI client, retries and rate limits.
+# Nothing here imports torch or Isaac Gym, so the fake processes start quickly.
+
+file_dir = os.path.dirname(os.path.abspath(__file__))  # Location of this file
+with open(Path(f"{file_dir}/../gpt/terrain_example_initial.py")) as f:
+    initial_terrain_example = f.read()
+with open(Path(f"{file_dir}/../gpt/terrain_example_evolution.py")) as f:
+    evolution_terrain_example = f.read()
+
+num_goals = 8
+num_benchmark_terrain_types = 10
+
+def get_setting(name):
+    # Timings and failure rates are passed from the config to the fake processes in environment variables
+    return float(os.environ[f"DRY_RUN_{name.upper()}"])
+
+def get_dry_run_dir(name):
+    # Terrain files and fake checkpoints go to the run's output directory instead of legged_gym (see use_dry_run_backends())
+    return Path(os.environ["DRY_RUN_DIR"]) / name
+
+def stable_random(*keys):
+    # Unlike hash(), the same in every process
+    return random.Random(hashlib.sha256("/".join(str(key) for key in keys).encode()).hexdigest())
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """OpenAI-compatible chat completions endpoint on localhost, which answers every request with the example terrain
+    after some latency, failing with the given error codes first. Each sample gets a unique comment, so they aren't
+    deduplicated as the same terrain. Point the OpenAI client at it with OPENAI_BASE_URL=server.url."""
+
+    daemon_threads = True
+
+    def __init__(self, latency=0, errors=()):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.latency = latency
+        self.errors = list(errors)
+        self.num_requests = 0
+        self.num_samples = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        n = request.get("n", 1)
+        with server.lock:
+            server.num_requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            error = server.errors.pop(0) if server.errors else None
+            sample_ids = range(server.num_samples, server.num_samples + n)
+            if error is None:
+                server.num_samples += n
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+
+        if error is not None:
+            body = {"error": {"message": f"Fake error {error}", "type": "fake", "code": str(error)}}
+            headers = {"retry-after-ms": "50"} if error == 429 else {}
+        else:
+            # Evolution prompts include the previous terrain as an assistant message
+            is_evolution = any(message["role"] == "assistant" for message in request["messages"])
+            example = evolution_terrain_example if is_evolution else initial_terrain_example
+            responses = [f"```python\n{example.rstrip()}\n    # Dry run sample {sample_id}\n```" for sample_id in sample_ids]
+            prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            completion_tokens = sum(len(response) for response in responses) // 4
+            choices = [{"index": i, "message": {"role": "assistant", "content": response}, "finish_reason": "stop"} for i, response in enumerate(responses)]
+            body = {"id": "fake", "object": "chat.completion", "created": 0, "model": request["model"], "choices": choices,
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}}
+            headers = {}
+        data = json.dumps(body).encode()
+        self.send_response(error or 200)
+        for name, value in {"Content-Type": "application/json", "Content-Length": str(len(data)), **headers}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def save_fake_checkpoint(exptid, it, skill):
+    with open(get_dry_run_dir("logs") / exptid / f"model_{it}.pt", "w") as f:
+        json.dump({"skill": skill}, f)
+
+def load_fake_checkpoint(exptid):
+    """Returns the iteration and skill of exptid's last checkpoint, or a skill of 0 for real (or missing) checkpoints."""
+    load_dir = get_dry_run_dir("logs") / exptid
+    models = list(load_dir.glob("model_*.pt")) if load_dir.exists() else []
+    if not models:
+        return 0, 0.0
+    model = max(models, key=lambda model: int(re.search(r"model_(\d+)", model.name).group(1)))
+    it = int(re.search(r"model_(\d+)", model.name).group(1))
+    try:
+        with open(model) as f:
+            return it, json.load(f)["skill"]
+    except (UnicodeDecodeError, ValueError, KeyError):
+        return it, 0.0
+
+def fake_check_terrain(terrain_type):
+    """Passes or fails (with a traceback, like train.py) a fraction of terrains, the same ones every time."""
+    time.sleep(get_setting("check_time"))
+    with open(get_dry_run_dir("set_terrains") / f"set_terrain_{terrain_type}.py") as f:
+        terrain_code = f.read()
+    if stable_random(terrain_code).random() < get_setting("check_failure_rate"):
+        raise RuntimeError(f"Fake terrain check failure for {terrain_type}")
+    print("Converting heightmap to trimesh...", flush=True)
+
+def fake_train(exptid, max_iterations, load_run):
+    """Prints training logs like OnPolicyRunner over cfg.dry_run_train_time seconds, while the skill of the policy
+    grows at a rate that differs between runs, then saves it as the last checkpoint."""
+    log_dir = get_dry_run_dir("logs") / exptid
+    os.makedirs(log_dir, exist_ok=True)
+    print(f"Starting training, using log directory {log_dir}...", flush=True)
+
+    start_it, skill = load_fake_checkpoint(load_run)
+    end_it = start_it + max_iterations
+    rate = stable_random(exptid).uniform(0.5, 1.5) / 1000
+    rng = stable_random(exptid, "rewards")
+    for it in range(start_it, end_it):
+        reward = 10 * (skill + rate * (it - start_it)) + rng.gauss(0, 0.5)
+        print(f"Learning iteration {it}/{end_it}\nMean reward (total): {reward:.2f}", flush=True)
+        time.sleep(get_setting("train_time") / max_iterations)
+    save_fake_checkpoint(exptid, end_it, skill + rate * max_iterations)
+
+def get_terrain_codes(terrain_type):
+    terrain_file = get_dry_run_dir("set_terrains") / f"set_terrain_{terrain_type}.py"
+    if not terrain_file.exists():
+        # Built-in terrains such as the benchmark
+        return [f"{terrain_type}_{i}" for i in range(num_benchmark_terrain_types)]
+    with open(terrain_file) as f:
+        return re.split(r"^def set_terrain_\d+\(", f.read(), flags=re.MULTILINE)[1:]
+
+def fake_evaluate(exptid, terrain_type, results_file=None):
+    """Scores exptid's skill against a difficulty drawn for each terrain, returns the printed results and the results
+    dict in the same format as evaluate.py."""
+    time.sleep(get_setting("eval_time"))
+    it, skill = load_fake_checkpoint(exptid)
+    model_file = get_dry_run_dir("logs") / exptid / f"model_{it}.pt"
+    print(f"Loading model from {model_file}...", flush=True)
+
+    per_type = {}
+    for i, terrain_code in enumerate(get_terrain_codes(terrain_type)):
+        rng = stable_random(terrain_code)
+        difficulty = rng.uniform(0, 2)
+        goals = num_goals / (1 + math.exp(difficulty - skill)) + stable_random(exptid, terrain_code).gauss(0, 0.1)
+        per_type[i] = {"Reward": 2 * goals, "Episode length": 200 + 100 * goals, "Number of goals reached": goals, "Edge violation": 0.1 * difficulty}
+    summary = {name: sum(stats[name] for stats in per_type.values()) / len(per_type) for name in per_type[0].keys()}
+
+    stats_to_str = lambda stats: "".join(f"{name}: {value:.2f}\n" for name, value in stats.items())
+    output = "STATISTICS SUMMARY\n" + stats_to_str(summary) + "\n"
+    output += "".join(f"STATISTICS FOR TERRAIN TYPE {i:02}\n" + stats_to_str(stats) + "\n" for i, stats in per_type.items())
+    print(output, flush=True)
+
+    results = {"exptid": exptid, "terrain_type": terrain_type, "checkpoint": f"model_{it}", "summary": summary,
+               "per_type": per_type, "per_level": {0: summary}, "per_cell": [{"terrain_type": i, "level": 0, **stats} for i, stats in per_type.items()]}
+    if results_file is not None:
+        # Same layout as save_eval_results() in legged_gym/eval/eval_results.py, which would import torch
+        tmp_file = f"{results_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": 1, **results}, f, indent=2)
+        os.replace(tmp_file, results_file)
+    return output, results
+
+class DryRunEvalBackend:
+    """Evaluation server backend (see legged_gym/eval/eval_server.py) with fake_evaluate()."""
+
+    def make_env(self, job):
+        time.sleep(get_setting("eval_time"))
+
+    def evaluate(self, job):
+        output, results = fake_evaluate(job["exptid"], job["terrain_type"], job.get("results_file"))
+        return {"output": output, "results": results}
@@ -1,12 +1,19 @@
 
 import logging
 import os
-from openai import OpenAI
+from openai import OpenAI, APIStatusError, APIConnectionError
 
 import time
 import re
+import random
 from pathlib import Path
 import threading
+import json
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from eurekaverse.utils.misc_utils import traced, add_trace_args, get_trace_args
 
 file_dir = os.path.dirname(os.path.abspath(__file__))  # Location of this file
 with open(Path(f"{file_dir}/../gpt/system_prompt.txt")) as f:
@@ -22,10 +29,12 @@ with open(Path(f"{file_dir}/../gpt/terrain_example_initial.py")) as f:
 with open(Path(f"{file_dir}/../gpt/terrain_example_evolution.py")) as f:
     evolution_terrain_example = f.read()
 
-client = OpenAI()
+client = None  # Set in prepare_prompts
+rate_limiter = None  # Set in prepare_prompts
+response_cache = None  # Set in open_response_cache
 replay_run = ""  # Set to a log directory (e.g., "outputs/.../gpt_queries") to replay a specific run's LLM responses
-replay_idx = 0   # Used to keep track of which response to load from a run (if replay_run is set)
-replay_idx_lock = threading.Lock()
+replay_cache = None  # Responses of replay_run in an in-memory ResponseCache, indexed once on first use
+replay_cache_lock = threading.Lock()
 replay_initial_only = False  # Set to True to only replay initial queries and generate evolution queries from scratch
 
 gpt_pricing = {
@@ -35,21 +44,136 @@ gpt_pricing = {
     "gpt-3.5-turbo-0125": (5e-7, 1.5e-6)  # GPT-3.5 Turbo: $0.0005/1K input, $0.0015/1K output
 }
 
+class RateLimiter:
+    """Shared by all querying threads, caps in-flight requests and tokens per minute.
+    Rate limit errors pause all requests until the time given by the API's headers."""
+
+    def __init__(self, max_concurrent_requests, tokens_per_minute):
+        self.request_semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self.tokens_per_minute = tokens_per_minute
+        self.token_history = deque()  # (time, tokens) of requests in the last minute
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        self.request_semaphore.acquire()
+        while True:
+            with self.lock:
+                now = time.time()
+                while self.token_history and self.token_history[0][0] < now - 60:
+                    self.token_history.popleft()
+                used_tokens = sum(t for _, t in self.token_history)
+                if now >= self.paused_until and (used_tokens + tokens <= self.tokens_per_minute or not self.token_history):
+                    entry = [now, tokens]
+                    self.token_history.append(entry)
+                    return entry
+                wait_time = max(self.paused_until - now, self.token_history[0][0] + 60 - now if self.token_history else 0)
+            time.sleep(min(max(wait_time, 0.01), 1))
+
+    def release(self, entry, tokens=None):
+        # Replace the estimated token count with the actual usage, if known
+        if tokens is not None:
+            with self.lock:
+                entry[1] = tokens
+        self.request_semaphore.release()
+
+    def pause(self, delay):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + delay)
+
+class ResponseCache:
+    """Persistent cache of GPT responses in a single SQLite file, with one row per sample.
+    Keyed on where the sample was queried (iteration, parallel run, terrain, query and sample index), not on the request,
+    so a resumed run gets the same responses for the same queries no matter in which order they're made."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS samples (key TEXT PRIMARY KEY, response TEXT)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(query_key, sample):
+        return json.dumps({**query_key, "sample": sample}, sort_keys=True)
+
+    def get(self, keys):
+        """Returns the responses of all keys, or None if any is missing."""
+        with self.lock:
+            rows = [self.connection.execute("SELECT response FROM samples WHERE key = ?", (key,)).fetchone() for key in keys]
+        if any(row is None for row in rows):
+            return None
+        return [row[0] for row in rows]
+
+    def put(self, keys, responses):
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?)", list(zip(keys, responses)))
+
+def parse_duration(duration):
+    """Parses rate limit reset durations such as "20ms", "1s", or "6m0s" into seconds."""
+    units = {"ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+    matches = re.findall(r"([\d.]+)(ms|s|m|h)", duration)
+    if not matches:
+        return float(duration)
+    return sum(float(value) * units[unit] for value, unit in matches)
+
+def get_retry_delay(error, attempt, max_delay=60):
+    """Exponential backoff with full jitter, but at least as long as the API asks for in its rate limit headers."""
+    delay = random.uniform(0, min(max_delay, 2 ** attempt))
+    headers = error.response.headers if isinstance(error, APIStatusError) else {}
+    for header in ["retry-after-ms", "retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"]:
+        if header in headers:
+            try:
+                header_delay = parse_duration(headers[header]) / (1000 if header == "retry-after-ms" else 1)
+            except ValueError:
+                continue
+            delay = max(delay, min(header_delay, max_delay))
+            break
+    return delay
+
+def is_retryable(error):
+    """Only timeouts, conflicts, rate limits, server errors and connection errors can succeed when retried."""
+    if isinstance(error, APIStatusError):
+        return error.status_code in [408, 409, 429] or error.status_code >= 500
+    return isinstance(error, APIConnectionError)  # Includes timeouts
+
 def prepare_prompts(cfg):
-    global system_prompt, initial_example_message, evolution_example_message
+    global system_prompt, initial_example_message, evolution_example_message, rate_limiter, client
     
+    rate_limiter = RateLimiter(cfg.gpt_max_concurrent_requests, cfg.gpt_tokens_per_minute)
+    # Retries are handled by query_gpt_request, which respects the rate limiter
+    client = OpenAI(max_retries=0)
+
     initial_example_message = initial_example_prompt.replace("<INSERT EXAMPLE HERE>", initial_terrain_example)
     evolution_example_message = evolution_example_prompt.replace("<INSERT INITIAL EXAMPLE HERE>", initial_terrain_example)
     evolution_example_message = evolution_example_message.replace("<INSERT EVOLUTION EXAMPLE HERE>", evolution_terrain_example)
 
-def query_gpt_initial(cfg, num_samples=1):
+def open_response_cache(path):
+    global response_cache
+    response_cache = ResponseCache(path)
+    logging.info(f"Caching GPT responses in {path}")
+
+def query_gpt_initial(cfg, num_samples=1, query_key=None):
+    return query_gpt(cfg, get_initial_messages(), num_samples, query_key)
+
+def query_gpt_initial_stream(cfg, num_samples=1, query_key=None):
+    return query_gpt_stream(cfg, get_initial_messages(), num_samples, query_key)
+
+def query_gpt_evolution(cfg, prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions, num_samples=1, query_key=None):
+    messages = get_evolution_messages(prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions)
+    return query_gpt(cfg, messages, num_samples, query_key)
+
+def query_gpt_evolution_stream(cfg, prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions, num_samples=1, query_key=None):
+    messages = get_evolution_messages(prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions)
+    return query_gpt_stream(cfg, messages, num_samples, query_key)
+
+def get_initial_messages():
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": initial_example_message}
     ]
-    return query_gpt(cfg, messages, num_samples)
+    return messages
 
-def query_gpt_evolution(cfg, prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions, num_samples=1):
+def get_evolution_messages(prev_terrain_code, eval_statistics, terrain_stats, all_best_terrain_descriptions):
     global replay_run
     if replay_initial_only:
         replay_run = ""
@@ -67,77 +191,144 @@ def query_gpt_evolution(cfg, prev_terrain_code, eval_statistics, terrain_stats,
         {"role": "user", "content": evolution_message},
         {"role": "user", "content": evolution_example_message}
     ]
-    return query_gpt(cfg, messages, num_samples)
+    return messages
+
+def query_gpt(cfg, messages, num_samples=1, query_key=None):
+    """Blocking version of query_gpt_stream, returns all samples at once."""
+    responses, parsed_responses = [], []
+    total_prompt_cost, total_response_cost = 0, 0
+    for _, request_responses, request_parsed_responses, prompt_cost, response_cost in query_gpt_stream(cfg, messages, num_samples, query_key):
+        responses.extend(request_responses)
+        parsed_responses.extend(request_parsed_responses)
+        total_prompt_cost += prompt_cost
+        total_response_cost += response_cost
+    if not responses:
+        return None
+    return messages, responses, parsed_responses, total_prompt_cost, total_response_cost
 
-def query_gpt(cfg, messages, num_samples=1):
+def query_gpt_stream(cfg, messages, num_samples=1, query_key=None):
+    """Splits the query into concurrent requests of cfg.gpt_samples_per_request samples each.
+    Yields (messages, responses, parsed_responses, prompt_cost, response_cost) as each request completes, so callers can
+    start checking samples before the rest arrive. Failed requests are dropped after cfg.gpt_max_attempts attempts.
+    query_key (e.g., dict(it=1, parallel_run_id=0, terrain_id=2, query_id=0)) identifies the query in the response
+    cache and replay_run, without it responses are neither cached nor replayed."""
     logging.info(f"Querying OpenAI API for {num_samples} samples using {cfg.gpt_model}...")
 
-    if replay_run:
-        global replay_idx
-
-        log_dir_list = []
-        for root, dirs, _ in os.walk(replay_run):
-            for dir in dirs:
-                if "query" in dir:
-                    log_dir_list.append(os.path.join(root, dir))
-        log_dir_list = sorted(log_dir_list)
-
-        with replay_idx_lock:
-            log_dir = log_dir_list[replay_idx]
-            responses = []
-            files = [i for i in os.listdir(log_dir) if "response" in i]
-            files = sorted(files, key=lambda x: int(x.rstrip(".txt").split("-")[-1]))  # Sort numerically
-            for file in files[:num_samples]:
-                with open(os.path.join(log_dir, file), "r") as f:
-                    responses.append(f.read())
-            prompt_cost, response_cost = 0, 0
-            logging.info(f"Loaded past response from {log_dir}")
-            replay_idx = (replay_idx + 1) % len(log_dir_list)
-    else:
-        responses = None
-        attempts = 10
-        for i in range(attempts):
-            try:
-                responses = client.chat.completions.create(
-                    model=cfg.gpt_model,
-                    messages=messages,
-                    n=num_samples
-                )
-                break
-            except Exception as e:
-                logging.warning(f"Error querying OpenAI API (attempt {i})...")
-                logging.warning(e)
-                time.sleep(1)
-        if not responses:
-            logging.error(f"Failed to query OpenAI API {attempts} times!")
-            return None
+    request_starts = range(0, num_samples, cfg.gpt_samples_per_request)
+    request_sizes = [min(cfg.gpt_samples_per_request, num_samples - start) for start in request_starts]
+    executor = ThreadPoolExecutor(max_workers=len(request_sizes))
+    futures = []
+    try:
+        requests = [dict(model=cfg.gpt_model, messages=messages, n=n) for n in request_sizes]
+        cache_keys = [None] * len(requests)
+        if query_key is not None:
+            cache_keys = [[ResponseCache.get_key(query_key, sample) for sample in range(start, start + n)] for start, n in zip(request_starts, request_sizes)]
+        # Requests run in other threads, so they get the caller's span args (run, iteration, terrain) explicitly
+        trace_args = get_trace_args()
+        futures = [executor.submit(query_gpt_request, cfg, request, trace_args, keys) for request, keys in zip(requests, cache_keys)]
+        for future in as_completed(futures):
+            responses, prompt_cost, response_cost = future.result()
+            if responses is None:
+                continue
+            yield messages, responses, [parse_response(response) for response in responses], prompt_cost, response_cost
+    finally:
+        # If the caller stops early, don't send requests that haven't started yet
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+@traced()
+def query_gpt_request(cfg, request, trace_args=None, cache_keys=None):
+    add_trace_args(**(trace_args or {}))
+    if cache_keys is not None:
+        # Replayed responses take precedence over the run's own cache
+        for cache in [get_replay_cache() if replay_run else None, response_cache]:
+            cached = cache.get(cache_keys) if cache is not None else None
+            if cached is not None:
+                logging.info(f"Loaded {request['n']} {'replayed' if cache is replay_cache else 'cached'} samples")
+                add_trace_args(samples=request["n"], cached=True)
+                return cached, 0, 0
+
+    # Rough token estimate (4 characters per token) until the actual usage is known
+    prompt_chars = sum(len(message["content"]) for message in request["messages"])
+    estimated_tokens = prompt_chars // 4 + request["n"] * cfg.gpt_estimated_response_tokens
+
+    for i in range(cfg.gpt_max_attempts):
+        entry = rate_limiter.acquire(estimated_tokens)
+        try:
+            responses = client.chat.completions.create(**request)
+        except Exception as e:
+            rate_limiter.release(entry)
+            if not is_retryable(e):
+                logging.error("Error querying OpenAI API that can't be retried, giving up...")
+                logging.error(e)
+                return None, 0, 0
+            delay = get_retry_delay(e, i)
+            if isinstance(e, APIStatusError) and e.status_code == 429:
+                rate_limiter.pause(delay)
+            logging.warning(f"Error querying OpenAI API (attempt {i}), retrying in {delay:.1f}s...")
+            logging.warning(e)
+            time.sleep(delay)
+            continue
 
         prompt_tokens, response_tokens = responses.usage.prompt_tokens, responses.usage.completion_tokens
+        rate_limiter.release(entry, prompt_tokens + response_tokens)
+        add_trace_args(samples=request["n"], attempts=i + 1, prompt_tokens=prompt_tokens, response_tokens=response_tokens)
         prompt_pricing, response_pricing = gpt_pricing[cfg.gpt_model]
-        prompt_cost, response_cost = prompt_pricing * prompt_tokens, response_pricing * response_tokens  # GPT-4 Turbo pricing, $0.01/1K input, $0.03/1K output
-        logging.info(f"Received response, used {prompt_tokens} prompt tokens (${prompt_cost:.2f}) and {response_tokens} response tokens (${response_cost:.2f})")
+        prompt_cost, response_cost = prompt_pricing * prompt_tokens, response_pricing * response_tokens
+        logging.info(f"Received {request['n']} samples, used {prompt_tokens} prompt tokens (${prompt_cost:.2f}) and {response_tokens} response tokens (${response_cost:.2f})")
         responses = [choice.message.content for choice in responses.choices]
+        if cache_keys is not None and response_cache is not None:
+            response_cache.put(cache_keys, responses)
+        return responses, prompt_cost, response_cost
 
-    parsed_responses = []
-    for response in responses:
-        patterns = [
-            r'```python(.*?)```',
-            r'```(.*?)```',
-            r'^(.*?)$',
-        ]
-        for pattern in patterns:
-            string = re.search(pattern, response, re.DOTALL)
-            if string:
-                parsed_response = string.group(1).strip()
-                # Delete code outside of the function (check for un-indented lines)
-                parsed_response = parsed_response.split("\n")
-                parsed_response = [line for line in parsed_response
-                                   if line == "" or line.startswith(" ") or line.startswith("def") or line.startswith("import")]
-                parsed_response = "\n".join(parsed_response)
-                parsed_responses.append(parsed_response)
-                break
-    
-    return messages, responses, parsed_responses, prompt_cost, response_cost
+    logging.error(f"Failed to query OpenAI API {cfg.gpt_max_attempts} times!")
+    return None, 0, 0
+
+def get_replay_cache():
+    global replay_cache
+    with replay_cache_lock:
+        if replay_cache is None:
+            replay_cache = ResponseCache(":memory:")
+            index_replay_run(replay_run, replay_cache)
+    return replay_cache
+
+def index_replay_run(replay_run, cache):
+    """Puts the responses of every query logged in replay_run into the cache, keyed like the queries of this run.
+    Queries that replay_run didn't make (e.g., it stopped earlier) miss, and are sent to the API."""
+    for root, dirs, _ in os.walk(replay_run):
+        for dir in dirs:
+            # Logged by log_gpt_query() in gpt_queries/iter-{it}/run-{parallel_run_id}/[terrain-{terrain_id}_]query-{query_id}
+            log_dir = os.path.join(root, dir)
+            match = re.search(r"iter-(\d+)/run-(\d+)/(?:terrain-(\d+)_)?query-(\d+)$", log_dir)
+            if match is None:
+                continue
+            it, parallel_run_id, terrain_id, query_id = [int(group) if group is not None else -1 for group in match.groups()]
+            query_key = dict(it=it, parallel_run_id=parallel_run_id, terrain_id=terrain_id, query_id=query_id)
+            keys, responses = [], []
+            for file in os.listdir(log_dir):
+                if file.startswith("response-"):
+                    keys.append(ResponseCache.get_key(query_key, int(file[len("response-"):-len(".txt")])))
+                    with open(os.path.join(log_dir, file), "r") as f:
+                        responses.append(f.read())
+            cache.put(keys, responses)
+
+def parse_response(response):
+    patterns = [
+        r'```python(.*?)```',
+        r'```(.*?)```',
+        r'^(.*?)$',
+    ]
+    for pattern in patterns:
+        string = re.search(pattern, response, re.DOTALL)
+        if string:
+            parsed_response = string.group(1).strip()
+            # Delete code outside of the function (check for un-indented lines)
+            parsed_response = parsed_response.split("\n")
+            parsed_response = [line for line in parsed_response
+                               if line == "" or line.startswith(" ") or line.startswith("def") or line.startswith("import")]
+            parsed_response = "\n".join(parsed_response)
+            return parsed_response
 
 def log_gpt_query(messages, responses, save_dir):
     if not os.path.exists(save_dir):
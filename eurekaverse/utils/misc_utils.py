@@ -7,6 +7,12 @@ import time
 import threading
 import contextlib
 import re
+import math
+import inspect
+import functools
+from concurrent import futures
+from concurrent.futures import Future
+from pathlib import Path
 
 gpustat_lock = threading.Lock()
 gpustat_next_ready_time = time.time()
@@ -31,38 +37,320 @@ def get_num_gpus():
     gpustats = json.loads(out_str.decode('utf-8'))
     return len(gpustats['gpus'])
 
+class GpustatDevices:
+    """Reads the memory of each GPU (in MB) with gpustat."""
+
+    def get_memory(self):
+        sp = subprocess.Popen(['gpustat', '--json'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out_str, _ = sp.communicate()
+        gpustats = json.loads(out_str.decode('utf-8'))
+        return {f"cuda:{gpu['index']}": (gpu['memory.used'], gpu['memory.total']) for gpu in gpustats['gpus']}
+
+class NvmlDevices:
+    """Reads the memory of each GPU (in MB) directly with NVML, without starting a process (needs nvidia-ml-py)."""
+
+    def __init__(self):
+        import pynvml
+        self.pynvml = pynvml
+        pynvml.nvmlInit()
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def get_memory(self):
+        memory = {}
+        for i, handle in enumerate(self.handles):
+            info = self.pynvml.nvmlDeviceGetMemoryInfo(handle)
+            memory[f"cuda:{i}"] = (info.used / 2**20, info.total / 2**20)
+        return memory
+
+class FakeDevices:
+    """GPUs with fixed total memory whose usage is set by hand, for testing scheduling without GPUs."""
+
+    def __init__(self, num_gpus, total_memory):
+        self.memory = {f"cuda:{i}": [0, total_memory] for i in range(num_gpus)}
+
+    def get_memory(self):
+        return {device: tuple(memory) for device, memory in self.memory.items()}
+
+class GpuScheduler:
+    """Assigns jobs to the GPU with the most free memory, reserving the memory declared for their job type.
+
+    Reservations are tracked in this process, so jobs that start together don't all pick the same GPU before their
+    memory usage shows up, and a job waits until some GPU has room for it. A GPU's free memory is its total minus the
+    larger of its measured usage and our reservations on it. The measured usage can't be split between our jobs and
+    other processes, so memory used by other processes is only respected where it exceeds our unused reservations."""
+
+    def __init__(self, devices, job_memory, refresh_interval=2):
+        self.devices = devices
+        self.job_memory = job_memory    # Job type -> MB
+        self.refresh_interval = refresh_interval
+        self.reserved = {}              # Device -> reserved MB
+        self.memory = None
+        self.memory_time = 0
+        self.condition = threading.Condition()
+
+    def get_free_memory(self):
+        if self.memory is None or time.time() - self.memory_time > self.refresh_interval:
+            self.memory = self.devices.get_memory()
+            self.memory_time = time.time()
+        return {device: total - max(used, self.reserved.get(device, 0)) for device, (used, total) in self.memory.items()}
+
+    def acquire(self, job_type):
+        """Blocks until a GPU has room for the job, reserves its memory and returns the device."""
+        job_memory = self.job_memory[job_type]
+        with self.condition:
+            while True:
+                free_memory = self.get_free_memory()
+                if all(job_memory > self.memory[device][1] for device in free_memory.keys()):
+                    raise ValueError(f"No GPU has enough memory for a {job_type} job ({job_memory} MB)")
+                device = max(free_memory.keys(), key=lambda device: free_memory[device])
+                if free_memory[device] >= job_memory:
+                    self.reserved[device] = self.reserved.get(device, 0) + job_memory
+                    return device
+                # Wake up on releases, and now and then in case other processes freed memory
+                self.condition.wait(timeout=self.refresh_interval)
+
+    def release(self, device, job_type):
+        with self.condition:
+            self.reserved[device] -= self.job_memory[job_type]
+            self.condition.notify_all()
+
+    def release_on_exit(self, process, device, job_type):
+        """Releases the reservation once the process (see WatchedProcess) has exited."""
+        process.exited.add_done_callback(lambda _: self.release(device, job_type))
+
+class WatchedProcess(subprocess.Popen):
+    """Subprocess whose output is read line by line in a background thread, instead of re-reading the log file.
+    Output is appended to log_file (or kept in memory if None), and watch() futures resolve as soon as a line matches."""
+
+    def __init__(self, args, log_file=None, **kwargs):
+        super().__init__(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+        self.log_file = log_file
+        self.log_offset = os.path.getsize(log_file) if log_file is not None else 0  # Where this process's output starts
+        self.output = []                 # Output lines, only kept if there is no log file
+        self.watches = []                # (string, future) pairs still waiting for a matching line
+        self.watch_lock = threading.Lock()
+        self.exited = Future()           # Resolves to the return code once all output has been read
+
+        # The reader thread owns the pipe, so communicate() only waits for the process (see wait())
+        self.output_pipe, self.stdout = self.stdout, None
+        self.reader_thread = threading.Thread(target=self.read_output, daemon=True)
+        self.reader_thread.start()
+
+    def read_output(self):
+        log = open(self.log_file, "a") if self.log_file is not None else None
+        try:
+            for line in iter(self.output_pipe.readline, b""):
+                line = line.decode("utf-8", errors="replace")
+                with self.watch_lock:
+                    if log is not None:
+                        log.write(line)
+                        log.flush()
+                    else:
+                        self.output.append(line)
+                    matched = [future for string, future in self.watches if string in line]
+                    self.watches = [(string, future) for string, future in self.watches if string not in line]
+                # Resolve outside the lock, since callbacks may call watch()
+                for future in matched:
+                    future.set_result(line)
+        finally:
+            if log is not None:
+                log.close()
+            self.output_pipe.close()
+            self.exited.set_result(super().wait())
+
+    def watch(self, string):
+        """Returns a future that resolves to the first output line containing string, including lines already read."""
+        future = Future()
+        with self.watch_lock:
+            if self.log_file is not None:
+                with open(self.log_file, "r") as f:
+                    f.seek(self.log_offset)
+                    past_lines = f.readlines()
+            else:
+                past_lines = self.output
+            match = next((line for line in past_lines if string in line), None)
+            if match is not None:
+                future.set_result(match)
+            elif not self.exited.done():
+                self.watches.append((string, future))
+        return future
+
+    def wait(self, timeout=None):
+        # Also wait for the reader thread, so the log file is complete when the process is done
+        # NOTE: The output only ends once descendants that inherited the pipe have exited too, so this also times out
+        end_time = time.monotonic() + timeout if timeout is not None else None
+        returncode = super().wait(timeout=timeout)
+        self.reader_thread.join(timeout=max(0, end_time - time.monotonic()) if end_time is not None else None)
+        if self.reader_thread.is_alive():
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return returncode
+
+class SuccessiveHalving:
+    """Stops the worst runs early: at each rung (a number of training iterations), only the best keep_fraction of the
+    runs still going continue, but at least min_keep of them.
+
+    Runs call start() when they start training and report() at each rung, which blocks until every started run has
+    reported or stopped (see stop()), and returns whether to continue. A run that starts late, after a rung was decided,
+    continues if it scores at least as well as the worst run kept at that rung, so queued runs never hold up the others."""
+
+    def __init__(self, rungs, keep_fraction, min_keep=1):
+        self.rungs = sorted(rungs)
+        self.keep_fraction = keep_fraction
+        self.min_keep = min_keep
+        self.running = set()
+        self.scores = {rung: {} for rung in self.rungs}
+        self.kept = {}        # Rung -> runs kept when the rung was decided
+        self.thresholds = {}  # Rung -> lowest score kept
+        self.condition = threading.Condition()
+
+    def start(self, run_id):
+        with self.condition:
+            self.running.add(run_id)
+
+    def stop(self, run_id):
+        """The run finished, failed or was culled, so rungs don't wait for it anymore."""
+        with self.condition:
+            self.running.discard(run_id)
+            for rung in self.rungs:
+                self.decide(rung)
+
+    def report(self, run_id, rung, score):
+        with self.condition:
+            self.scores[rung][run_id] = score
+            if rung in self.thresholds:
+                keep = score >= self.thresholds[rung]
+            else:
+                self.decide(rung)
+                while rung not in self.thresholds:
+                    self.condition.wait()
+                keep = run_id in self.kept[rung]
+            if not keep:
+                self.running.discard(run_id)
+            return keep
+
+    def decide(self, rung):
+        scores = self.scores[rung]
+        if rung in self.thresholds or not scores or not all(run_id in scores for run_id in self.running):
+            return
+        ranked = sorted(scores.keys(), key=lambda run_id: scores[run_id], reverse=True)
+        num_keep = max(self.min_keep, math.ceil(self.keep_fraction * len(ranked)))
+        self.kept[rung] = set(ranked[:num_keep])
+        self.thresholds[rung] = min(scores[run_id] for run_id in self.kept[rung])
+        self.condition.notify_all()
+
 def run_subprocess(command, log_file):
-    if log_file == None:
-        process = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env={**os.environ.copy(), "TQDM_DISABLE": "1"})
-    else:
+    if log_file is not None:
         with open(log_file, "a") as f:
             f.write("\n" + "="*100 + "\n" + f"Running command: {command}\n" + "="*100 + "\n")
-            process = subprocess.Popen(command.split(), stdout=f, stderr=f, env={**os.environ.copy(), "TQDM_DISABLE": "1"})
+    process = WatchedProcess(command.split(), log_file=log_file, env={**os.environ.copy(), "TQDM_DISABLE": "1"})
     return process
 
 def wait_subprocess(process, log_file, success_log, failure_log, timeout=60):
-    timeout = time.time() + timeout
-    while True:
-        if log_file is None:
-            output = process.stdout.readline()
-        else: 
-            with open(log_file, 'r') as file:
-                output = file.read()
-        if output:
-            if success_log in output:
-                return True, False
-            if failure_log in output:
-                time.sleep(1)  # Wait for the process to finish writing to the log file
-                return False, False
-
-        retcode = process.poll()
-        if retcode is not None:
-            logging.warning(f"Process terminated while waiting with code {retcode}")
-            return False, False
-        if time.time() > timeout:
-            return False, True
-
-        time.sleep(1)
+    success = process.watch(success_log)
+    failure = process.watch(failure_log)
+    futures.wait([success, failure, process.exited], timeout=timeout, return_when=futures.FIRST_COMPLETED)
+    if success.done():
+        return True, False
+    if failure.done():
+        try:
+            process.exited.result(timeout=1)  # Wait for the process to finish writing the traceback
+        except futures.TimeoutError:
+            pass
+        return False, False
+    if process.exited.done():
+        logging.warning(f"Process terminated while waiting with code {process.exited.result()}")
+        return False, False
+    return False, True
+
+# Records where the time goes if started, see start_tracing()
+tracer = None
+
+class Tracer:
+    """Writes spans as Chrome trace events (open in Perfetto or chrome://tracing), one event per line.
+    The closing bracket of the event array is optional in this format, so the trace stays readable if the run is
+    killed, and a resumed run appends to the same trace."""
+
+    def __init__(self, path):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a")
+        if is_new:
+            self.file.write("[\n")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread_ids = {}
+
+    def get_thread_id(self):
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.thread_ids:
+                self.thread_ids[thread.ident] = len(self.thread_ids)
+                self.write({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": self.thread_ids[thread.ident], "args": {"name": thread.name}})
+            return self.thread_ids[thread.ident]
+
+    def write(self, event):
+        self.file.write(json.dumps(event) + ",\n")
+        self.file.flush()
+
+    def add_span(self, name, start_time, end_time, args):
+        event = {"name": name, "ph": "X", "ts": start_time * 1e6, "dur": (end_time - start_time) * 1e6, "pid": os.getpid(), "tid": self.get_thread_id(), "args": args}
+        with self.lock:
+            self.write(event)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def start_tracing(path):
+    global tracer
+    tracer = Tracer(path)
+
+def stop_tracing():
+    global tracer
+    if tracer is not None:
+        tracer.close()
+        tracer = None
+
+@contextlib.contextmanager
+def trace(name, **args):
+    """Records the time spent in the with block as a span with the given args, yields the args so more can be added."""
+    if tracer is None:
+        yield args
+        return
+    spans = tracer.local.__dict__.setdefault("spans", [])
+    spans.append(args)
+    start_time = time.time()
+    try:
+        yield args
+    finally:
+        spans.pop()
+        tracer.add_span(name, start_time, time.time(), {key: str(value) if isinstance(value, Path) else value for key, value in args.items()})
+
+def add_trace_args(**args):
+    """Adds args to the innermost span of this thread, for values that are only known inside it (like the GPU)."""
+    if tracer is not None and getattr(tracer.local, "spans", None):
+        tracer.local.spans[-1].update(args)
+
+def get_trace_args():
+    """Args of all spans this thread is in, to pass to work done in other threads (whose span stacks are empty)."""
+    args = {}
+    if tracer is not None:
+        for span_args in getattr(tracer.local, "spans", []):
+            args.update(span_args)
+    return args
+
+def traced(*arg_names):
+    """Decorator that records each call as a span named after the function, with the given arguments as span args."""
+    def decorator(function):
+        signature = inspect.signature(function)
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            with trace(function.__name__, **{name: bound.arguments.get(name) for name in arg_names}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
 
 @contextlib.contextmanager
 def suppress_output():
@@ -0,0 +1,34 @@
+import pickle
+import sqlite3
+import threading
+
+class RunStateStore:
+    """Append-only log of finished jobs of a run in a single SQLite file, used to resume the run where it stopped.
+
+    Each record is one (kind, iteration, parallel run id, value) row written in its own transaction, so a run killed at
+    any point leaves a consistent log, and restoring replays the records in order (see restore_run() in run_eurekaverse.py).
+    Values are pickled, since the run's state uses int keys and tuples that JSON can't keep."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, it INTEGER, parallel_run_id INTEGER, value BLOB)")
+        self.lock = threading.Lock()
+
+    def append(self, kind, value, it=None, parallel_run_id=None):
+        with self.lock:
+            self.connection.execute("INSERT INTO records (kind, it, parallel_run_id, value) VALUES (?, ?, ?, ?)", (kind, it, parallel_run_id, pickle.dumps(value)))
+
+    def records(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT kind, it, parallel_run_id, value FROM records ORDER BY id").fetchall()
+        return [(kind, it, parallel_run_id, pickle.loads(value)) for kind, it, parallel_run_id, value in rows]
+
+    def latest(self, kind):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM records WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)).fetchone()
+        return pickle.loads(row[0]) if row is not None else None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -8,6 +8,15 @@ import numpy as np
 import inspect
 import shutil
 import random  # This is used by set_terrain in compute_terrain_stats()
+import multiprocessing as mp
+import resource
+import signal
+import traceback
+import sqlite3
+import hashlib
+import json
+import threading
+import copy
 
 from eurekaverse.utils.misc_utils import suppress_output
 
@@ -15,7 +24,8 @@ with suppress_output():
     from isaacgym import terrain_utils
     from legged_gym.envs.base.legged_robot_config import LeggedRobotCfg
     from legged_gym.utils import set_seed
-    from legged_gym.utils.terrain_gpt import fix_terrain, calc_direct_path_heights
+    from legged_gym.eval.eval_results import load_eval_results
+    from legged_gym.utils.terrain_gpt import Terrain, fix_terrain, calc_direct_path_heights
 
 file_dir = os.path.dirname(os.path.abspath(__file__))  # Location of this file
 with open(Path(f"{file_dir}/../gpt/terrain_template.py")) as f:
@@ -27,6 +37,11 @@ if not terrain_file_dir.exists():
 #       This does not always hold true if there is un-indented code between functions, but we filter these out in query_gpt()
 function_pattern = r"(^def\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\((.*?)\):([\S\s]+?))(?=^def|\Z)"
 
+# Pre-forked workers for checking generated terrains on CPU (see start_check_pool())
+check_pool = None
+check_terrain_cfg = None
+check_cpu_time_limit = None
+
 def get_terrain(terrain_filename):
     with open(terrain_file_dir / (terrain_filename + ".py"), "r") as f:
         return f.read()
@@ -107,7 +122,17 @@ def extract_evaluation_stats(eval_string):
 def stat_to_str(stats):
     return "\n".join([f"{key}: {val}" for key, val in stats.items()])
 
+def get_eval_stats_from_results(eval_results_file):
+    results = load_eval_results(eval_results_file)
+    # Round like the printed results, since these stats are also shown to GPT
+    round_stats = lambda stats: {key: round(val, 2) for key, val in stats.items()}
+    return round_stats(results["summary"]), {terrain_type: round_stats(stats) for terrain_type, stats in results["per_type"].items()}
+
 def get_eval_stats_from_file(eval_log_file):
+    # Prefer the structured results saved next to the log, only parse the printed results for older evaluations
+    eval_results_file = Path(eval_log_file).with_suffix(".json")
+    if eval_results_file.exists():
+        return get_eval_stats_from_results(eval_results_file)
     with open(eval_log_file) as f:
         eval_data = f.read()
         eval_summary_string, eval_strings_per_terrain = extract_evaluation_strings(eval_data)
@@ -115,6 +140,55 @@ def get_eval_stats_from_file(eval_log_file):
         eval_stats_per_terrain = {terrain_type: extract_evaluation_stats(string) for terrain_type, string in eval_strings_per_terrain.items()}
     return eval_summary_stats, eval_stats_per_terrain
 
+def aggregate_terrain_stats(stats_per_terrain, weights):
+    """Weighted mean of per-terrain stats, where terrains sampled from a larger set are weighted by how many terrains
+    each stands for (weight > 1). Also returns the standard error of each mean due to that sampling (0 if nothing was sampled)."""
+    summary_stats, std_errors = {}, {}
+    if len(stats_per_terrain) == 0:
+        return summary_stats, std_errors
+    total_weight = sum(weights)
+    for key in stats_per_terrain[0].keys():
+        values = [(weight, stats[key]) for weight, stats in zip(weights, stats_per_terrain) if stats[key] is not None]
+        summary_stats[key] = sum(weight * value for weight, value in values) / sum(weight for weight, _ in values)
+        sampled = [value for weight, value in values if weight > 1]
+        if len(sampled) > 1:
+            # All sampled terrains share one weight, num_population / num_sampled
+            num_population = next(weight for weight, _ in values if weight > 1) * len(sampled)
+            correction = 1 - len(sampled) / num_population
+            std_errors[key] = num_population / total_weight * np.std(sampled, ddof=1) / np.sqrt(len(sampled)) * np.sqrt(correction)
+        else:
+            std_errors[key] = 0.0
+    return summary_stats, std_errors
+
+class EvalResultCache:
+    """Persistent cache of evaluation outputs (printed results and results JSON) in a single SQLite file.
+    Keyed on the checkpoint, terrain and eval config, so nothing is evaluated twice, even across restarts."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS evaluations (key TEXT PRIMARY KEY, output TEXT, results TEXT)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(checkpoint_file, terrain_type, eval_config):
+        with open(checkpoint_file, "rb") as f:
+            checkpoint_hash = hashlib.sha256(f.read()).hexdigest()
+        # Generated terrains are identified by their code, so renamed copies of the same terrains still hit the cache
+        terrain_file = terrain_file_dir / f"set_terrain_{terrain_type}.py"
+        terrain = hashlib.sha256(terrain_file.read_bytes()).hexdigest() if terrain_file.exists() else terrain_type
+        key = json.dumps({"checkpoint": checkpoint_hash, "terrain": terrain, "config": eval_config}, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT output, results FROM evaluations WHERE key = ?", (key,)).fetchone()
+        return row
+
+    def put(self, key, output, results):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?)", (key, output, results))
+
 def load_terrain_function_from_string(string):
     local_scope = {}
     exec(string, globals(), local_scope)
@@ -179,7 +253,7 @@ def compute_terrain_stats(terrain_fn_string):
             start_location = np.array([2, (terrain.length / 2 * terrain.horizontal_scale)])
             goals = np.concatenate([start_location[None, :], terrain.goals], axis=0) / terrain.horizontal_scale
             _, heights = calc_direct_path_heights(terrain.height_field_raw, goals, skip_size=round(1 / terrain.horizontal_scale))
-            heights = np.array([i for sublist in heights for i in sublist], dtype=np.float64) * terrain.vertical_scale  # Squash list, convert to meters
+            heights = np.concatenate(heights).astype(np.float64) * terrain.vertical_scale  # Squash list, convert to meters
 
             # Compute statistics on heights
             if set_idx not in stats:
@@ -224,3 +298,96 @@ def extract_fixed_terrains(cfg, train_log_file):
 
 def get_num_total_goals():
     return LeggedRobotCfg.terrain.num_goals
+
+def get_task_terrain_cfg(task):
+    """Returns the terrain config that train.py uses for the task, so checks build the same terrain."""
+    from legged_gym.envs import task_registry
+    env_cfg, _ = task_registry.get_cfgs(task)
+    return env_cfg.terrain
+
+class StringTerrain(Terrain):
+    """Terrain built from a set_terrain function loaded from a string, rather than from a terrain file."""
+    def __init__(self, cfg, set_terrain_fn):
+        self.string_set_terrain_fn = set_terrain_fn
+        super().__init__(cfg, num_robots=1)
+
+    def load_set_terrain_fn(self):
+        return self.string_set_terrain_fn
+
+def check_terrain_feasibility_from_string(terrain_fn_string, terrain_cfg):
+    """Builds the terrain like train.py with --check_terrain_feasibility does, raises if any sub-terrain is broken or infeasible.
+    That check passes once the heightmap is converted to a mesh, so we stop before the conversion too."""
+    cfg = copy.deepcopy(terrain_cfg)
+    cfg.type = "check"  # Not a built-in terrain, so it gets fixed and checked
+    cfg.check_feasibility = True
+    cfg.mesh_type = "heightfield"
+    cfg.use_cache = False
+    cfg.num_workers = 0  # Pool workers are daemons, which can't start their own workers
+
+    # Execute in a fresh namespace, like loading the terrain file as a module
+    scope = {}
+    exec(terrain_fn_string, scope)
+    StringTerrain(cfg, scope["set_terrain"])
+
+def raise_cpu_time_exceeded(signum, frame):
+    raise TimeoutError(f"Terrain check exceeded CPU time limit of {check_cpu_time_limit}s")
+
+def init_check_worker(terrain_cfg, cpu_time_limit, memory_limit):
+    global check_terrain_cfg, check_cpu_time_limit
+    check_terrain_cfg = terrain_cfg
+    check_cpu_time_limit = cpu_time_limit
+    # The soft CPU time limit sends SIGXCPU, which we turn into an exception so the worker survives
+    signal.signal(signal.SIGXCPU, raise_cpu_time_exceeded)
+    if memory_limit is not None:
+        # Allow memory_limit (in GB) on top of what the worker inherited, allocating past it raises MemoryError
+        with open("/proc/self/statm") as f:
+            inherited_memory = int(f.read().split()[0]) * resource.getpagesize()
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (inherited_memory + int(memory_limit * 1e9), hard))
+
+def check_terrain_in_worker(terrain_fn_string, timeout):
+    # Past the wall-clock timeout (e.g. the terrain sleeps or blocks, which the CPU time limit doesn't catch), the worker exits
+    # The pool then replaces it with a fresh worker, so it isn't held forever
+    watchdog = threading.Timer(timeout, os._exit, (1,))
+    watchdog.daemon = True
+    watchdog.start()
+    if check_cpu_time_limit is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_time = usage.ru_utime + usage.ru_stime
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_time + check_cpu_time_limit) + 1, hard))
+    try:
+        with suppress_output():
+            check_terrain_feasibility_from_string(terrain_fn_string, check_terrain_cfg)
+        return True, ""
+    except BaseException:
+        return False, traceback.format_exc()
+    finally:
+        watchdog.cancel()
+        if check_cpu_time_limit is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def start_check_pool(num_workers, terrain_cfg, cpu_time_limit=60, memory_limit=4):
+    """Forks workers that check generated terrains without starting a simulation, call before starting other threads.
+    Terrains are built with terrain_cfg, use get_task_terrain_cfg() to match the checks of train.py."""
+    global check_pool
+    if check_pool is None:
+        check_pool = mp.get_context("fork").Pool(num_workers, initializer=init_check_worker, initargs=(terrain_cfg, cpu_time_limit, memory_limit))
+    return check_pool
+
+def stop_check_pool():
+    global check_pool
+    if check_pool is not None:
+        check_pool.terminate()
+        check_pool = None
+
+def check_terrain_in_pool(terrain_fn_string, timeout):
+    """Returns whether the terrain code is feasible and the traceback if not."""
+    result = check_pool.apply_async(check_terrain_in_worker, (terrain_fn_string, timeout))
+    try:
+        return result.get(timeout=timeout)
+    except mp.TimeoutError:
+        return False, f"Terrain check timed out after {timeout}s"
+    except Exception as e:
+        # E.g., the CPU time limit was hit after the check itself finished
+        return False, repr(e)
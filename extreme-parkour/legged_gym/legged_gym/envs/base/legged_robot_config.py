@@ -28,6 +28,9 @@
 #
 # Copyright (c) 2021 ETH Zurich, Nikita Rudin
 
+import os
+
+from legged_gym import LEGGED_GYM_ROOT_DIR
 from legged_gym.envs.base.base_config import BaseConfig
 
 class LeggedRobotCfg(BaseConfig):
@@ -149,6 +152,10 @@ class LeggedRobotCfg(BaseConfig):
     class terrain:
         type = "default"  # Which set_terrain() function to use
         check_feasibility = False  # Whether to check terrain validity and feasibility (used to check generated terrains)
+        num_workers = 0  # Number of processes to build sub-terrains with (0 or 1 builds serially)
+        use_cache = False  # Whether to cache built terrains on disk, keyed on the set_terrain code and this config
+        cache_dir = os.path.join(LEGGED_GYM_ROOT_DIR, "logs", "terrain_cache")
+        cache_max_size = 50  # [GB] Least recently used terrains are evicted past this size
 
         mesh_type = 'trimesh' # "heightfield" # none, plane, heightfield or trimesh
         hf2mesh_method = "grid"  # grid or fast
@@ -429,6 +436,7 @@ class LeggedRobotCfgPPO(BaseConfig):
         hidden_dims = 512
         learning_rate = 1.e-3
         num_steps_per_env = LeggedRobotCfg.depth.update_interval * 24
+        bptt_window = None # backpropagate through the depth encoder this many steps at a time (multiple of depth.update_interval), None = num_steps_per_env
 
     class estimator:
         train_with_estimated_states = True
@@ -443,9 +451,12 @@ class LeggedRobotCfgPPO(BaseConfig):
         algorithm_class_name = 'PPO'
         num_steps_per_env = 24 # per iteration
         max_iterations = 5000 # number of policy updates
+        lean_storage = False # store the proprio history in observations once per step instead of in every observation (~60% less rollout memory)
 
         # logging
         save_interval = 500 # check for potential saves every this many iterations
+        keep_last_checkpoints = -1 # only keep this many of the latest checkpoints, -1 = keep all
+        keep_checkpoint_interval = 0 # but always keep checkpoints at multiples of this many iterations, 0 = none
         experiment_name = 'rough_a1'
         run_name = ''
         # load and resume
@@ -0,0 +1 @@
+# Evaluation utilities that don't import Isaac Gym or legged_gym.envs, so processes that don't simulate can use them
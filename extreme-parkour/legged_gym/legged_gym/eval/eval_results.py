@@ -0,0 +1,55 @@
+import os
+import json
+import torch
+
+# Bump when the layout of the results changes, so loaders can tell old files apart
+EVAL_RESULTS_VERSION = 1
+
+def save_eval_results(results, path):
+    """Atomically writes evaluation results from evaluate(), so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": EVAL_RESULTS_VERSION, **results}, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_eval_results(path):
+    """Loads evaluation results, with terrain types and levels as ints again (JSON keys are always strings).
+
+    Results contain the "exptid", "terrain_type" and "checkpoint" that were evaluated, the overall "summary" stats,
+    stats "per_type" and "per_level", and "per_cell", a list of stats with their "terrain_type" and "level"."""
+    with open(path) as f:
+        results = json.load(f)
+    if results.get("version") != EVAL_RESULTS_VERSION:
+        raise ValueError(f"Unsupported evaluation results version {results.get('version')} in {path}, expected {EVAL_RESULTS_VERSION}")
+    results["per_type"] = {int(terrain_type): stats for terrain_type, stats in results["per_type"].items()}
+    results["per_level"] = {int(level): stats for level, stats in results["per_level"].items()}
+    return results
+
+def mean_per_cell(env_class, terrain_levels, sums_per_env, counter_per_env):
+    """Averages per-env sums over each (terrain type, level) cell, weighted by the number of episodes per env.
+    sums_per_env maps metric names to per-env tensors. Returns {name: {cell: mean}} with one index_add_ over all metrics,
+    instead of masking every metric once per cell."""
+    env_class, terrain_levels = env_class.cpu().long(), terrain_levels.cpu().long()
+    num_levels = int(terrain_levels.max()) + 1
+    cell_ids, env_cells = torch.unique(env_class * num_levels + terrain_levels, return_inverse=True)
+    cells = [(int(cell_id) // num_levels, int(cell_id) % num_levels) for cell_id in cell_ids]
+
+    names = list(sums_per_env.keys())
+    stacked = torch.stack([counter_per_env.cpu()] + [sums_per_env[name].cpu() for name in names], dim=1)
+    sums_per_cell = torch.zeros(len(cells), stacked.shape[1], dtype=stacked.dtype).index_add_(0, env_cells, stacked)
+    means_per_cell = sums_per_cell[:, 1:] / sums_per_cell[:, :1]
+    # Clone so each pickled mean doesn't carry the storage of the whole table
+    return {name: {cell: means_per_cell[i, j].clone() for i, cell in enumerate(cells)} for j, name in enumerate(names)}
+
+def partition_envs(env_class, terrain_levels, num_groups):
+    """Splits envs into num_groups groups of env ids, spreading the envs of each (terrain type, level) cell evenly so
+    every group sees the same terrains."""
+    cell_ids = env_class.long() * (int(terrain_levels.max()) + 1) + terrain_levels.long()
+    groups = [[] for _ in range(num_groups)]
+    for cell_id in torch.unique(cell_ids):
+        env_ids = (cell_ids == cell_id).nonzero(as_tuple=False)[:, 0]
+        if len(env_ids) < num_groups:
+            raise ValueError(f"Only {len(env_ids)} envs per terrain cell, need at least {num_groups} to split them between all groups")
+        for i in range(num_groups):
+            groups[i].append(env_ids[i::num_groups])
+    return [torch.sort(torch.cat(group))[0] for group in groups]
@@ -0,0 +1,165 @@
+import os
+import hashlib
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+
+from legged_gym import LEGGED_GYM_ROOT_DIR
+
+# Evaluation jobs are dicts such as {"exptid": ..., "terrain_type": ..., "checkpoint": -1, "max_steps": ...}
+# Servers only listen on localhost, the key just keeps other local processes from sending jobs by accident
+EVAL_SERVER_AUTHKEY = b"legged_gym_eval_server"
+EVAL_SERVER_READY_LOG = "Evaluation server listening on port"
+# Job args that only pick the policy and where its results go, all other args (e.g. num_envs, max_steps) key the env
+POLICY_JOB_ARGS = ["exptid", "checkpoint", "metric_granularity", "no_save", "results_file"]
+
+def get_terrain_key(terrain_type):
+    """Identifies the terrain an env was built with, including the contents of generated set_terrain files."""
+    filepath = f"{LEGGED_GYM_ROOT_DIR}/legged_gym/utils/set_terrains/set_terrain_{terrain_type}.py"
+    if not os.path.exists(filepath):
+        return terrain_type
+    with open(filepath, "rb") as f:
+        return f"{terrain_type}:{hashlib.sha256(f.read()).hexdigest()}"
+
+def get_env_args(job):
+    """The job args that the env depends on, jobs with the same env args can share an env."""
+    return repr(sorted((key, value) for key, value in job.items() if key not in POLICY_JOB_ARGS))
+
+def get_env_key(job):
+    """Identifies the env a job needs, including the contents of generated set_terrain files."""
+    return get_terrain_key(job["terrain_type"]), get_env_args(job)
+
+class EvalServer:
+    """Runs evaluation jobs one at a time, keeping the env alive between jobs on the same terrain and env args.
+
+    The backend provides make_env(job), which (re)builds the env for the job's terrain, and evaluate(job), which loads
+    the job's policy into the current env and returns a dict of results. See scripts/evaluate_server.py for the Isaac
+    Gym backend and FakeEvalBackend for testing without a simulator."""
+
+    def __init__(self, backend, port=0):
+        self.backend = backend
+        self.listener = Listener(("localhost", port), authkey=EVAL_SERVER_AUTHKEY)
+        self.port = self.listener.address[1]
+        self.env_key = None
+        self.num_env_builds = 0
+
+    def serve_forever(self):
+        print(f"{EVAL_SERVER_READY_LOG} {self.port}", flush=True)
+        while True:
+            with self.listener.accept() as connection:
+                job = connection.recv()
+                if job is None:
+                    connection.send({"success": True})
+                    break
+                connection.send(self.run_job(job))
+        self.listener.close()
+
+    def run_job(self, job):
+        try:
+            env_key = get_env_key(job)
+            if env_key != self.env_key:
+                print(f"Building env for terrain {job['terrain_type']}...", flush=True)
+                self.env_key = None  # In case building fails halfway
+                self.backend.make_env(job)
+                self.env_key = env_key
+                self.num_env_builds += 1
+            print(f"Evaluating {job['exptid']} on terrain {job['terrain_type']}...", flush=True)
+            results = self.backend.evaluate(job)
+            return {"success": True, "num_env_builds": self.num_env_builds, **results}
+        except BaseException:
+            # Also catches exit() from evaluate(), the server should keep running
+            error = traceback.format_exc()
+            print(error, flush=True)
+            return {"success": False, "error": error}
+
+def send_eval_job(port, job):
+    """Sends a job to the server on port, blocks until it's done and returns the result (None shuts the server down)."""
+    with Client(("localhost", port), authkey=EVAL_SERVER_AUTHKEY) as connection:
+        connection.send(job)
+        return connection.recv()
+
+class EvalServerPool:
+    """Schedules evaluation jobs on up to servers_per_device servers per device.
+
+    start_server(device) starts a server and returns its port. A job goes to an idle server on its device, preferring one
+    that last evaluated a job with the same env args (see get_env_args()) so its env doesn't need a rebuild. New servers are only started when all
+    servers on the device are busy."""
+
+    def __init__(self, start_server, servers_per_device=1):
+        self.start_server = start_server
+        self.servers_per_device = servers_per_device
+        self.servers = {}  # Device -> list of {"port", "env_args", "busy"}
+        self.condition = threading.Condition()
+
+    def acquire_server(self, device, env_args):
+        with self.condition:
+            while True:
+                servers = self.servers.setdefault(device, [])
+                idle_servers = [server for server in servers if not server["busy"]]
+                matching_servers = [server for server in idle_servers if server["env_args"] == env_args]
+                if idle_servers:
+                    # Rebuilding an idle server's env is cheaper than starting a new server
+                    server = (matching_servers or idle_servers)[0]
+                    server["busy"] = True
+                    return server
+                if len(servers) < self.servers_per_device:
+                    # Reserve a slot while the server starts, without holding the lock
+                    server = {"port": None, "env_args": None, "busy": True}
+                    servers.append(server)
+                    break
+                self.condition.wait()
+
+        try:
+            server["port"] = self.start_server(device)
+        except BaseException:
+            with self.condition:
+                self.servers[device].remove(server)
+                self.condition.notify_all()
+            raise
+        return server
+
+    def release_server(self, server, env_args):
+        with self.condition:
+            server["env_args"] = env_args
+            server["busy"] = False
+            self.condition.notify_all()
+
+    def run(self, job, device):
+        env_args = get_env_args(job)
+        server = self.acquire_server(device, env_args)
+        try:
+            result = send_eval_job(server["port"], job)
+        except (ConnectionError, EOFError):
+            # The server died, so forget about it and let the next job start a new one
+            with self.condition:
+                self.servers[device].remove(server)
+                self.condition.notify_all()
+            return {"success": False, "error": traceback.format_exc()}
+        self.release_server(server, env_args)
+        return result
+
+    def shutdown(self):
+        with self.condition:
+            servers = [server for device_servers in self.servers.values() for server in device_servers]
+            self.servers = {}
+        for server in servers:
+            try:
+                send_eval_job(server["port"], None)
+            except (ConnectionError, EOFError):
+                pass
+
+class FakeEvalBackend:
+    """Backend without a simulator for testing the server and scheduling, records the calls it gets."""
+
+    def __init__(self):
+        self.env_builds = []
+        self.evaluations = []
+
+    def make_env(self, job):
+        self.env_builds.append(job["terrain_type"])
+
+    def evaluate(self, job):
+        self.evaluations.append(job["exptid"])
+        stats = {"Number of goals reached": float(len(self.evaluations))}
+        results = {"exptid": job["exptid"], "terrain_type": job["terrain_type"], "checkpoint": "fake", "summary": stats, "per_type": {0: stats}, "per_level": {0: stats}, "per_cell": []}
+        return {"output": f"STATISTICS SUMMARY\nNumber of goals reached: {len(self.evaluations):.2f}\n", "results": results}
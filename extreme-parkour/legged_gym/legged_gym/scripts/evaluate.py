@@ -49,17 +49,42 @@ from legged_gym import LEGGED_GYM_ROOT_DIR
 from legged_gym.envs import *
 from legged_gym.utils import task_registry, add_shared_args, process_args, webviewer
 from legged_gym.utils.helpers import get_checkpoint
+from legged_gym.eval.eval_results import save_eval_results, mean_per_cell, partition_envs
 
-def evaluate(args):
-    if args.web:
-        web_viewer = webviewer.WebViewer()
-    faulthandler.enable()
+class EpisodeMetrics:
+    """Sums metrics over the finished episodes of each env."""
 
-    load_dir = Path(LEGGED_GYM_ROOT_DIR) / "logs" / args.proj_name / args.exptid
-    if not load_dir.exists():
-        print(f"Error: {load_dir} does not exist!")
-        exit()
+    def __init__(self, env):
+        self.rew_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+        self.rew_terms_sum_per_env = {term: torch.zeros(env.num_envs, dtype=torch.float, device=env.device) for term in env.rew_term_sums.keys()}
+        self.len_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+        self.goals_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+        self.sum_counter_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+        self.edge_violation_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+        self.cur_episode_length = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
 
+    def update(self, env, dones, infos):
+        cur_rew_sums = infos["rew_sums"]
+        cur_reward_term_sums = infos["rew_term_sums"]
+        cur_goal_idx = infos["cur_goal_idx"]
+        feet_at_edge = env.feet_at_edge.clone().float()
+        self.cur_episode_length += 1
+
+        new_ids = (dones > 0).nonzero(as_tuple=False)[:, 0]
+        self.rew_sum_per_env[new_ids] += cur_rew_sums[new_ids]
+        for term in self.rew_terms_sum_per_env.keys():
+            self.rew_terms_sum_per_env[term][new_ids] += cur_reward_term_sums[term][new_ids]
+        self.len_sum_per_env[new_ids] += self.cur_episode_length[new_ids]
+        self.goals_sum_per_env[new_ids] += cur_goal_idx[new_ids]
+        self.sum_counter_per_env[new_ids] += 1
+        self.edge_violation_sum_per_env[:] += feet_at_edge.sum(dim=1)
+        self.cur_episode_length[new_ids] = 0
+
+def get_load_dir(args):
+    return Path(LEGGED_GYM_ROOT_DIR) / "logs" / args.proj_name / args.exptid
+
+def make_eval_env(args):
+    load_dir = get_load_dir(args)
     try:
         env_cfg, train_cfg = task_registry.get_saved_cfgs(load_dir=load_dir)
         if env_cfg is None or train_cfg is None:
@@ -95,21 +120,30 @@ def evaluate(args):
     # prepare environment
     env: LeggedRobot
     env, _ = task_registry.make_env(name=args.task, args=args, env_cfg=env_cfg)
-    obs = env.get_observations()
+    return env, env_cfg, train_cfg
 
-    total_steps = args.max_steps if (args.max_steps is not None and args.max_steps > 0) else 10 * int(env.max_episode_length)
+def evaluate(args, env=None, env_cfg=None, train_cfg=None, ppo_runner=None):
+    """Evaluates the policy of args.exptid and returns the printed results and the results dict (see eval_results.py).
+    To evaluate several policies without recreating the sim (see evaluate_server.py), pass in the env and configs from
+    make_eval_env() and the runner returned by the previous call, in which case only the policy weights are reloaded."""
+    if args.web:
+        web_viewer = webviewer.WebViewer()
+    faulthandler.enable()
+
+    load_dir = get_load_dir(args)
+    if not load_dir.exists():
+        print(f"Error: {load_dir} does not exist!")
+        exit()
 
-    # Buffers for metric tracking
-    rew_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    rew_terms_sum_per_env = {term: torch.zeros(env.num_envs, dtype=torch.float, device=env.device) for term in env.rew_term_sums.keys()}
-    len_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    goals_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    sum_counter_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    edge_violation_sum_per_env = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+    if env is None:
+        env, env_cfg, train_cfg = make_eval_env(args)
+        obs = env.get_observations()
+    else:
+        obs, _ = env.reset()
+
+    total_steps = args.max_steps if (args.max_steps is not None and args.max_steps > 0) else 10 * int(env.max_episode_length)
 
-    # cur_rew_sum = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    cur_episode_length = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
-    cur_time_from_start = torch.zeros(env.num_envs, dtype=torch.float, device=env.device)
+    metrics = EpisodeMetrics(env)
 
     if args.web:
         web_viewer.setup(env)
@@ -126,8 +160,15 @@ def evaluate(args):
         # parkour_actor.load(load_dir)
         checkpoint = "jit"
     else:
-        ppo_runner, train_cfg, _, loaded_dir, checkpoint = task_registry.make_alg_runner(env=env, args=args, name=args.task, train_cfg=train_cfg, log_root=load_dir)
-        assert load_dir == loaded_dir, f"Config loading directory {load_dir} is different from the runner loading directory {loaded_dir}!"
+        if ppo_runner is None:
+            ppo_runner, train_cfg, _, loaded_dir, checkpoint = task_registry.make_alg_runner(env=env, args=args, name=args.task, train_cfg=train_cfg, log_root=load_dir)
+            assert load_dir == loaded_dir, f"Config loading directory {load_dir} is different from the runner loading directory {loaded_dir}!"
+        else:
+            # Same networks as the previous evaluation, only load the new weights
+            checkpoint = get_checkpoint(load_dir, checkpoint=train_cfg.runner.checkpoint)
+            ppo_runner.load(os.path.join(load_dir, checkpoint))
+            if not train_cfg.policy.continue_from_last_std:
+                ppo_runner.alg.actor_critic.reset_std(train_cfg.policy.init_noise_std, 12, device=ppo_runner.device)
         if env.cfg.depth.use_camera:
             policy = ppo_runner.get_depth_actor_inference_policy(device=env.device)
             if env.cfg.depth.use_camera:
@@ -240,29 +281,7 @@ def evaluate(args):
 
         lookat_id = env.lookat_id
 
-        # Log stuff
-        # cur_rew_sum += rews
-        cur_rew_sums = infos["rew_sums"]
-        cur_reward_term_sums = infos["rew_term_sums"]
-        cur_goal_idx = infos["cur_goal_idx"]
-        feet_at_edge = env.feet_at_edge.clone().float()
-        cur_episode_length += 1
-        cur_time_from_start += 1
-
-        new_ids = (dones > 0).nonzero(as_tuple=False)[:, 0]
-        killed_ids = ((dones > 0) & (~infos["time_outs"])).nonzero(as_tuple=False)[:, 0]
-
-        rew_sum_per_env[new_ids] += cur_rew_sums[new_ids]
-        for term in rew_terms_sum_per_env.keys():
-            rew_terms_sum_per_env[term][new_ids] += cur_reward_term_sums[term][new_ids]
-        len_sum_per_env[new_ids] += cur_episode_length[new_ids]
-        goals_sum_per_env[new_ids] += cur_goal_idx[new_ids]
-        sum_counter_per_env[new_ids] += 1
-        edge_violation_sum_per_env[:] += feet_at_edge.sum(dim=1)
-
-        # cur_rew_sum[new_ids] = 0
-        cur_episode_length[new_ids] = 0
-        cur_time_from_start[killed_ids] = 0
+        metrics.update(env, dones, infos)
 
     if args.use_jit and not args.no_save:
         np.save(f'{load_dir}/action_replay.npy', torch.stack(action_replay).cpu().numpy())
@@ -270,26 +289,29 @@ def evaluate(args):
         np.save(f'{load_dir}/depth_replay.npy', torch.stack(depth_replay).cpu().numpy())
         np.save(f'{load_dir}/depth_latent_replay.npy', torch.stack(depth_latent_replay).cpu().numpy())
     
-    rew_sum_per_env = rew_sum_per_env.cpu()
-    rew_terms_sum_per_env = {term: rew_terms_sum_per_env[term].cpu() for term in rew_terms_sum_per_env.keys()}
-    len_sum_per_env = len_sum_per_env.cpu()
-    goals_sum_per_env = goals_sum_per_env.cpu()
-    sum_counter_per_env = sum_counter_per_env.cpu()
-    edge_violation_sum_per_env = edge_violation_sum_per_env.cpu()
-
-    terrain_cells = set(zip(env.env_class.cpu().numpy().tolist(), env.terrain_levels.cpu().numpy().tolist()))
-    mean_rew_per_cell_buffer, mean_rew_terms_per_cell_buffer, mean_len_per_cell_buffer, mean_goals_per_cell_buffer, mean_edge_violation_per_cell_buffer = {}, {}, {}, {}, {}
-    mean_rew_terms_per_cell_buffer = {term: {} for term in rew_terms_sum_per_env.keys()}
+    output, results = report_results(args, env_cfg, load_dir, args.exptid, checkpoint_name, metrics, env.env_class, env.terrain_levels)
+    return output, results, ppo_runner
+
+def report_results(args, env_cfg, load_dir, exptid, checkpoint_name, metrics, env_class, terrain_levels, env_ids=None):
+    """Prints and saves the results of the envs in env_ids (all envs if None), returns the printed results and the results dict."""
+    env_ids = env_ids if env_ids is not None else torch.arange(len(env_class), device=env_class.device)
+    env_class, terrain_levels = env_class[env_ids].cpu(), terrain_levels[env_ids].cpu()
+    rew_sum_per_env = metrics.rew_sum_per_env[env_ids].cpu()
+    rew_terms_sum_per_env = {term: metrics.rew_terms_sum_per_env[term][env_ids].cpu() for term in metrics.rew_terms_sum_per_env.keys()}
+    len_sum_per_env = metrics.len_sum_per_env[env_ids].cpu()
+    goals_sum_per_env = metrics.goals_sum_per_env[env_ids].cpu()
+    sum_counter_per_env = metrics.sum_counter_per_env[env_ids].cpu()
+    edge_violation_sum_per_env = metrics.edge_violation_sum_per_env[env_ids].cpu()
+
     sum_counter_per_env[sum_counter_per_env == 0] = 1  # Avoid division by zero
-    for cell in terrain_cells:
-        terrain_type, terrain_level = cell
-        ids = (env.env_class == terrain_type) & (env.terrain_levels == terrain_level)
-        mean_rew_per_cell_buffer[cell] = torch.sum(rew_sum_per_env[ids]) / torch.sum(sum_counter_per_env[ids])
-        for term in rew_terms_sum_per_env.keys():
-            mean_rew_terms_per_cell_buffer[term][cell] = torch.sum(rew_terms_sum_per_env[term][ids]) / torch.sum(sum_counter_per_env[ids])
-        mean_len_per_cell_buffer[cell] = torch.sum(len_sum_per_env[ids]) / torch.sum(sum_counter_per_env[ids])
-        mean_goals_per_cell_buffer[cell] = torch.sum(goals_sum_per_env[ids]) / torch.sum(sum_counter_per_env[ids])
-        mean_edge_violation_per_cell_buffer[cell] = torch.sum(edge_violation_sum_per_env[ids]) / torch.sum(sum_counter_per_env[ids])
+    sums_per_env = {"rew": rew_sum_per_env, "len": len_sum_per_env, "goals": goals_sum_per_env, "edge_violation": edge_violation_sum_per_env}
+    sums_per_env.update({("rew_term", term): rew_terms_sum_per_env[term] for term in rew_terms_sum_per_env.keys()})
+    means_per_cell = mean_per_cell(env_class, terrain_levels, sums_per_env, sum_counter_per_env)
+    mean_rew_per_cell_buffer = means_per_cell["rew"]
+    mean_rew_terms_per_cell_buffer = {term: means_per_cell[("rew_term", term)] for term in rew_terms_sum_per_env.keys()}
+    mean_len_per_cell_buffer = means_per_cell["len"]
+    mean_goals_per_cell_buffer = means_per_cell["goals"]
+    mean_edge_violation_per_cell_buffer = means_per_cell["edge_violation"]
     
     if not args.no_save:
         pickle_filename = f"{load_dir}/evaluation-{env_cfg.terrain.type}_{checkpoint_name}.pkl"
@@ -325,35 +347,35 @@ def evaluate(args):
         else:
             raise ValueError(f"Invalid granularity {granularity}")
     
+    def collect_stats(granularity):
+        # Compute mean statistics, weighing over each terrain type and difficulty equally
+        # We do this to avoid biasing the results towards harder terrains that cause more resets, which would put more entries in the buffer
+        means = {"Reward": aggregate_cells(mean_rew_per_cell_buffer, granularity)}
+        for term in mean_rew_terms_per_cell_buffer.keys():
+            means[f"Reward term {term}"] = aggregate_cells(mean_rew_terms_per_cell_buffer[term], granularity)
+        means["Episode length"] = aggregate_cells(mean_len_per_cell_buffer, granularity)
+        means["Number of goals reached"] = aggregate_cells(mean_goals_per_cell_buffer, granularity)
+        means["Edge violation"] = aggregate_cells(mean_edge_violation_per_cell_buffer, granularity)
+        if granularity == "overall":
+            return {name: float(mean) for name, mean in means.items()}
+        assert all(mean.keys() == means["Reward"].keys() for mean in means.values()), "Mismatch in keys for statistics"
+        return {i: {name: float(mean[i]) for name, mean in means.items()} for i in sorted(means["Reward"].keys())}
+
+    def stats_to_str(stats):
+        return "".join(f"{name}: {value:.2f}\n" for name, value in stats.items())
+
+    summary_stats = collect_stats("overall")
+    output = ""
     results_str = ""
     results_str += "STATISTICS SUMMARY\n"
-    rew_mean = aggregate_cells(mean_rew_per_cell_buffer, granularity="overall")
-    rew_terms_mean = {term: aggregate_cells(mean_rew_terms_per_cell_buffer[term], granularity="overall") for term in mean_rew_terms_per_cell_buffer.keys()}
-    len_mean = aggregate_cells(mean_len_per_cell_buffer, granularity="overall")
-    goals_mean = aggregate_cells(mean_goals_per_cell_buffer, granularity="overall")
-    edge_violation_mean = aggregate_cells(mean_edge_violation_per_cell_buffer, granularity="overall")
-    results_str += f"Reward: {rew_mean:.2f}\n"
-    for term in rew_terms_mean.keys():
-        results_str += f"Reward term {term}: {rew_terms_mean[term]:.2f}\n"
-    results_str += f"Episode length: {len_mean:.2f}\n"
-    results_str += f"Number of goals reached: {goals_mean:.2f}\n"
-    results_str += f"Edge violation: {edge_violation_mean:.2f}\n"
+    results_str += stats_to_str(summary_stats)
     results_str += "\n"
-    
+
+    stats_per = {granularity: collect_stats(granularity) for granularity in ["cell", "level", "type"]}
     granularities = [args.metric_granularity] if args.metric_granularity != "all" else ["cell", "level", "type"]
     for granularity in granularities:
-        # Compute mean statistics, weighing over each terrain type and difficulty equally
-        # We do this to avoid biasing the results towards harder terrains that cause more resets, which would put more entries in the buffer
-        rew_mean_per = aggregate_cells(mean_rew_per_cell_buffer, granularity)
-        rew_terms_mean_per = {term: aggregate_cells(mean_rew_terms_per_cell_buffer[term], granularity) for term in mean_rew_terms_per_cell_buffer.keys()}
-        len_mean_per = aggregate_cells(mean_len_per_cell_buffer, granularity)
-        goals_mean_per = aggregate_cells(mean_goals_per_cell_buffer, granularity)
-        edge_violation_mean_per = aggregate_cells(mean_edge_violation_per_cell_buffer, granularity)
-        assert rew_mean_per.keys() == len_mean_per.keys() == goals_mean_per.keys() == edge_violation_mean_per.keys(), "Mismatch in keys for statistics"
-
-
         granularity_results_str = ""
-        for i in sorted(rew_mean_per.keys()):
+        for i, stats in stats_per[granularity].items():
             if granularity == "cell":
                 terrain_type, terrain_level = i
                 granularity_results_str += f"STATISTICS FOR TERRAIN TYPE {terrain_type:02}, LEVEL {terrain_level:02}\n"
@@ -361,17 +383,13 @@ def evaluate(args):
                 granularity_results_str += f"STATISTICS FOR TERRAIN TYPE {i:02}\n"
             elif granularity == "level":
                 granularity_results_str += f"STATISTICS FOR TERRAIN LEVEL {i:02}\n"
-            granularity_results_str += f"Reward: {rew_mean_per[i]:.2f}\n"
-            for term in rew_terms_mean_per.keys():
-                granularity_results_str += f"Reward term {term}: {rew_terms_mean_per[term][i]:.2f}\n"
-            granularity_results_str += f"Episode length: {len_mean_per[i]:.2f}\n"
-            granularity_results_str += f"Number of goals reached: {goals_mean_per[i]:.2f}\n"
-            granularity_results_str += f"Edge violation: {edge_violation_mean_per[i]:.2f}\n"
+            granularity_results_str += stats_to_str(stats)
             granularity_results_str += "\n"
 
         # Print and save results
         if args.metric_granularity != "all":
             print(results_str + granularity_results_str)
+            output = results_str + granularity_results_str
         if not args.no_save:
             filepath = os.path.join(load_dir, f"evaluation-{env_cfg.terrain.type}_per-{granularity}_{checkpoint_name}.txt")
             if os.path.exists(filepath):
@@ -379,11 +397,23 @@ def evaluate(args):
             with open(filepath, "w", encoding='utf-8') as f:
                 f.write(results_str + granularity_results_str)
     
+    results = {
+        "exptid": exptid,
+        "terrain_type": env_cfg.terrain.type,
+        "checkpoint": checkpoint_name,
+        "summary": summary_stats,
+        "per_type": stats_per["type"],
+        "per_level": stats_per["level"],
+        "per_cell": [{"terrain_type": int(terrain_type), "level": int(level), **stats} for (terrain_type, level), stats in stats_per["cell"].items()],
+    }
+    if args.results_file is not None:
+        save_eval_results(results, args.results_file)
+
     if "cell" in granularities:
         goals_mean_per = aggregate_cells(mean_goals_per_cell_buffer, "cell")
 
-        num_terrains = torch.unique(env.env_class).numel()
-        num_levels = torch.unique(env.terrain_levels).numel()
+        num_terrains = torch.unique(env_class).numel()
+        num_levels = torch.unique(terrain_levels).numel()
         per_row = min(5, num_terrains)
         fig, axs = plt.subplots(num_terrains // per_row, per_row, figsize=(24, 8))
         keys = sorted(list(goals_mean_per.keys()))
@@ -405,6 +435,70 @@ def evaluate(args):
             plt.savefig(save_filename)
         if args.plot_cells:
             plt.show()
+        plt.close("all")
+
+    return output, results
+
+def parse_policy(policy, default_checkpoint=-1):
+    # "exptid" or "exptid:checkpoint"
+    exptid, _, checkpoint = policy.partition(":")
+    return exptid, int(checkpoint) if checkpoint else default_checkpoint
+
+def evaluate_multiple(args):
+    """Evaluates all policies in args.policies in one sim, each stepping its own share of the envs in every terrain cell.
+    The env is built from the config of the first policy, so all policies should share observations and architecture.
+    Returns a list of (output, results) per policy."""
+    assert not args.use_jit and not args.replay_actions and not args.replay_depth, "Only supported when evaluating a single policy"
+    policies = [parse_policy(policy, args.checkpoint) for policy in args.policies]
+    policy_args = []
+    for exptid, checkpoint in policies:
+        policy_arg = copy.copy(args)
+        policy_arg.exptid, policy_arg.checkpoint = exptid, checkpoint
+        if args.results_file is not None:
+            policy_arg.results_file = args.results_file.format(exptid=exptid, checkpoint=checkpoint)
+        policy_args.append(policy_arg)
+    if args.results_file is not None:
+        assert len(set(policy_arg.results_file for policy_arg in policy_args)) == len(policies), "--results_file needs {exptid} and {checkpoint} to tell policies apart"
+    for policy_arg in policy_args:
+        if not get_load_dir(policy_arg).exists():
+            print(f"Error: {get_load_dir(policy_arg)} does not exist!")
+            exit()
+
+    env, env_cfg, train_cfg = make_eval_env(policy_args[0])
+    assert not env_cfg.depth.use_camera, "Depth policies are not supported when evaluating multiple policies"
+    obs = env.get_observations()
+    total_steps = args.max_steps if (args.max_steps is not None and args.max_steps > 0) else 10 * int(env.max_episode_length)
+    metrics = EpisodeMetrics(env)
+    env_ids_per_policy = partition_envs(env.env_class, env.terrain_levels, len(policies))
+
+    actors, checkpoint_names = [], []
+    for policy_arg in policy_args:
+        policy_train_cfg = deepcopy(train_cfg)
+        policy_train_cfg.runner.resume = True
+        policy_train_cfg.runner.load_run = policy_arg.exptid
+        policy_train_cfg.runner.checkpoint = policy_arg.checkpoint
+        ppo_runner, _, _, _, checkpoint = task_registry.make_alg_runner(env=env, args=policy_arg, name=args.task, train_cfg=policy_train_cfg, log_root=get_load_dir(policy_arg))
+        policy = ppo_runner.get_inference_policy(device=env.device)
+        actors.append(ppo_runner.alg.depth_actor if hasattr(ppo_runner.alg, "depth_actor") else policy)
+        checkpoint_names.append(checkpoint.replace(".pt", "").replace("_", "-"))
+
+    # Not vmapped: torch 1.10 has no torch.func to stack the weights of all policies into one call, and stacking them by hand would
+    # mean rewriting the forward of the actors' history and scan encoders. Each forward is batched over its policy's envs instead,
+    # so the loop costs one small kernel launch per policy and step, next to the sim step that all policies share.
+    actions = torch.zeros(env.num_envs, env.num_actions, device=env.device, requires_grad=False)
+    print(f"Running {len(policies)} policies for {total_steps} steps")
+    for t in tqdm(range(total_steps)):
+        with torch.no_grad():
+            for actor, env_ids in zip(actors, env_ids_per_policy):
+                actions[env_ids] = actor(obs[env_ids].detach(), hist_encoding=True, scandots_latent=None)
+        obs, _, rews, dones, infos = env.step(actions)
+        metrics.update(env, dones, infos)
+
+    outputs = []
+    for policy_arg, checkpoint_name, env_ids in zip(policy_args, checkpoint_names, env_ids_per_policy):
+        print(f"Results for {policy_arg.exptid} ({checkpoint_name}):")
+        outputs.append(report_results(policy_arg, env_cfg, get_load_dir(policy_arg), policy_arg.exptid, checkpoint_name, metrics, env.env_class, env.terrain_levels, env_ids))
+    return outputs
 
 if __name__ == '__main__':
     EXPORT_POLICY = False
@@ -421,6 +515,9 @@ if __name__ == '__main__':
     parser.add_argument("--metric_granularity", type=str, default="all", choices=["type", "level", "cell", "all"])
     parser.add_argument("--no_save", action="store_true", default=False, help="Do not save any evaluation results")
     parser.add_argument("--plot_cells", action="store_true", default=False, help="Plot evaluation results in new window")
+    parser.add_argument("--results_file", type=str, help="Also save all results to this JSON file (see eval_results.py)")
+    parser.add_argument("--policies", type=str, nargs="+", help="Evaluate several policies (exptid or exptid:checkpoint) in one sim, splitting the envs between them. "
+                        "--results_file may then contain {exptid} and {checkpoint}.")
 
     parser.add_argument("--replay_actions", action="store_true", default=False, help="Replay actions stored from deployment")
     parser.add_argument("--replay_depth", action="store_true", default=False, help="Replay depth stored from deployment")
@@ -440,4 +537,7 @@ if __name__ == '__main__':
             args.num_envs = args.terrain_rows * args.terrain_cols
     
     args.script = "evaluate"
-    evaluate(args)
+    if args.policies:
+        evaluate_multiple(args)
+    else:
+        evaluate(args)
@@ -0,0 +1,58 @@
+import argparse
+import copy
+
+import isaacgym
+from legged_gym.envs import *
+from legged_gym.utils import add_shared_args, process_args
+from legged_gym.eval.eval_server import EvalServer, FakeEvalBackend
+
+from evaluate import make_eval_env, evaluate
+
+class IsaacGymEvalBackend:
+    def __init__(self, args):
+        self.args = args
+        self.env = None
+
+    def get_job_args(self, job):
+        args = copy.copy(self.args)
+        for key, value in job.items():
+            setattr(args, key, value)
+        return args
+
+    def make_env(self, job):
+        if self.env is not None:
+            # Isaac Gym doesn't free the old sim by itself
+            self.env.gym.destroy_sim(self.env.sim)
+            self.env = None
+        self.env, self.env_cfg, self.train_cfg = make_eval_env(self.get_job_args(job))
+        self.ppo_runner = None
+
+    def evaluate(self, job):
+        output, results, self.ppo_runner = evaluate(self.get_job_args(job), self.env, self.env_cfg, self.train_cfg, self.ppo_runner)
+        return {"output": output, "results": results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_shared_args(parser)
+
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on. If 0, picks a free port and prints it.")
+    parser.add_argument("--fake_backend", action="store_true", default=False, help="Don't simulate anything, for testing job scheduling")
+
+    # Defaults for evaluate(), overridden by each job
+    parser.add_argument("--checkpoint", type=int, default=-1, help="Which model checkpoint to load. If -1, will load the last checkpoint.")
+    parser.add_argument("--max_steps", type=int, help="Maximum number of evaluation steps")
+    parser.add_argument("--metric_granularity", type=str, default="type", choices=["type", "level", "cell", "all"])
+    parser.add_argument("--no_save", action="store_true", default=False, help="Do not save any evaluation results")
+    parser.add_argument("--results_file", type=str, help="Also save all results to this JSON file (see eval_results.py)")
+
+    args = parser.parse_args()
+    args = process_args(args)
+    args.script = "evaluate"
+    args.use_jit = False
+    args.web = False
+    args.plot_cells = False
+    args.replay_actions = False
+    args.replay_depth = False
+
+    backend = FakeEvalBackend() if args.fake_backend else IsaacGymEvalBackend(args)
+    EvalServer(backend, port=args.port).serve_forever()
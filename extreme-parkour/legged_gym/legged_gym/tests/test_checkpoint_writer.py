@@ -0,0 +1,36 @@
+import isaacgym
+from legged_gym.envs import *
+import torch
+
+import os
+
+from legged_gym.utils.helpers import get_checkpoint
+from rsl_rl.utils import CheckpointWriter
+
+def test_checkpoint_writer(tmp_path):
+    model = torch.nn.Linear(3, 2)
+    optimizer = torch.optim.Adam(model.parameters())
+    writer = CheckpointWriter(keep_last=2, keep_interval=400)
+    for it in range(0, 1300, 100):
+        model.weight.data.fill_(it)
+        writer.save({"model_state_dict": model.state_dict(), "optimizer_state_dict": optimizer.state_dict(), "iter": it}, tmp_path / f"model_{it}.pt")
+        # The snapshot is taken when saving, later updates don't end up in the checkpoint
+        model.weight.data.fill_(-1)
+    writer.flush()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(f"model_{it}.pt" for it in [0, 400, 800, 1100, 1200])
+    for it in [400, 1200]:
+        loaded = torch.load(tmp_path / f"model_{it}.pt")
+        assert loaded["iter"] == it
+        assert torch.all(loaded["model_state_dict"]["weight"] == it)
+
+    # A checkpoint that is still being written is not the last one
+    (tmp_path / "model_1300.pt.tmp").write_bytes(b"")
+    assert get_checkpoint(tmp_path) == "model_1200.pt"
+
+    writer.save({"iter": 1300}, tmp_path / "missing_dir" / "model_1300.pt")
+    try:
+        writer.flush()
+        assert False, "Expected the failed write to raise"
+    except RuntimeError:
+        pass
@@ -0,0 +1,95 @@
+# Only the config classes are needed, imported first since legged_gym.envs has to import isaacgym before torch
+from legged_gym.envs.base.legged_robot_config import LeggedRobotCfg, LeggedRobotCfgPPO
+from legged_gym.utils.helpers import class_to_dict
+import torch
+
+from rsl_rl.runners import OnPolicyRunner
+
+class FakeDepthEnv:
+    """Random observations and depth images, which depend on the actions so that the rollout depends on the policy"""
+
+    def __init__(self, cfg, num_envs=4):
+        self.cfg = cfg
+        self.num_envs = num_envs
+        self.num_obs = cfg.env.num_observations
+        self.num_privileged_obs = cfg.env.num_privileged_obs
+        self.num_actions = cfg.env.num_actions
+        self.generator = torch.Generator().manual_seed(0)
+        self.obs = torch.randn(num_envs, self.num_obs, generator=self.generator)
+        self.depth_buffer = torch.rand(num_envs, cfg.depth.depth_buf_len, 60, 90, generator=self.generator)
+        self.global_counter = 0
+
+    def get_observations(self):
+        return self.obs
+
+    def step(self, actions):
+        self.global_counter += 1
+        self.obs = torch.randn(self.num_envs, self.num_obs, generator=self.generator) + actions.sum(dim=1, keepdim=True)
+        infos = {
+            "depth": None,
+            "delta_yaw_ok": torch.rand(self.num_envs, generator=self.generator) < 0.5,
+            "inc_goal": torch.zeros(self.num_envs),
+        }
+        if self.global_counter % self.cfg.depth.update_interval == 0:
+            self.depth_buffer = torch.rand(self.depth_buffer.shape, generator=self.generator)
+            infos["depth"] = self.depth_buffer[:, 0]
+        rewards = torch.randn(self.num_envs, generator=self.generator)
+        dones = torch.rand(self.num_envs, generator=self.generator) < 0.05
+        return self.obs, None, rewards, dones, infos
+
+def make_runner(log_dir, bptt_window):
+    train_cfg = LeggedRobotCfgPPO()
+    train_cfg.depth_encoder.if_depth = True
+    train_cfg.depth_encoder.train_direction_distillation = True
+    train_cfg.depth_encoder.num_steps_per_env = 30
+    train_cfg.depth_encoder.bptt_window = bptt_window
+    torch.manual_seed(0)
+    runner = OnPolicyRunner(FakeDepthEnv(LeggedRobotCfg()), class_to_dict(train_cfg), log_dir=str(log_dir), device="cpu")
+    runner.logged = []
+    runner.log = lambda locs, vision: runner.logged.append((locs["depth_actor_loss"], locs["yaw_loss"]))
+    return runner
+
+def learn_vision_full_rollout(runner):
+    """Reference, the update of learn_vision before windows, which backpropagates through the whole rollout at once"""
+    env, alg, n_proprio = runner.env, runner.alg, runner.env.cfg.env.n_proprio
+    obs = env.get_observations()
+    infos = {"depth": env.depth_buffer.clone()[:, 0], "delta_yaw_ok": torch.zeros(env.num_envs, dtype=torch.bool)}
+    actions_teacher_buffer, actions_student_buffer, yaw_buffer_student, yaw_buffer_teacher = [], [], [], []
+    for i in range(runner.depth_encoder_cfg["num_steps_per_env"]):
+        if infos["depth"] is not None:
+            obs_prop_depth = obs[:, :n_proprio].clone()
+            obs_prop_depth[:, 5:7] = 0
+            depth_encoder_output = alg.depth_encoder(infos["depth"].clone(), obs_prop_depth)
+            depth_latent = depth_encoder_output[:, :-2]
+            yaw = 1.5 * depth_encoder_output[:, -2:]
+            yaw_buffer_student.append(yaw)
+            yaw_buffer_teacher.append(obs[:, 5:7])
+        with torch.no_grad():
+            actions_teacher_buffer.append(alg.actor_critic.act_inference(obs, hist_encoding=True, scandots_latent=None))
+        obs_student = obs.clone()
+        obs_student[infos["delta_yaw_ok"], 5:7] = yaw.detach()[infos["delta_yaw_ok"]]
+        actions_student = alg.depth_actor(obs_student, hist_encoding=True, scandots_latent=depth_latent)
+        actions_student_buffer.append(actions_student)
+        obs, _, _, _, infos = env.step(actions_student.detach())
+    return alg.update_depth_actor(torch.cat(actions_student_buffer), torch.cat(actions_teacher_buffer), torch.cat(yaw_buffer_student), torch.cat(yaw_buffer_teacher))
+
+def test_depth_bptt(tmp_path):
+    reference = make_runner(tmp_path, None)
+    reference.alg.depth_encoder.train()
+    reference.alg.depth_actor.train()
+    reference_losses = learn_vision_full_rollout(reference)
+
+    # A window as long as the rollout is the same update
+    full = make_runner(tmp_path, 30)
+    full.learn_vision(1)
+    assert full.logged == [reference_losses]
+    for module in ["depth_encoder", "depth_actor"]:
+        for param, reference_param in zip(getattr(full.alg, module).parameters(), getattr(reference.alg, module).parameters()):
+            assert torch.equal(param, reference_param), f"{module} differs from the reference"
+
+    # Shorter windows only change the gradients of the depth encoder, the losses are the same
+    windowed = make_runner(tmp_path, 10)
+    windowed.learn_vision(1)
+    assert torch.allclose(torch.tensor(windowed.logged), torch.tensor(full.logged), rtol=1e-5)
+    encoder_params = zip(windowed.alg.depth_encoder.parameters(), full.alg.depth_encoder.parameters())
+    assert not all(torch.equal(param, full_param) for param, full_param in encoder_params)
@@ -0,0 +1,44 @@
+import torch
+
+from collections import deque
+import statistics
+
+from rsl_rl.utils import EpisodeStatistics
+
+def test_episode_statistics():
+    torch.manual_seed(0)
+    for num_envs, num_steps, done_prob in [(1, 50, 0.1), (16, 300, 0.05), (256, 40, 0.5), (512, 10, 1.0)]:
+        # Bookkeeping as done in OnPolicyRunner before, with deques on the host
+        reward_sum_buffer = deque(maxlen=100)
+        episode_len_buffer = deque(maxlen=100)
+        goals_reached_buffer = deque(maxlen=100)
+        cur_reward_sum = torch.zeros(num_envs, dtype=torch.float)
+        cur_episode_length = torch.zeros(num_envs, dtype=torch.float)
+        cur_num_goals_reached = torch.zeros(num_envs, dtype=torch.float)
+
+        episode_stats = EpisodeStatistics(["reward", "length", "goals_reached"], num_envs, maxlen=100, device='cpu')
+        for step in range(num_steps):
+            rewards = torch.randn(num_envs)
+            dones = (torch.rand(num_envs) < done_prob).long()
+            inc_goal = torch.rand(num_envs) < 0.2
+
+            cur_reward_sum += rewards
+            cur_episode_length += 1
+            cur_num_goals_reached += inc_goal
+            new_ids = (dones > 0).nonzero(as_tuple=False)
+            reward_sum_buffer.extend(cur_reward_sum[new_ids][:, 0].cpu().numpy().tolist())
+            episode_len_buffer.extend(cur_episode_length[new_ids][:, 0].cpu().numpy().tolist())
+            goals_reached_buffer.extend(cur_num_goals_reached[new_ids][:, 0].cpu().numpy().tolist())
+            cur_reward_sum[new_ids] = 0
+            cur_episode_length[new_ids] = 0
+            cur_num_goals_reached[new_ids] = 0
+
+            episode_stats.update(dones, reward=rewards, length=1, goals_reached=inc_goal)
+
+            if step % 7 == 0 or step == num_steps - 1:
+                stats = episode_stats.get()
+                assert stats["reward"] == list(reward_sum_buffer), f"Mismatch for {num_envs} envs at step {step}"
+                assert stats["length"] == list(episode_len_buffer)
+                assert stats["goals_reached"] == list(goals_reached_buffer)
+        assert len(goals_reached_buffer) > 1
+        assert statistics.stdev(stats["goals_reached"]) == statistics.stdev(goals_reached_buffer)
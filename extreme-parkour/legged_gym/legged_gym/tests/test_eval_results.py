@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+import torch
+
+from legged_gym.eval.eval_results import save_eval_results, load_eval_results, mean_per_cell, partition_envs
+
+def mean_per_cell_loop(env_class, terrain_levels, sums_per_env, counter_per_env):
+    """Reference implementation, masking every metric once per cell"""
+    terrain_cells = set(zip(env_class.numpy().tolist(), terrain_levels.numpy().tolist()))
+    means = {name: {} for name in sums_per_env.keys()}
+    for cell in terrain_cells:
+        terrain_type, terrain_level = cell
+        ids = (env_class == terrain_type) & (terrain_levels == terrain_level)
+        for name, sums in sums_per_env.items():
+            means[name][cell] = torch.sum(sums[ids]) / torch.sum(counter_per_env[ids])
+    return means
+
+def test_mean_per_cell():
+    torch.manual_seed(0)
+    for num_types, num_levels, num_envs in [(1, 1, 1), (3, 10, 50), (20, 20, 4096)]:
+        env_class = torch.randint(num_types, (num_envs,))
+        terrain_levels = torch.randint(num_levels, (num_envs,))
+        counter_per_env = torch.randint(1, 10, (num_envs,)).float()
+        sums_per_env = {"rew": torch.randn(num_envs) * 100, "len": torch.rand(num_envs) * 1000, ("rew_term", "tracking"): torch.randn(num_envs)}
+
+        expected = mean_per_cell_loop(env_class, terrain_levels, sums_per_env, counter_per_env)
+        means = mean_per_cell(env_class, terrain_levels, sums_per_env, counter_per_env)
+        for name in sums_per_env.keys():
+            assert means[name].keys() == expected[name].keys()
+            for cell in expected[name].keys():
+                assert torch.allclose(means[name][cell], expected[name][cell], rtol=1e-5, atol=1e-5), f"Mismatch for {name} in cell {cell}"
+
+def test_eval_results_roundtrip():
+    stats = {"Reward": 1.5, "Number of goals reached": 3.25}
+    results = {"exptid": "test", "terrain_type": "benchmark", "checkpoint": "model-10", "summary": stats,
+               "per_type": {0: stats, 11: stats}, "per_level": {3: stats}, "per_cell": [{"terrain_type": 11, "level": 3, **stats}]}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "results.json")
+        save_eval_results(results, path)
+        loaded = load_eval_results(path)
+    assert loaded["version"] == 1
+    assert {key: val for key, val in loaded.items() if key != "version"} == results
+
+def test_partition_envs():
+    # Like the evaluation grid, with several envs per (terrain type, level) cell
+    env_class = torch.arange(10).repeat_interleave(20).repeat(4)
+    terrain_levels = torch.arange(10).repeat(20).repeat(4)
+    for num_groups in [1, 3, 8]:
+        groups = partition_envs(env_class, terrain_levels, num_groups)
+        assert len(groups) == num_groups
+        assert torch.equal(torch.sort(torch.cat(groups))[0], torch.arange(len(env_class)))
+        for group in groups:
+            counts = torch.bincount(env_class[group] * 10 + terrain_levels[group], minlength=100)
+            assert counts.max() - counts.min() <= 1, "Every group should see every cell about equally often"
+    try:
+        partition_envs(env_class, terrain_levels, 81)
+        assert False, "Groups without some cells should be rejected"
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    test_mean_per_cell()
+    test_eval_results_roundtrip()
+    test_partition_envs()
@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from legged_gym import LEGGED_GYM_ROOT_DIR
+from legged_gym.eval.eval_server import EvalServer, EvalServerPool, FakeEvalBackend, send_eval_job
+
+def start_fake_server(backends):
+    backend = FakeEvalBackend()
+    backends.append(backend)
+    server = EvalServer(backend)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.port
+
+def test_eval_server_rebuilds_only_on_terrain_change():
+    backends = []
+    port = start_fake_server(backends)
+    terrain_file = f"{LEGGED_GYM_ROOT_DIR}/legged_gym/utils/set_terrains/set_terrain_test-eval-server.py"
+    try:
+        for exptid, terrain_type in [("a", "benchmark"), ("b", "benchmark"), ("c", "default"), ("d", "default")]:
+            result = send_eval_job(port, {"exptid": exptid, "terrain_type": terrain_type})
+            assert result["success"], result
+        assert backends[0].env_builds == ["benchmark", "default"]
+        assert backends[0].evaluations == ["a", "b", "c", "d"]
+
+        # Generated terrains with the same name but different code need a rebuild
+        for code in ["# v1", "# v1", "# v2"]:
+            with open(terrain_file, "w") as f:
+                f.write(code)
+            send_eval_job(port, {"exptid": "e", "terrain_type": "test-eval-server"})
+        assert backends[0].env_builds == ["benchmark", "default", "test-eval-server", "test-eval-server"]
+
+        # A failed job is reported, and the server keeps running
+        result = send_eval_job(port, {"exptid": "f"})
+        assert not result["success"] and "KeyError" in result["error"]
+        assert send_eval_job(port, {"exptid": "g", "terrain_type": "benchmark"})["success"]
+
+        # Other policies and results files reuse the env, other env args (copied onto the backend's args) don't
+        num_builds = len(backends[0].env_builds)
+        for job in [{"exptid": "h", "checkpoint": 100, "results_file": "h.json"}, {"exptid": "i", "num_envs": 16}, {"exptid": "j", "num_envs": 16, "max_steps": 10}]:
+            assert send_eval_job(port, {"terrain_type": "benchmark", **job})["success"]
+        assert len(backends[0].env_builds) == num_builds + 2
+    finally:
+        send_eval_job(port, None)
+        if os.path.exists(terrain_file):
+            os.remove(terrain_file)
+
+def test_eval_server_pool():
+    backends = []
+    pool = EvalServerPool(lambda device: start_fake_server(backends), servers_per_device=2)
+    try:
+        # Sequential jobs reuse the same server and its env
+        for exptid in ["a", "b", "c"]:
+            assert pool.run({"exptid": exptid, "terrain_type": "benchmark"}, device="cuda:0")["success"]
+        assert len(backends) == 1 and backends[0].env_builds == ["benchmark"]
+
+        # Concurrent jobs start at most servers_per_device servers per device
+        jobs = [({"exptid": str(i), "terrain_type": f"terrain-{i % 3}"}, f"cuda:{i % 2}") for i in range(24)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda job: pool.run(*job), jobs))
+        assert all(result["success"] for result in results)
+        assert sum(len(servers) for servers in pool.servers.values()) <= 4
+        assert sum(len(backend.evaluations) for backend in backends) == 3 + len(jobs)
+    finally:
+        pool.shutdown()
+
+if __name__ == "__main__":
+    test_eval_server_rebuilds_only_on_terrain_change()
+    test_eval_server_pool()
@@ -0,0 +1,103 @@
+import torch
+
+from rsl_rl.storage import RolloutStorage
+
+def compute_returns_loop(storage, last_values, gamma, lam):
+    """Reference implementation, looping backwards over the steps"""
+    returns = torch.zeros_like(storage.returns)
+    advantage = 0
+    for step in reversed(range(storage.num_transitions_per_env)):
+        if step == storage.num_transitions_per_env - 1:
+            next_values = last_values
+        else:
+            next_values = storage.values[step + 1]
+        next_is_not_terminal = 1.0 - storage.dones[step].float()
+        delta = storage.rewards[step] + next_is_not_terminal * gamma * next_values - storage.values[step]
+        advantage = delta + next_is_not_terminal * gamma * lam * advantage
+        returns[step] = advantage + storage.values[step]
+    return returns
+
+def test_compute_returns():
+    torch.manual_seed(0)
+    for num_envs, num_steps, done_prob in [(1, 1, 0.5), (16, 24, 0.05), (64, 120, 0.2), (8, 24, 1.0)]:
+        storage = RolloutStorage(num_envs, num_steps, [3], [None], [2])
+        storage.rewards[:] = torch.randn(num_steps, num_envs, 1)
+        storage.values[:] = torch.randn(num_steps, num_envs, 1) * 10
+        storage.dones[:] = (torch.rand(num_steps, num_envs, 1) < done_prob).byte()
+        last_values = torch.randn(num_envs, 1) * 10
+
+        expected = compute_returns_loop(storage, last_values, gamma=0.99, lam=0.95)
+        storage.compute_returns(last_values, gamma=0.99, lam=0.95)
+        assert torch.allclose(storage.returns, expected, rtol=1e-4, atol=1e-4), f"Mismatch for {num_envs} envs and {num_steps} steps"
+        advantages = expected - storage.values
+        if advantages.numel() > 1:
+            assert torch.allclose(storage.advantages, (advantages - advantages.mean()) / (advantages.std() + 1e-8), rtol=1e-4, atol=1e-4)
+
+def make_transition(obs, done_prob=0.1):
+    num_envs = obs.shape[0]
+    transition = RolloutStorage.Transition()
+    transition.observations = obs
+    transition.critic_observations = obs
+    transition.actions = torch.randn(num_envs, 2)
+    transition.rewards = torch.randn(num_envs)
+    transition.dones = torch.rand(num_envs) < done_prob
+    transition.values = torch.randn(num_envs, 1)
+    transition.actions_log_prob = torch.randn(num_envs)
+    transition.action_mean = torch.randn(num_envs, 2)
+    transition.action_sigma = torch.rand(num_envs, 2)
+    return transition
+
+def fill_rollout(storages, num_steps, history, episode_length, n_other=5):
+    """Adds a rollout to all storages, with a proprio history updated like in LeggedRobot.compute_observations()"""
+    num_envs, history_len, n_proprio = history.shape
+    def observe(history):
+        proprio = torch.randn(num_envs, n_proprio)
+        obs = torch.cat([proprio, torch.randn(num_envs, n_other), history.flatten(1)], dim=-1)
+        history = torch.where((episode_length <= 1)[:, None, None], torch.stack([proprio] * history_len, dim=1), torch.cat([history[:, 1:], proprio.unsqueeze(1)], dim=1))
+        return obs, history
+
+    obs, history = observe(history)
+    for _ in range(num_steps):
+        transition = make_transition(obs)
+        for storage in storages:
+            storage.add_transitions(transition)
+        # Reset done envs, their history is zero until the next observation
+        episode_length += 1
+        episode_length[transition.dones] = 0
+        history[transition.dones] = 0
+        obs, history = observe(history)
+    return history, episode_length
+
+def test_lean_storage():
+    torch.manual_seed(0)
+    num_envs, num_steps, history_len, n_proprio = 32, 24, 10, 4
+    num_obs = n_proprio + 5 + history_len * n_proprio
+    storage = RolloutStorage(num_envs, num_steps, [num_obs], [None], [2])
+    lean_storage = RolloutStorage(num_envs, num_steps, [num_obs], [None], [2], history_len=history_len, n_proprio=n_proprio)
+    assert lean_storage.observations.numel() + lean_storage.history_rows.numel() < 0.5 * storage.observations.numel()
+
+    history, episode_length = torch.zeros(num_envs, history_len, n_proprio), torch.randint(0, 3, (num_envs,))
+    for _ in range(3):
+        # Later rollouts start in the middle of episodes
+        history, episode_length = fill_rollout([storage, lean_storage], num_steps, history, episode_length)
+        torch.manual_seed(1)
+        batches = list(storage.mini_batch_generator(4, num_epochs=2))
+        torch.manual_seed(1)
+        lean_batches = list(lean_storage.mini_batch_generator(4, num_epochs=2))
+        for batch, lean_batch in zip(batches, lean_batches):
+            assert torch.equal(batch[0], lean_batch[0]) and torch.equal(batch[1], lean_batch[1])
+        storage.clear()
+        lean_storage.clear()
+
+    # Histories that aren't shifted by one row per step can't be rebuilt
+    for _ in range(2):
+        lean_storage.add_transitions(make_transition(torch.randn(num_envs, num_obs)))
+    try:
+        next(lean_storage.mini_batch_generator(4))
+        assert False, "Mismatched history should be rejected"
+    except RuntimeError:
+        pass
+
+if __name__ == "__main__":
+    test_compute_returns()
+    test_lean_storage()
@@ -0,0 +1,225 @@
+import numpy as np
+import os
+import time
+
+import isaacgym
+from isaacgym import terrain_utils
+from legged_gym.envs import *
+from legged_gym.envs.base.legged_robot_config import LeggedRobotCfg
+from legged_gym.utils.helpers import set_seed
+from legged_gym.utils.terrain_gpt import Terrain, TERRAIN_FUNCTION_CACHE_SIZE, load_terrain_function, load_terrain_function_from_file, get_terrain_function_args, evict_terrain_cache, fix_terrain, label_obstacles, convert_heightfield_to_trimesh, calc_direct_path_heights
+from legged_gym.utils.set_terrain_benchmark import set_terrain as set_terrain_benchmark
+
+NUM_BENCHMARK_TERRAINS = 20
+
+def make_benchmark_terrain(variation, difficulty):
+    cfg = LeggedRobotCfg.terrain
+    set_seed(int(variation * 1e3 + difficulty * 1e6))
+    terrain = terrain_utils.SubTerrain(
+        "terrain",
+        width=int(cfg.terrain_length / cfg.horizontal_scale),
+        length=int(cfg.terrain_width / cfg.horizontal_scale),
+        vertical_scale=cfg.vertical_scale,
+        horizontal_scale=cfg.horizontal_scale
+    )
+    terrain.goals = np.zeros((cfg.num_goals, 2))
+    set_terrain_benchmark(terrain, variation, difficulty)
+    return terrain
+
+def test_fix_terrain_backends():
+    """The scipy obstacle labeling must give the same fixed terrain as the reference flood fill"""
+    for idx in range(NUM_BENCHMARK_TERRAINS):
+        for difficulty in [0, 0.5, 1]:
+            variation = idx / NUM_BENCHMARK_TERRAINS
+            terrain = make_benchmark_terrain(variation, difficulty)
+            height_field_raw = terrain.height_field_raw.copy()
+            min_height = np.min(height_field_raw)
+            dz_threshold = 1 / terrain.vertical_scale
+            assert label_obstacles(height_field_raw, min_height, dz_threshold, backend="bfs") == label_obstacles(height_field_raw, min_height, dz_threshold, backend="scipy"), f"Obstacles differ for terrain {idx} at difficulty {difficulty}"
+
+            terrain_bfs = make_benchmark_terrain(variation, difficulty)
+            terrain_scipy = make_benchmark_terrain(variation, difficulty)
+            desc_bfs = fix_terrain(terrain_bfs, backend="bfs")
+            desc_scipy = fix_terrain(terrain_scipy, backend="scipy")
+            assert set(desc_bfs.split(", ")) == set(desc_scipy.split(", ")), f"Fixes differ for terrain {idx} at difficulty {difficulty}"
+            assert np.array_equal(terrain_bfs.height_field_raw, terrain_scipy.height_field_raw), f"Height fields differ for terrain {idx} at difficulty {difficulty}"
+            assert np.array_equal(terrain_bfs.goals, terrain_scipy.goals), f"Goals differ for terrain {idx} at difficulty {difficulty}"
+
+def make_terrain_cfg(**kwargs):
+    cfg = LeggedRobotCfg().terrain
+    cfg.type = "benchmark"
+    cfg.num_rows = 3
+    cfg.num_cols = 4
+    for name, value in kwargs.items():
+        setattr(cfg, name, value)
+    return cfg
+
+def assert_same_terrain(terrain, ref_terrain):
+    for name in ["height_field_raw", "goals", "env_origins", "terrain_type", "vertices", "triangles", "x_edge_mask"]:
+        assert np.array_equal(getattr(terrain, name), getattr(ref_terrain, name)), f"{name} differs"
+    assert terrain.fix_messages == ref_terrain.fix_messages
+
+def test_build_terrain_in_pool():
+    """Building sub-terrains in worker processes must give exactly the serial terrain"""
+    serial_terrain = Terrain(make_terrain_cfg(num_workers=0), num_robots=1)
+    pool_terrain = Terrain(make_terrain_cfg(num_workers=3), num_robots=1)
+    assert_same_terrain(pool_terrain, serial_terrain)
+
+def test_terrain_cache(tmp_path):
+    cfg = make_terrain_cfg(use_cache=True, cache_dir=str(tmp_path))
+    built_terrain = Terrain(cfg, num_robots=1)
+    cache_file = built_terrain.get_cache_file()
+    assert os.listdir(tmp_path) == [os.path.basename(cache_file)]
+    loaded_terrain = Terrain(make_terrain_cfg(use_cache=True, cache_dir=str(tmp_path)), num_robots=1)
+    assert_same_terrain(loaded_terrain, built_terrain)
+
+    # A broken cache file is rebuilt and replaced
+    with open(cache_file, "wb") as f:
+        f.write(b"not a terrain")
+    rebuilt_terrain = Terrain(make_terrain_cfg(use_cache=True, cache_dir=str(tmp_path)), num_robots=1)
+    assert_same_terrain(rebuilt_terrain, built_terrain)
+    assert os.path.getsize(cache_file) > len(b"not a terrain")
+
+def test_evict_terrain_cache(tmp_path):
+    for i in range(4):
+        with open(tmp_path / f"terrain_{i}.npz", "wb") as f:
+            f.write(bytes(1000))
+        os.utime(tmp_path / f"terrain_{i}.npz", (i, i))
+    # Temporary files of a killed writer and of one still writing
+    for name, mtime in [("terrain_4.npz.123.tmp", 0), ("terrain_5.npz.456.tmp", time.time())]:
+        with open(tmp_path / name, "wb") as f:
+            f.write(bytes(1000))
+        os.utime(tmp_path / name, (mtime, mtime))
+    evict_terrain_cache(str(tmp_path), max_size=3500 / 1e9)
+    assert sorted(os.listdir(tmp_path)) == ["terrain_2.npz", "terrain_3.npz", "terrain_5.npz.456.tmp"]
+
+def test_terrain_function_cache(tmp_path):
+    terrain_file = tmp_path / "set_terrain_0.py"
+    terrain_file.write_text("def set_terrain(terrain, difficulty):\n    return 0\n")
+    set_terrain = load_terrain_function_from_file(terrain_file)
+    assert load_terrain_function_from_file(terrain_file) is set_terrain
+    assert get_terrain_function_args(set_terrain) == ["terrain", "difficulty"]
+
+    # Overwritten files are loaded again
+    terrain_file.write_text("def set_terrain(terrain, variation, difficulty):\n    return 1\n")
+    os.utime(terrain_file, ns=(0, 0))
+    assert load_terrain_function_from_file(terrain_file)(None, 0, 0) == 1
+
+    # Loading many generated terrains keeps only the latest ones
+    for i in range(1, 3 * TERRAIN_FUNCTION_CACHE_SIZE):
+        terrain_file = tmp_path / f"set_terrain_{i}.py"
+        terrain_file.write_text(f"def set_terrain(terrain, difficulty):\n    return {i}\n")
+        get_terrain_function_args(load_terrain_function_from_file(terrain_file))
+    assert load_terrain_function.cache_info().currsize <= TERRAIN_FUNCTION_CACHE_SIZE
+    assert get_terrain_function_args.cache_info().currsize <= TERRAIN_FUNCTION_CACHE_SIZE
+
+def calc_direct_path_heights_loop(height_field_raw, goals, skip_size):
+    # Previous point-by-point Bresenham implementation, kept as a reference
+    all_line_heights = []
+    all_skip_line_heights = []
+    for i in range(len(goals) - 1):
+        (goal_x, goal_y), (next_goal_x, next_goal_y) = goals[i], goals[i + 1]
+        goal_x, goal_y, next_goal_x, next_goal_y = round(goal_x), round(goal_y), round(next_goal_x), round(next_goal_y)
+
+        dx, dy = abs(next_goal_x - goal_x), abs(next_goal_y - goal_y)
+        sx, sy = 1 if goal_x < next_goal_x else -1, 1 if goal_y < next_goal_y else -1
+        err = dx - dy
+
+        x, y = goal_x, goal_y
+        line_heights = [height_field_raw[x, y]]
+        while x != next_goal_x or y != next_goal_y:
+            e2 = 2 * err
+            if e2 > -dy:
+                err -= dy
+                x += sx
+            if e2 < dx:
+                err += dx
+                y += sy
+            line_heights.append(height_field_raw[x, y])
+        all_line_heights.append(line_heights)
+
+        j = 0
+        skip_line_heights = []
+        while j < len(line_heights) - 1:
+            skip_line_heights.append(line_heights[j])
+            k = min(j + skip_size + 1, len(line_heights))
+            diff_along_range = line_heights[j+1:k] - line_heights[j]
+            diff_along_range = np.maximum.accumulate(diff_along_range)
+            diff_along_range = np.abs(diff_along_range)
+            min_diff_idx = np.argmin(diff_along_range)
+            j += min_diff_idx + 1
+        skip_line_heights.append(line_heights[-1])
+        all_skip_line_heights.append(skip_line_heights)
+
+    return all_line_heights, all_skip_line_heights
+
+def test_calc_direct_path_heights():
+    skip_size = round(1 / LeggedRobotCfg.terrain.horizontal_scale)
+    goal_sets = []
+    for idx in range(NUM_BENCHMARK_TERRAINS):
+        for difficulty in [0, 0.5, 1]:
+            terrain = make_benchmark_terrain(idx / NUM_BENCHMARK_TERRAINS, difficulty)
+            fix_terrain(terrain)
+            start_location = np.array([2, (terrain.length / 2 * terrain.horizontal_scale)])
+            goals = np.concatenate([start_location[None, :], terrain.goals], axis=0) / terrain.horizontal_scale
+            goal_sets.append((terrain.height_field_raw, goals))
+    # Random lines in every direction, including repeated and half-pixel goals
+    for _ in range(20):
+        height_field_raw = np.random.randint(-200, 200, size=(360, 80)).astype(np.int16)
+        goals = np.random.randint(0, [360, 80], size=(9, 2)).astype(np.float64)
+        goals[np.random.rand(9) < 0.3] += 0.5
+        goals[4] = goals[3]
+        goal_sets.append((height_field_raw, goals))
+
+    for height_field_raw, goals in goal_sets:
+        line_heights, skip_line_heights = calc_direct_path_heights(height_field_raw, goals, skip_size)
+        ref_line_heights, ref_skip_line_heights = calc_direct_path_heights_loop(height_field_raw, goals, skip_size)
+        assert len(line_heights) == len(ref_line_heights) and len(skip_line_heights) == len(ref_skip_line_heights)
+        for heights, ref_heights in zip(line_heights + skip_line_heights, ref_line_heights + ref_skip_line_heights):
+            assert np.array_equal(heights, np.array(ref_heights))
+
+def convert_heightfield_to_triangles_loop(num_rows, num_cols):
+    # Previous row-by-row triangle construction, kept as a reference
+    triangles = -np.ones((2*(num_rows-1)*(num_cols-1), 3), dtype=np.uint32)
+    for i in range(num_rows - 1):
+        ind0 = np.arange(0, num_cols-1) + i*num_cols
+        ind1 = ind0 + 1
+        ind2 = ind0 + num_cols
+        ind3 = ind2 + 1
+        start = 2*i*(num_cols-1)
+        stop = start + 2*(num_cols-1)
+        triangles[start:stop:2, 0] = ind0
+        triangles[start:stop:2, 1] = ind3
+        triangles[start:stop:2, 2] = ind1
+        triangles[start+1:stop:2, 0] = ind0
+        triangles[start+1:stop:2, 1] = ind2
+        triangles[start+1:stop:2, 2] = ind3
+    return triangles
+
+def test_convert_heightfield_to_trimesh():
+    cfg = LeggedRobotCfg.terrain
+    for num_rows, num_cols in [(2, 2), (37, 81), (360, 80)]:
+        height_field_raw = np.random.randint(-200, 200, size=(num_rows, num_cols)).astype(np.int16)
+        vertices, triangles, x_edge_mask = convert_heightfield_to_trimesh(height_field_raw, cfg.horizontal_scale, cfg.vertical_scale, cfg.slope_treshold)
+        assert triangles.dtype == np.uint32
+        assert np.array_equal(triangles, convert_heightfield_to_triangles_loop(num_rows, num_cols))
+        assert vertices.shape == (num_rows * num_cols, 3) and x_edge_mask.shape == (num_rows, num_cols)
+
+def benchmark_convert_heightfield_to_trimesh(num_rows=3800, num_cols=8200):
+    """Full 10x40 map at the default 0.05m horizontal scale"""
+    cfg = LeggedRobotCfg.terrain
+    height_field_raw = np.zeros((num_rows, num_cols), dtype=np.int16)
+    start = time.time()
+    convert_heightfield_to_triangles_loop(num_rows, num_cols)
+    print(f"Loop triangles: {time.time() - start:.2f}s")
+    start = time.time()
+    convert_heightfield_to_trimesh(height_field_raw, cfg.horizontal_scale, cfg.vertical_scale, cfg.slope_treshold)
+    print(f"convert_heightfield_to_trimesh (vertices and triangles): {time.time() - start:.2f}s")
+
+if __name__ == '__main__':
+    test_fix_terrain_backends()
+    test_build_terrain_in_pool()
+    test_calc_direct_path_heights()
+    test_convert_heightfield_to_trimesh()
+    benchmark_convert_heightfield_to_trimesh()
+    print("Done")
@@ -77,7 +77,8 @@ def set_seed(seed):
 def get_checkpoint(load_dir, checkpoint=-1, model_name_include="model"):
     if checkpoint == -1:
         # Get last checkpoint
-        models = [file for file in os.listdir(load_dir) if model_name_include in file and ".pt" in file]
+        # Skips temporary files of checkpoints that are still being written
+        models = [file for file in os.listdir(load_dir) if model_name_include in file and file.endswith(".pt")]
         models.sort(key=lambda m: '{0:0>15}'.format(m))
         model = models[-1]
     else:
@@ -136,6 +137,10 @@ def update_cfg_from_args(env_cfg, cfg_train, args):
             env_cfg.terrain.num_rows = args.terrain_rows
         if args.terrain_cols is not None:
             env_cfg.terrain.num_cols = args.terrain_cols
+        if args.terrain_workers is not None:
+            env_cfg.terrain.num_workers = args.terrain_workers
+        if args.terrain_cache:
+            env_cfg.terrain.use_cache = True
         if args.action_delay is not None:
             env_cfg.domain_rand.action_delay = args.action_delay
         if args.terrain_type is not None:
@@ -196,6 +201,8 @@ def add_agent_args(parser):
 def add_terrain_args(parser):
     parser.add_argument("--terrain_rows", type=int, help="Number of rows (levels) in the terrain grid")
     parser.add_argument("--terrain_cols", type=int, help="Number of columns (types) in the terrain grid")
+    parser.add_argument("--terrain_workers", type=int, help="Number of processes to build the terrain grid with")
+    parser.add_argument("--terrain_cache", action="store_true", default=False, help="Load and save built terrains in the on-disk terrain cache")
     parser.add_argument("--terrain_type", type=str, default="default", help="Which set_terrain() function file to use")
     parser.add_argument("--check_terrain_feasibility", action="store_true", default=False, help="Check terrain feasibility with simple heuristics")
 
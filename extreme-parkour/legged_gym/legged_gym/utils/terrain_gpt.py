@@ -1,13 +1,22 @@
 import os
+import sys
+import time
 import numpy as np
 import random
 from isaacgym import terrain_utils
 from legged_gym.envs.base.legged_robot_config import LeggedRobotCfg
 from pydelatin import Delatin
 import pyfqmr
-from scipy.ndimage import binary_dilation
+from scipy.ndimage import binary_dilation, find_objects
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from collections import deque
 import inspect
+import functools
 import importlib.util
+import hashlib
+import zipfile
+import multiprocessing as mp
 from legged_gym.utils.helpers import set_seed
 
 # This is the standard set_terrain
@@ -22,16 +31,29 @@ from legged_gym.utils.set_terrain_random import set_terrain as set_terrain_rando
 # Override default set_terrain.py with a custom path
 set_terrain_override = None
 
+# Loaded set_terrain functions and their argument names, so each file is only executed and inspected once per process.
+# Long evolution runs (and check workers) load many generated terrains, so only the most recent ones are kept
+TERRAIN_FUNCTION_CACHE_SIZE = 16
+
 def load_terrain_function_from_file(filepath):
+    # Key on mtime and size as well, since generated terrain files are overwritten in place
+    stat = os.stat(filepath)
+    return load_terrain_function(os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=TERRAIN_FUNCTION_CACHE_SIZE)
+def load_terrain_function(filepath, mtime_ns, size):
     spec = importlib.util.spec_from_file_location("module_name", filepath)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
-    function = module.set_terrain
-    return function
+    return module.set_terrain
 
-def run_ambiguous_set_terrain(set_terrain_fn, terrain, variation, difficulty):
+@functools.lru_cache(maxsize=TERRAIN_FUNCTION_CACHE_SIZE)
+def get_terrain_function_args(set_terrain_fn):
     signature = inspect.signature(set_terrain_fn)
-    args = [p.name for p in signature.parameters.values()]
+    return [p.name for p in signature.parameters.values()]
+
+def run_ambiguous_set_terrain(set_terrain_fn, terrain, variation, difficulty):
+    args = get_terrain_function_args(set_terrain_fn)
     if set(args) == set(["terrain", "variation", "difficulty"]):
         set_idx = set_terrain_fn(terrain, variation, difficulty)
     elif set(args) == set(["terrain", "difficulty"]):
@@ -75,21 +97,31 @@ class Terrain:
 
         if set_terrain_override is not None and self.cfg.type == "default":
             print(f"Warning: Using set_terrain override, getting terrain from {set_terrain_override}")
-        for j in range(self.cfg.num_cols):
-            for i in range(self.cfg.num_rows):
-                difficulty = i / (self.cfg.num_rows-1) if self.cfg.num_rows > 1 else 0.5
-                variation = j / self.cfg.num_cols
-                terrain = self.make_terrain(variation, difficulty)
-
-                # Pad borders
-                pad_width = int(0.1 // terrain.horizontal_scale)
-                pad_height = int(0.5 // terrain.vertical_scale)
-                terrain.height_field_raw[:, :pad_width] = pad_height
-                terrain.height_field_raw[:, -pad_width:] = pad_height
-                terrain.height_field_raw[:pad_width, :] = pad_height
-                terrain.height_field_raw[-pad_width:, :] = pad_height
-
-                self.add_terrain_to_map(terrain, i, j)
+        self.set_terrain_fn = self.load_set_terrain_fn()
+        cache_file = self.get_cache_file() if cfg.use_cache else None
+        if cache_file is not None and self.load_from_cache(cache_file):
+            return
+        if cache_file is not None:
+            print(f"Terrain cache miss, building terrain for {cache_file}")
+
+        cells = [(i, j) for j in range(self.cfg.num_cols) for i in range(self.cfg.num_rows)]
+        if self.cfg.num_workers > 1:
+            # Every sub-terrain reseeds the RNGs from its own (variation, difficulty), so the result is identical to building serially
+            # NOTE: We fork so workers inherit the loaded set_terrain function instead of re-importing everything
+            global terrain_pool_parent
+            terrain_pool_parent = self
+            try:
+                with mp.get_context("fork").Pool(self.cfg.num_workers) as pool:
+                    terrains = pool.map(make_padded_terrain_in_worker, cells, chunksize=max(1, len(cells) // (4 * self.cfg.num_workers)))
+            finally:
+                terrain_pool_parent = None
+        else:
+            terrains = [self.make_padded_terrain(i, j) for i, j in cells]
+        self.fix_messages = []
+        for (i, j), terrain in zip(cells, terrains):
+            self.add_terrain_to_map(terrain, i, j)
+            if terrain.fix_desc != "":
+                self.fix_messages.append(f"Automatically fixed terrain {terrain.idx}: {terrain.fix_desc}")
         
         self.heightsamples = self.height_field_raw
         if self.type=="trimesh":
@@ -116,6 +148,107 @@ class Terrain:
             print("Created {} vertices".format(self.vertices.shape[0]))
             print("Created {} triangles".format(self.triangles.shape[0]))
 
+        if cache_file is not None:
+            self.save_to_cache(cache_file)
+
+    def get_cache_file(self):
+        # Terrains are keyed on the code that generates them and every config field that changes the result
+        key = hashlib.sha256()
+        for source_file in [inspect.getsourcefile(self.set_terrain_fn), __file__]:
+            with open(source_file, "rb") as f:
+                key.update(f.read())
+        for field in terrain_cache_cfg_fields:
+            key.update(f"{field}={getattr(self.cfg, field)};".encode())
+        return os.path.join(self.cfg.cache_dir, f"terrain_{key.hexdigest()[:32]}.npz")
+
+    def load_from_cache(self, cache_file):
+        # Returns whether the terrain was loaded, the file may be missing, or evicted by another process while loading
+        try:
+            os.utime(cache_file)  # Mark as recently used for eviction
+            with np.load(cache_file) as data:
+                data = {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Failed to load terrain from cache {cache_file}: {e}")
+            return False
+        print(f"Terrain cache hit, loading terrain from {cache_file}")
+        self.height_field_raw = data["height_field_raw"]
+        self.goals = data["goals"]
+        self.env_origins = data["env_origins"]
+        self.terrain_type = data["terrain_type"]
+        self.fix_messages = data["fix_messages"].tolist()
+        if self.type == "trimesh":
+            self.vertices = data["vertices"]
+            self.triangles = data["triangles"]
+            if "x_edge_mask" in data:
+                self.x_edge_mask = data["x_edge_mask"]
+        self.heightsamples = self.height_field_raw
+        for fix_message in self.fix_messages:
+            print(fix_message)
+        if self.type == "trimesh":
+            # NOTE: Generated terrain checks wait for this line to know that the terrain was built
+            print("Converting heightmap to trimesh... (loaded from cache)")
+            print("Created {} vertices".format(self.vertices.shape[0]))
+            print("Created {} triangles".format(self.triangles.shape[0]))
+        return True
+
+    def save_to_cache(self, cache_file):
+        os.makedirs(self.cfg.cache_dir, exist_ok=True)
+        data = {
+            "height_field_raw": self.height_field_raw,
+            "goals": self.goals,
+            "env_origins": self.env_origins,
+            "terrain_type": self.terrain_type,
+            "fix_messages": np.array(self.fix_messages, dtype=str),
+        }
+        if self.type == "trimesh":
+            data["vertices"] = self.vertices
+            data["triangles"] = self.triangles
+            if hasattr(self, "x_edge_mask"):
+                data["x_edge_mask"] = self.x_edge_mask
+        # Write to a temporary file first, since other processes may be reading or writing the same terrain
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp_file, cache_file)
+        print(f"Saved terrain to cache {cache_file}")
+        evict_terrain_cache(self.cfg.cache_dir, self.cfg.cache_max_size)
+
+    def load_set_terrain_fn(self):
+        # Resolve the set_terrain function once per build, rather than once per sub-terrain
+        if self.cfg.type == "default":
+            if set_terrain_override is not None:
+                return load_terrain_function_from_file(set_terrain_override)
+            return set_terrain
+        elif self.cfg.type == "benchmark":
+            return set_terrain_benchmark
+        elif self.cfg.type == "original":
+            return set_terrain_original
+        elif self.cfg.type == "original_distill":
+            return set_terrain_original_distill
+        elif self.cfg.type == "simple":
+            return set_terrain_simple
+        elif self.cfg.type == "random":
+            return set_terrain_random
+        filepath = f"{LEGGED_GYM_ROOT_DIR}/legged_gym/utils/set_terrains/set_terrain_{self.cfg.type}.py"
+        if not os.path.exists(filepath):
+            raise ValueError(f"Terrain type {self.cfg.type} not recognized!")
+        return load_terrain_function_from_file(filepath)
+
+    def make_padded_terrain(self, row, col):
+        difficulty = row / (self.cfg.num_rows-1) if self.cfg.num_rows > 1 else 0.5
+        variation = col / self.cfg.num_cols
+        terrain = self.make_terrain(variation, difficulty)
+
+        # Pad borders
+        pad_width = int(0.1 // terrain.horizontal_scale)
+        pad_height = int(0.5 // terrain.vertical_scale)
+        terrain.height_field_raw[:, :pad_width] = pad_height
+        terrain.height_field_raw[:, -pad_width:] = pad_height
+        terrain.height_field_raw[:pad_width, :] = pad_height
+        terrain.height_field_raw[-pad_width:, :] = pad_height
+        return terrain
+
     def make_terrain(self, variation, difficulty):
         # Make terrain generation deterministic
         # NOTE: The seed will be reset back to env_cfg.seed after the environment is created, inside TaskRegistry.make_env()
@@ -131,35 +264,16 @@ class Terrain:
         terrain.goals = np.zeros((self.cfg.num_goals, 2))
 
         fix_desc = ""
-        if self.cfg.type == "default":
-            if set_terrain_override is not None:
-                set_terrain_fn = load_terrain_function_from_file(set_terrain_override)
-            else:
-                set_terrain_fn = set_terrain
-            set_idx = run_ambiguous_set_terrain(set_terrain_fn, terrain, variation, difficulty)
-            fix_desc = fix_terrain(terrain)
-            if self.cfg.check_feasibility:
-                check_terrain_feasibility(terrain, allow_flat_terrain=(difficulty == 0))
-        elif self.cfg.type == "benchmark":
-            set_idx = set_terrain_benchmark(terrain, variation, difficulty)
-        elif self.cfg.type == "original":
-            set_idx = set_terrain_original(terrain, variation, difficulty)
-        elif self.cfg.type == "original_distill":
-            set_idx = set_terrain_original_distill(terrain, variation, difficulty)
-        elif self.cfg.type == "simple":
-            set_idx = set_terrain_simple(terrain, variation, difficulty)
-        elif self.cfg.type == "random":
-            set_idx = set_terrain_random(terrain, variation, difficulty)
+        if self.cfg.type in ["benchmark", "original", "original_distill", "simple", "random"]:
+            set_idx = self.set_terrain_fn(terrain, variation, difficulty)
         else:
-            filepath = f"{LEGGED_GYM_ROOT_DIR}/legged_gym/utils/set_terrains/set_terrain_{self.cfg.type}.py"
-            if not os.path.exists(filepath):
-                raise ValueError(f"Terrain type {self.cfg.type} not recognized!")
-            set_terrain_fn = load_terrain_function_from_file(filepath)
-            set_idx = run_ambiguous_set_terrain(set_terrain_fn, terrain, variation, difficulty)
+            # Default or generated terrain, which may have mistakes that need fixing
+            set_idx = run_ambiguous_set_terrain(self.set_terrain_fn, terrain, variation, difficulty)
             fix_desc = fix_terrain(terrain)
             if self.cfg.check_feasibility:
                 check_terrain_feasibility(terrain, allow_flat_terrain=(difficulty == 0))
         terrain.idx = set_idx if set_idx is not None else 0
+        terrain.fix_desc = fix_desc
         if fix_desc != "":
             print(f"Automatically fixed terrain {terrain.idx}: {fix_desc}")
 
@@ -194,8 +308,59 @@ class Terrain:
         self.terrain_type[i, j] = terrain.idx
         self.goals[i, j, :, :2] = terrain.goals + [i * self.env_length, j * self.env_width]
     
-def fix_terrain(terrain):
-    """Fix common errors with GPT-generated terrains"""
+# Config fields that change the built terrain, used to key the terrain cache
+terrain_cache_cfg_fields = [
+    "type", "check_feasibility", "mesh_type", "hf2mesh_method", "max_error", "edge_width_thresh",
+    "horizontal_scale", "vertical_scale", "border_size", "height", "downsampled_scale", "simplify_grid",
+    "slope_treshold", "origin_zero_z", "terrain_length", "terrain_width", "num_rows", "num_cols", "num_goals",
+]
+
+def evict_terrain_cache(cache_dir, max_size, max_tmp_age=3600):
+    # Delete least recently used terrains until the cache is under max_size (in GB)
+    # NOTE: Processes training and evaluating in parallel share the cache, so any file may be evicted by another one meanwhile
+    cache_files = []
+    total_size = 0
+    for filename in os.listdir(cache_dir):
+        if not filename.startswith("terrain_"):
+            continue
+        file = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            continue
+        if filename.endswith(".tmp"):
+            # Files that are not written to anymore were left by killed writers (e.g. culled runs)
+            if time.time() - stat.st_mtime > max_tmp_age:
+                remove_cache_file(file)
+            else:
+                total_size += stat.st_size
+        elif filename.endswith(".npz"):
+            cache_files.append((stat.st_mtime, stat.st_size, file))
+            total_size += stat.st_size
+    cache_files = sorted(cache_files)
+    while total_size > max_size * 1e9 and len(cache_files) > 1:
+        _, size, cache_file = cache_files.pop(0)
+        total_size -= size
+        if remove_cache_file(cache_file):
+            print(f"Evicted terrain {cache_file} from cache")
+
+def remove_cache_file(file):
+    try:
+        os.remove(file)
+        return True
+    except FileNotFoundError:
+        return False
+
+# Terrain being built by a worker pool, inherited by the forked workers
+terrain_pool_parent = None
+
+def make_padded_terrain_in_worker(cell):
+    terrain = terrain_pool_parent.make_padded_terrain(*cell)
+    sys.stdout.flush()  # Workers may be terminated before flushing, and fix messages are parsed from the logs
+    return terrain
+
+def fix_terrain(terrain, backend="scipy"):
+    """Fix common errors with GPT-generated terrains, backend selects the obstacle labeling (see label_obstacles())"""
     # If goals are in units (indices), convert to meters
     # This doesn't count as a fix since we prompt GPT to return goals in units (for simplicity)
     env_length, env_width = terrain.width * terrain.horizontal_scale, terrain.length * terrain.horizontal_scale
@@ -250,33 +415,8 @@ def fix_terrain(terrain):
     valid_ratio_threshold = 2
     min_obstacle_length, min_obstacle_width = 0.6 / terrain.horizontal_scale, 0.4 / terrain.horizontal_scale
     floodfill_dz_threshold = 1 / terrain.vertical_scale
-    obstacles = {}
-    floodfill = np.zeros_like(terrain.height_field_raw)
+    obstacles = label_obstacles(terrain.height_field_raw, min_terrain_height, floodfill_dz_threshold, backend=backend)
 
-    def bfs(x, y, id):
-        q = [(x, y)]
-        while len(q) > 0:
-            x, y = q.pop(0)
-            if floodfill[x, y] != 0:
-                continue
-            floodfill[x, y] = id
-            obstacles[id] = [
-                (min(obstacles[id][0][0], x), min(obstacles[id][0][1], y)),
-                (max(obstacles[id][1][0], x+1), max(obstacles[id][1][1], y+1))
-            ]
-            for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < terrain.height_field_raw.shape[0] and 0 <= ny < terrain.height_field_raw.shape[1]:
-                    if terrain.height_field_raw[nx, ny] != min_terrain_height and floodfill[nx, ny] == 0 and abs(terrain.height_field_raw[nx, ny] - terrain.height_field_raw[x, y]) < floodfill_dz_threshold:
-                        q.append((nx, ny))
-    obstacle_counter = 0
-    for i in range(terrain.height_field_raw.shape[0]):
-        for j in range(terrain.height_field_raw.shape[1]):
-            if terrain.height_field_raw[i, j] != min_terrain_height and floodfill[i, j] == 0:
-                obstacle_counter += 1
-                obstacles[obstacle_counter] = [(i, j), (i, j)]
-                bfs(i, j, obstacle_counter)
-    
     for obstacle in obstacles:
         x1, y1 = obstacles[obstacle][0]
         x2, y2 = obstacles[obstacle][1]
@@ -305,41 +445,105 @@ def fix_terrain(terrain):
     
     return ", ".join(fix_descs)
 
+def label_obstacles(height_field_raw, min_height, dz_threshold, backend="scipy"):
+    """Finds obstacles as 4-connected regions above min_height whose neighboring heights differ by less than dz_threshold.
+    Returns a dict of obstacle id (numbered in raster order of each region's first pixel) to [(x1, y1), (x2, y2)] bounding boxes."""
+    if backend == "scipy":
+        return _label_obstacles_scipy(height_field_raw, min_height, dz_threshold)
+    elif backend == "bfs":
+        return _label_obstacles_bfs(height_field_raw, min_height, dz_threshold)
+    else:
+        raise ValueError(f"Obstacle labeling backend {backend} not recognized!")
+
+def _label_obstacles_bfs(height_field_raw, min_height, dz_threshold):
+    # Reference implementation, flood fills one pixel at a time
+    obstacles = {}
+    floodfill = np.zeros_like(height_field_raw)
+
+    def bfs(x, y, id):
+        q = deque([(x, y)])
+        while len(q) > 0:
+            x, y = q.popleft()
+            if floodfill[x, y] != 0:
+                continue
+            floodfill[x, y] = id
+            obstacles[id] = [
+                (min(obstacles[id][0][0], x), min(obstacles[id][0][1], y)),
+                (max(obstacles[id][1][0], x+1), max(obstacles[id][1][1], y+1))
+            ]
+            for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < height_field_raw.shape[0] and 0 <= ny < height_field_raw.shape[1]:
+                    if height_field_raw[nx, ny] != min_height and floodfill[nx, ny] == 0 and abs(height_field_raw[nx, ny] - height_field_raw[x, y]) < dz_threshold:
+                        q.append((nx, ny))
+    obstacle_counter = 0
+    for i in range(height_field_raw.shape[0]):
+        for j in range(height_field_raw.shape[1]):
+            if height_field_raw[i, j] != min_height and floodfill[i, j] == 0:
+                obstacle_counter += 1
+                obstacles[obstacle_counter] = [(i, j), (i, j)]
+                bfs(i, j, obstacle_counter)
+    return obstacles
+
+def _label_obstacles_scipy(height_field_raw, min_height, dz_threshold):
+    # Same regions as the flood fill, but the edge condition depends on the height difference between neighbors,
+    # so we label with connected components on the pixel graph instead of scipy.ndimage.label
+    hf = height_field_raw
+    num_rows, num_cols = hf.shape
+    is_obstacle = hf != min_height
+    pixel_ids = np.arange(num_rows * num_cols).reshape(num_rows, num_cols)
+
+    # NOTE: Differences are taken in the height field's dtype to match the flood fill exactly
+    connect_x = is_obstacle[1:, :] & is_obstacle[:-1, :] & (np.abs(hf[1:, :] - hf[:-1, :]) < dz_threshold)
+    connect_y = is_obstacle[:, 1:] & is_obstacle[:, :-1] & (np.abs(hf[:, 1:] - hf[:, :-1]) < dz_threshold)
+    src = np.concatenate([pixel_ids[:-1, :][connect_x], pixel_ids[:, :-1][connect_y]])
+    dst = np.concatenate([pixel_ids[1:, :][connect_x], pixel_ids[:, 1:][connect_y]])
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(num_rows * num_cols, num_rows * num_cols))
+    _, components = connected_components(graph, directed=False)
+
+    # Renumber components by their first pixel in raster order, which is the order the flood fill discovers them
+    obstacle_components = components[is_obstacle.ravel()]
+    unique_components, first_pixel = np.unique(obstacle_components, return_index=True)
+    obstacle_ids = np.zeros(len(unique_components), dtype=np.int32)
+    obstacle_ids[np.argsort(first_pixel)] = np.arange(1, len(unique_components) + 1)
+    labels = np.zeros(num_rows * num_cols, dtype=np.int32)
+    labels[is_obstacle.ravel()] = obstacle_ids[np.searchsorted(unique_components, obstacle_components)]
+
+    obstacles = {}
+    for i, (slice_x, slice_y) in enumerate(find_objects(labels.reshape(num_rows, num_cols)), start=1):
+        obstacles[i] = [(slice_x.start, slice_y.start), (slice_x.stop, slice_y.stop)]
+    return obstacles
+
 def calc_direct_path_heights(height_field_raw, goals, skip_size):
     """Runs Bresenham's line algorithm to check heights along direct path between goals."""
     # NOTE: goals is in indices, not meters
 
-    all_line_heights = []
+    # Rasterize all lines at once: every index along the major axis is visited, and the minor axis offset
+    # at step k is k * d_minor / d_major rounded with ties down, which is exactly what Bresenham's algorithm visits
+    goals = np.round(np.asarray(goals, dtype=np.float64)).astype(np.int64)
+    starts, ends = goals[:-1], goals[1:]
+    deltas = np.abs(ends - starts)
+    signs = np.where(starts < ends, 1, -1)
+    num_points = np.max(deltas, axis=1) + 1
+    line_ids = np.repeat(np.arange(len(starts)), num_points)
+    steps = np.arange(len(line_ids)) - np.repeat(np.cumsum(num_points) - num_points, num_points)
+    dx, dy = deltas[line_ids, 0], deltas[line_ids, 1]
+    x_major = dx >= dy
+    offset_x = np.where(x_major, steps, (2 * steps * dx + dy - 1) // np.maximum(2 * dy, 1))
+    offset_y = np.where(x_major, np.maximum((2 * steps * dy + dx - 1) // np.maximum(2 * dx, 1), 0), steps)
+    xs = starts[line_ids, 0] + signs[line_ids, 0] * offset_x
+    ys = starts[line_ids, 1] + signs[line_ids, 1] * offset_y
+    all_line_heights = np.split(height_field_raw[xs, ys], np.cumsum(num_points)[:-1])
+
     all_skip_line_heights = []
-    for i in range(len(goals) - 1):
-        (goal_x, goal_y), (next_goal_x, next_goal_y) = goals[i], goals[i + 1]
-        goal_x, goal_y, next_goal_x, next_goal_y = round(goal_x), round(goal_y), round(next_goal_x), round(next_goal_y)
-
-        dx, dy = abs(next_goal_x - goal_x), abs(next_goal_y - goal_y)
-        sx, sy = 1 if goal_x < next_goal_x else -1, 1 if goal_y < next_goal_y else -1
-        err = dx - dy
-
-        # Extract height along the line
-        x, y = goal_x, goal_y
-        line_heights = [height_field_raw[x, y]]
-        while x != next_goal_x or y != next_goal_y:
-            e2 = 2 * err
-            if e2 > -dy:
-                err -= dy
-                x += sx
-            if e2 < dx:
-                err += dx
-                y += sy
-            line_heights.append(height_field_raw[x, y])
-        all_line_heights.append(line_heights)
-        
+    for line_heights in all_line_heights:
         # Check max height difference in line_heights
         # We must also account for gap obstacles: a large height difference is
         # allowed if there is a platform with smaller height difference right after
         j = 0
-        skip_line_heights = []
+        skip_idxs = []
         while j < len(line_heights) - 1:
-            skip_line_heights.append(line_heights[j])
+            skip_idxs.append(j)
             k = min(j + skip_size + 1, len(line_heights))
             diff_along_range = line_heights[j+1:k] - line_heights[j]      # Difference between jump destinations (i+1:j) and jump origin (i)
             diff_along_range = np.maximum.accumulate(diff_along_range)    # Every point is at least as high as the points before
@@ -347,8 +551,8 @@ def calc_direct_path_heights(height_field_raw, goals, skip_size):
             diff_along_range = np.abs(diff_along_range)
             min_diff_idx = np.argmin(diff_along_range)                    # Find optimal jump destination
             j += min_diff_idx + 1                                         # Move to next jump destination
-        skip_line_heights.append(line_heights[-1])
-        all_skip_line_heights.append(skip_line_heights)
+        skip_idxs.append(len(line_heights) - 1)
+        all_skip_line_heights.append(line_heights[skip_idxs])
 
     return all_line_heights, all_skip_line_heights  # First list is for all line heights, second list is with considering skips
 
@@ -358,7 +562,7 @@ def check_terrain_feasibility(terrain, allow_flat_terrain=False):
     start_location = np.array([2, (terrain.length / 2 * terrain.horizontal_scale)])
     goals = np.concatenate([start_location[None, :], terrain.goals], axis=0) / terrain.horizontal_scale
     _, heights = calc_direct_path_heights(terrain.height_field_raw, goals, skip_size=round(1 / terrain.horizontal_scale))
-    heights = [i for sublist in heights for i in sublist]
+    heights = np.concatenate(heights)
     diff_along_path = np.max(np.abs(np.diff(heights)))
     assert diff_along_path <= round(0.8 / terrain.vertical_scale), f'Generated terrain has maximum height difference of {diff_along_path} along direct path, not feasible!'
     if not allow_flat_terrain:
@@ -401,19 +605,12 @@ def convert_heightfield_to_trimesh(height_field_raw, horizontal_scale, vertical_
     vertices[:, 0] = xx.flatten()
     vertices[:, 1] = yy.flatten()
     vertices[:, 2] = hf.flatten() * vertical_scale
-    triangles = -np.ones((2*(num_rows-1)*(num_cols-1), 3), dtype=np.uint32)
-    for i in range(num_rows - 1):
-        ind0 = np.arange(0, num_cols-1) + i*num_cols
-        ind1 = ind0 + 1
-        ind2 = ind0 + num_cols
-        ind3 = ind2 + 1
-        start = 2*i*(num_cols-1)
-        stop = start + 2*(num_cols-1)
-        triangles[start:stop:2, 0] = ind0
-        triangles[start:stop:2, 1] = ind3
-        triangles[start:stop:2, 2] = ind1
-        triangles[start+1:stop:2, 0] = ind0
-        triangles[start+1:stop:2, 1] = ind2
-        triangles[start+1:stop:2, 2] = ind3
+    # Two triangles per grid square, built for all squares at once in the same order as isaacgym
+    # Each square's six indices are its top-left vertex index plus fixed offsets, written straight into a uint32 array
+    top_left = np.arange(num_rows-1, dtype=np.uint32)[:, None] * np.uint32(num_cols) + np.arange(num_cols-1, dtype=np.uint32)[None, :]
+    offsets = np.array([0, num_cols+1, 1, 0, num_cols, num_cols+1], dtype=np.uint32)
+    triangles = np.empty((num_rows-1, num_cols-1, 6), dtype=np.uint32)
+    np.add(top_left[:, :, None], offsets, out=triangles)
+    triangles = triangles.reshape(-1, 3)
 
     return vertices, triangles, move_x != 0
@@ -130,8 +130,8 @@ class PPO:
             self.depth_actor = depth_actor
             self.depth_actor_optimizer = optim.Adam([*self.depth_actor.parameters(), *self.depth_encoder.parameters()], lr=depth_encoder_paras["learning_rate"])
 
-    def init_storage(self, num_envs, num_transitions_per_env, actor_obs_shape, critic_obs_shape, action_shape):
-        self.storage = RolloutStorage(num_envs, num_transitions_per_env, actor_obs_shape,  critic_obs_shape, action_shape, self.device)
+    def init_storage(self, num_envs, num_transitions_per_env, actor_obs_shape, critic_obs_shape, action_shape, history_len=None, n_proprio=None):
+        self.storage = RolloutStorage(num_envs, num_transitions_per_env, actor_obs_shape,  critic_obs_shape, action_shape, self.device, history_len, n_proprio)
 
     def test_mode(self):
         self.actor_critic.test()
@@ -313,19 +313,26 @@ class PPO:
     
     def update_depth_actor(self, actions_student_batch, actions_teacher_batch, yaw_student_batch=None, yaw_teacher_batch=None):
         if self.if_depth:
-            depth_actor_loss = (actions_teacher_batch.detach() - actions_student_batch).norm(p=2, dim=1).mean()
-            if yaw_student_batch is not None and yaw_teacher_batch is not None:
-                yaw_loss = (yaw_teacher_batch.detach() - yaw_student_batch).norm(p=2, dim=1).mean()
-                loss = depth_actor_loss + yaw_loss
-            else:
-                yaw_loss = torch.zeros_like(depth_actor_loss)
-                loss = depth_actor_loss
-
             self.depth_actor_optimizer.zero_grad()
-            loss.backward()
-            nn.utils.clip_grad_norm_(self.depth_actor.parameters(), self.max_grad_norm)
-            self.depth_actor_optimizer.step()
+            depth_actor_loss, yaw_loss = self.backward_depth_actor(actions_student_batch, actions_teacher_batch, yaw_student_batch, yaw_teacher_batch)
+            self.step_depth_actor()
             return depth_actor_loss.item(), yaw_loss.item()
+
+    def backward_depth_actor(self, actions_student_batch, actions_teacher_batch, yaw_student_batch=None, yaw_teacher_batch=None, weight=1.0):
+        # Accumulates the gradients of the losses (scaled by weight) of one window of steps, returns the detached scaled losses
+        depth_actor_loss = (actions_teacher_batch.detach() - actions_student_batch).norm(p=2, dim=1).mean() * weight
+        if yaw_student_batch is not None and yaw_teacher_batch is not None:
+            yaw_loss = (yaw_teacher_batch.detach() - yaw_student_batch).norm(p=2, dim=1).mean() * weight
+            loss = depth_actor_loss + yaw_loss
+        else:
+            yaw_loss = torch.zeros_like(depth_actor_loss)
+            loss = depth_actor_loss
+        loss.backward()
+        return depth_actor_loss.detach(), yaw_loss.detach()
+
+    def step_depth_actor(self):
+        nn.utils.clip_grad_norm_(self.depth_actor.parameters(), self.max_grad_norm)
+        self.depth_actor_optimizer.step()
     
     def update_depth_both(self, depth_latent_batch, scandots_latent_batch, actions_student_batch, actions_teacher_batch):
         if self.if_depth:
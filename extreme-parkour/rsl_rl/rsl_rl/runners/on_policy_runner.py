@@ -30,7 +30,6 @@
 
 import time
 import os
-from collections import deque
 import statistics
 
 import torch
@@ -39,6 +38,7 @@ import wandb
 from rsl_rl.algorithms import PPO
 from rsl_rl.modules import *
 from rsl_rl.env import VecEnv
+from rsl_rl.utils import EpisodeStatistics, CheckpointWriter
 from copy import copy, deepcopy
 import warnings
 
@@ -94,14 +94,19 @@ class OnPolicyRunner:
                                   device=self.device, **self.alg_cfg)
         self.num_steps_per_env = self.cfg["num_steps_per_env"]
         self.save_interval = self.cfg["save_interval"]
+        self.checkpoint_writer = CheckpointWriter(keep_last=self.cfg["keep_last_checkpoints"], keep_interval=self.cfg["keep_checkpoint_interval"])
         self.dagger_update_freq = self.alg_cfg["dagger_update_freq"]
 
+        # Lean storage rebuilds the proprio history at the end of each observation instead of storing it at every step
+        lean_storage = self.cfg["lean_storage"]
         self.alg.init_storage(
             self.env.num_envs, 
             self.num_steps_per_env, 
             [self.env.num_obs], 
             [self.env.num_privileged_obs], 
             [self.env.num_actions],
+            history_len=self.env.cfg.env.history_len if lean_storage else None,
+            n_proprio=self.env.cfg.env.n_proprio if lean_storage else None,
         )
 
         self.learn = self.learn_RL if not self.if_depth else self.learn_vision
@@ -124,12 +129,8 @@ class OnPolicyRunner:
         self.alg.actor_critic.train() # switch to train mode (for dropout for example)
 
         ep_infos = []
-        reward_sum_buffer = deque(maxlen=100)
-        episode_len_buffer = deque(maxlen=100)
-        goals_reached_buffer = deque(maxlen=100)
-        cur_reward_sum = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
-        cur_episode_length = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
-        cur_num_goals_reached = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
+        # Stats of the last 100 episodes, kept on the device and only read when logging
+        episode_stats = EpisodeStatistics(["reward", "length", "goals_reached"], self.env.num_envs, maxlen=100, device=self.device)
 
         self.start_learning_iteration = copy(self.current_learning_iteration)
         self.end_learning_iteration = self.current_learning_iteration + num_learning_iterations
@@ -153,19 +154,8 @@ class OnPolicyRunner:
                         # Book keeping
                         if 'episode' in infos:
                             ep_infos.append(infos['episode'])
-                        cur_reward_sum += rewards
-                        cur_episode_length += 1
-                        cur_num_goals_reached += infos["inc_goal"]
-                        
                         # Record and reset stats for finished episodes
-                        new_ids = (dones > 0).nonzero(as_tuple=False)
-                        reward_sum_buffer.extend(cur_reward_sum[new_ids][:, 0].cpu().numpy().tolist())
-                        episode_len_buffer.extend(cur_episode_length[new_ids][:, 0].cpu().numpy().tolist())
-                        goals_reached_buffer.extend(cur_num_goals_reached[new_ids][:, 0].cpu().numpy().tolist())
-
-                        cur_reward_sum[new_ids] = 0
-                        cur_episode_length[new_ids] = 0
-                        cur_num_goals_reached[new_ids] = 0
+                        episode_stats.update(dones, reward=rewards, length=1, goals_reached=infos["inc_goal"])
 
                 stop = time.time()
                 collection_time = stop - start
@@ -189,6 +179,7 @@ class OnPolicyRunner:
         
         self.current_learning_iteration = self.end_learning_iteration
         self.save(os.path.join(self.log_dir, 'model_{}.pt'.format(self.current_learning_iteration)))
+        self.checkpoint_writer.flush()
 
     def learn_vision(self, num_learning_iterations, init_at_random_ep_len=False):
         if init_at_random_ep_len:
@@ -198,12 +189,8 @@ class OnPolicyRunner:
         self.end_learning_iteration = self.current_learning_iteration + num_learning_iterations
 
         ep_infos = []
-        reward_sum_buffer = deque(maxlen=100)
-        episode_len_buffer = deque(maxlen=100)
-        goals_reached_buffer = deque(maxlen=100)
-        cur_reward_sum = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
-        cur_episode_length = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
-        cur_num_goals_reached = torch.zeros(self.env.num_envs, dtype=torch.float, device=self.device)
+        # Stats of the last 100 episodes, kept on the device and only read when logging
+        episode_stats = EpisodeStatistics(["reward", "length", "goals_reached"], self.env.num_envs, maxlen=100, device=self.device)
 
         obs = self.env.get_observations()
         infos = {
@@ -214,9 +201,15 @@ class OnPolicyRunner:
         self.alg.depth_actor.train()
 
         num_pretrain_iter = 0
+        num_steps = self.depth_encoder_cfg["num_steps_per_env"]
+        # Gradients are accumulated over windows of bptt_window steps, cutting the graph through the hidden states in between
+        bptt_window = self.depth_encoder_cfg["bptt_window"] or num_steps
+        assert bptt_window % self.env.cfg.depth.update_interval == 0, "bptt_window must be a multiple of depth.update_interval"
         for it in range(self.start_learning_iteration, self.end_learning_iteration):
             self.current_learning_iteration = it
             start = time.time()
+            self.alg.depth_actor_optimizer.zero_grad()
+            depth_actor_loss, yaw_loss = 0, 0
             depth_latent_buffer = []
             scandots_latent_buffer = []
             actions_teacher_buffer = []
@@ -224,7 +217,7 @@ class OnPolicyRunner:
             yaw_buffer_student = []
             yaw_buffer_teacher = []
             delta_yaw_ok_buffer = []
-            for i in range(self.depth_encoder_cfg["num_steps_per_env"]):
+            for i in range(num_steps):
                 if infos["depth"] != None:
                     with torch.no_grad():
                         scandots_latent = self.alg.actor_critic.actor.infer_scandots_latent(obs)
@@ -248,7 +241,7 @@ class OnPolicyRunner:
                     actions_teacher_buffer.append(actions_teacher)
 
                 obs_student = obs.clone()
-                delta_yaw_ok_buffer.append(torch.nonzero(infos["delta_yaw_ok"]).size(0) / infos["delta_yaw_ok"].numel())
+                delta_yaw_ok_buffer.append(infos["delta_yaw_ok"].double().mean())
                 if self.depth_encoder_cfg["train_direction_distillation"]:
                     # delta_yaw_ok will be completely 0 if depth.use_direction_distillation is False (see LeggedRobot)
                     obs_student[infos["delta_yaw_ok"], 5:7] = yaw.detach()[infos["delta_yaw_ok"]]
@@ -267,36 +260,39 @@ class OnPolicyRunner:
                         # Book keeping
                         if 'episode' in infos:
                             ep_infos.append(infos['episode'])
-                        cur_reward_sum += rewards
-                        cur_episode_length += 1
-                        cur_num_goals_reached += infos["inc_goal"]
-                        new_ids = (dones > 0).nonzero(as_tuple=False)
-                        reward_sum_buffer.extend(cur_reward_sum[new_ids][:, 0].cpu().numpy().tolist())
-                        episode_len_buffer.extend(cur_episode_length[new_ids][:, 0].cpu().numpy().tolist())
-                        goals_reached_buffer.extend(cur_num_goals_reached[new_ids][:, 0].cpu().numpy().tolist())
-
-                        cur_reward_sum[new_ids] = 0
-                        cur_episode_length[new_ids] = 0
-                        cur_num_goals_reached[new_ids] = 0
+                        episode_stats.update(dones, reward=rewards, length=1, goals_reached=infos["inc_goal"])
+
+                if (i + 1) % bptt_window == 0 or i == num_steps - 1:
+                    # Backpropagate through this window and free its graph, each window's mean losses are weighted by its share of the steps
+                    weight = len(actions_student_buffer) / num_steps
+                    actions_teacher_buffer = torch.cat(actions_teacher_buffer, dim=0)
+                    actions_student_buffer = torch.cat(actions_student_buffer, dim=0)
+                    if self.depth_encoder_cfg["train_direction_distillation"]:
+                        yaw_buffer_student = torch.cat(yaw_buffer_student, dim=0)
+                        yaw_buffer_teacher = torch.cat(yaw_buffer_teacher, dim=0)
+                        window_losses = self.alg.backward_depth_actor(actions_student_buffer, actions_teacher_buffer, yaw_buffer_student, yaw_buffer_teacher, weight=weight)
+                    else:
+                        window_losses = self.alg.backward_depth_actor(actions_student_buffer, actions_teacher_buffer, weight=weight)
+                    depth_actor_loss += window_losses[0]
+                    yaw_loss += window_losses[1]
+                    actions_teacher_buffer = []
+                    actions_student_buffer = []
+                    yaw_buffer_student = []
+                    yaw_buffer_teacher = []
+                    self.alg.depth_encoder.detach_hidden_states()
+                    depth_latent = depth_latent.detach()
                 
             stop = time.time()
             collection_time = stop - start
             start = stop
 
-            delta_yaw_ok_percentage = sum(delta_yaw_ok_buffer) / len(delta_yaw_ok_buffer)
+            delta_yaw_ok_percentage = torch.stack(delta_yaw_ok_buffer).mean().item()
             depth_encoder_loss = 0
             # scandots_latent_buffer = torch.cat(scandots_latent_buffer, dim=0)
             # depth_latent_buffer = torch.cat(depth_latent_buffer, dim=0)
 
-            actions_teacher_buffer = torch.cat(actions_teacher_buffer, dim=0)
-            actions_student_buffer = torch.cat(actions_student_buffer, dim=0)
-            if self.depth_encoder_cfg["train_direction_distillation"]:
-                yaw_buffer_student = torch.cat(yaw_buffer_student, dim=0)
-                yaw_buffer_teacher = torch.cat(yaw_buffer_teacher, dim=0)
-                depth_actor_loss, yaw_loss = self.alg.update_depth_actor(actions_student_buffer, actions_teacher_buffer, yaw_buffer_student, yaw_buffer_teacher)
-            else:
-                depth_actor_loss, yaw_loss = self.alg.update_depth_actor(actions_student_buffer, actions_teacher_buffer)
-            self.alg.depth_encoder.detach_hidden_states()
+            self.alg.step_depth_actor()
+            depth_actor_loss, yaw_loss = depth_actor_loss.item(), yaw_loss.item()
             stop = time.time()
             learn_time = stop - start
 
@@ -308,6 +304,7 @@ class OnPolicyRunner:
 
         self.current_learning_iteration = self.end_learning_iteration
         self.save(os.path.join(self.log_dir, 'model_{}.pt'.format(self.current_learning_iteration)))
+        self.checkpoint_writer.flush()
 
     def log(self, locs, vision, width=80, pad=35):
         self.tot_timesteps += self.num_steps_per_env * self.env.num_envs
@@ -352,13 +349,15 @@ class OnPolicyRunner:
         wandb_dict['Perf/collection time'] = locs['collection_time']
         wandb_dict['Perf/learning_time'] = locs['learn_time']
 
-        if len(locs['reward_sum_buffer']) > 0:
-            wandb_dict['Train/mean_reward'] = statistics.mean(locs['reward_sum_buffer'])
-        if len(locs['episode_len_buffer']) > 0:
-            wandb_dict['Train/mean_episode_length'] = statistics.mean(locs['episode_len_buffer'])
-        if len(locs['goals_reached_buffer']) > 0:
-            wandb_dict['Train/mean_goals_reached'] = statistics.mean(locs['goals_reached_buffer'])
-            wandb_dict['Train/std_goals_reached'] = statistics.stdev(locs['goals_reached_buffer'])
+        episode_stats = locs['episode_stats'].get()
+        reward_sum_buffer, episode_len_buffer, goals_reached_buffer = episode_stats["reward"], episode_stats["length"], episode_stats["goals_reached"]
+        if len(reward_sum_buffer) > 0:
+            wandb_dict['Train/mean_reward'] = statistics.mean(reward_sum_buffer)
+        if len(episode_len_buffer) > 0:
+            wandb_dict['Train/mean_episode_length'] = statistics.mean(episode_len_buffer)
+        if len(goals_reached_buffer) > 0:
+            wandb_dict['Train/mean_goals_reached'] = statistics.mean(goals_reached_buffer)
+            wandb_dict['Train/std_goals_reached'] = statistics.stdev(goals_reached_buffer)
 
         wandb.log(wandb_dict, step=locs['it'])
 
@@ -387,10 +386,10 @@ class OnPolicyRunner:
                 f"""{'Yaw loss:':>{pad}} {locs['yaw_loss']:.4f}\n"""
                 f"""{'Delta yaw ok percentage:':>{pad}} {locs['delta_yaw_ok_percentage']:.4f}\n"""
             )
-        if len(locs['reward_sum_buffer']) > 0:
+        if len(reward_sum_buffer) > 0:
             log_string += (
-                f"""{'Mean reward (total):':>{pad}} {statistics.mean(locs['reward_sum_buffer']):.2f}\n"""
-                f"""{'Mean episode length:':>{pad}} {statistics.mean(locs['episode_len_buffer']):.2f}\n"""
+                f"""{'Mean reward (total):':>{pad}} {statistics.mean(reward_sum_buffer):.2f}\n"""
+                f"""{'Mean episode length:':>{pad}} {statistics.mean(episode_len_buffer):.2f}\n"""
             )
 
         log_string += f"""{'-' * width}\n"""
@@ -417,7 +416,8 @@ class OnPolicyRunner:
         if self.if_depth:
             state_dict['depth_encoder_state_dict'] = self.alg.depth_encoder.state_dict()
             state_dict['depth_actor_state_dict'] = self.alg.depth_actor.state_dict()
-        torch.save(state_dict, path)
+        # Written in the background, call self.checkpoint_writer.flush() to wait for it
+        self.checkpoint_writer.save(state_dict, path)
 
     def load(self, path, load_optimizer=True):
         print("*" * 80)
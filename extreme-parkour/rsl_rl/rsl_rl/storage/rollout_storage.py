@@ -31,7 +31,7 @@
 import torch
 import numpy as np
 
-from rsl_rl.utils import split_and_pad_trajectories
+from rsl_rl.utils import split_and_pad_trajectories, compute_gae
 
 class RolloutStorage:
     class Transition:
@@ -49,7 +49,7 @@ class RolloutStorage:
         def clear(self):
             self.__init__()
 
-    def __init__(self, num_envs, num_transitions_per_env, obs_shape, privileged_obs_shape, actions_shape, device='cpu'):
+    def __init__(self, num_envs, num_transitions_per_env, obs_shape, privileged_obs_shape, actions_shape, device='cpu', history_len=None, n_proprio=None):
 
         self.device = device
 
@@ -57,6 +57,20 @@ class RolloutStorage:
         self.privileged_obs_shape = privileged_obs_shape
         self.actions_shape = actions_shape
 
+        # Lean storage, if history_len and n_proprio are given: observations end with a history of the last history_len proprio
+        # observations, which at each step is either the previous history shifted by one new row, or one row repeated (after
+        # resets). So only the history before the rollout and the newest row of each step are stored, and the rest is rebuilt
+        self.history_len = history_len
+        self.n_proprio = n_proprio
+        self.lean = history_len is not None
+        if self.lean:
+            self.history_dim = history_len * n_proprio
+            self.history_rows = torch.zeros(history_len - 1 + num_transitions_per_env, num_envs, n_proprio, device=self.device)
+            self.history_fills = torch.zeros(num_transitions_per_env, num_envs, dtype=torch.bool, device=self.device)
+            self.history_prev = torch.zeros(num_envs, history_len, n_proprio, device=self.device)
+            self.history_mismatch = torch.zeros(num_envs, dtype=torch.bool, device=self.device)
+            obs_shape = [obs_shape[0] - self.history_dim]
+
         # Core
         self.observations = torch.zeros(num_transitions_per_env, num_envs, *obs_shape, device=self.device)
 
@@ -88,7 +102,10 @@ class RolloutStorage:
     def add_transitions(self, transition: Transition):
         if self.step >= self.num_transitions_per_env:
             raise AssertionError("Rollout buffer overflow")
-        self.observations[self.step].copy_(transition.observations)
+        if self.lean:
+            self._save_history(transition.observations)
+        else:
+            self.observations[self.step].copy_(transition.observations)
         if self.privileged_observations is not None: self.privileged_observations[self.step].copy_(transition.critic_observations)
         self.actions[self.step].copy_(transition.actions)
         self.rewards[self.step].copy_(transition.rewards.view(-1, 1))
@@ -101,6 +118,32 @@ class RolloutStorage:
         self._save_hidden_states(transition.hidden_states)
         self.step += 1
 
+    def _save_history(self, observations):
+        self.observations[self.step].copy_(observations[:, :-self.history_dim])
+        history = observations[:, -self.history_dim:].view(-1, self.history_len, self.n_proprio)
+        is_fill = (history == history[:, -1:]).flatten(1).all(dim=1)
+        self.history_fills[self.step].copy_(is_fill)
+        if self.step == 0:
+            self.history_rows[:self.history_len].copy_(history.transpose(0, 1))
+        else:
+            self.history_rows[self.step + self.history_len - 1].copy_(history[:, -1])
+            # Checked once per update in mini_batch_generator(), to avoid a sync every step
+            is_shift = (history[:, :-1] == self.history_prev[:, 1:]).flatten(1).all(dim=1)
+            self.history_mismatch |= ~(is_shift | is_fill)
+        self.history_prev.copy_(history)
+
+    def _get_observations(self, steps, env_ids):
+        """ Rebuilds the full observations of the given steps and envs (flat index tensors) in lean storage.
+        Row k of the history at step t is the newest row of step t - (history_len - 1) + k, or of the last step with a repeated
+        history (fill) if that is later, where steps before the rollout are taken from the history before it.
+        """
+        row_ids = torch.arange(self.history_len, device=self.device).unsqueeze(0) + steps.unsqueeze(1)
+        fill_ids = (torch.arange(self.num_transitions_per_env, device=self.device).unsqueeze(1) + self.history_len - 1) * self.history_fills
+        last_fill_ids = torch.cummax(fill_ids, dim=0)[0][steps, env_ids]
+        row_ids = torch.max(row_ids, last_fill_ids.unsqueeze(1))
+        history = self.history_rows[row_ids, env_ids.unsqueeze(1)].flatten(1)
+        return torch.cat((self.observations[steps, env_ids], history), dim=-1)
+
     def _save_hidden_states(self, hidden_states):
         if hidden_states is None or hidden_states==(None, None):
             return
@@ -120,18 +163,11 @@ class RolloutStorage:
 
     def clear(self):
         self.step = 0
+        if self.lean:
+            self.history_mismatch[:] = False
 
     def compute_returns(self, last_values, gamma, lam):
-        advantage = 0
-        for step in reversed(range(self.num_transitions_per_env)):
-            if step == self.num_transitions_per_env - 1:
-                next_values = last_values
-            else:
-                next_values = self.values[step + 1]
-            next_is_not_terminal = 1.0 - self.dones[step].float()
-            delta = self.rewards[step] + next_is_not_terminal * gamma * next_values - self.values[step]
-            advantage = delta + next_is_not_terminal * gamma * lam * advantage
-            self.returns[step] = advantage + self.values[step]
+        self.returns.copy_(compute_gae(self.rewards, self.values, self.dones, last_values, gamma, lam))
 
         # Compute and normalize the advantages
         self.advantages = self.returns - self.values
@@ -150,6 +186,8 @@ class RolloutStorage:
         mini_batch_size = batch_size // num_mini_batches
         indices = torch.randperm(num_mini_batches*mini_batch_size, requires_grad=False, device=self.device)
 
+        if self.lean and self.history_mismatch.any():
+            raise RuntimeError("Observation history isn't shifted by one row per step, so lean rollout storage can't rebuild it")
         observations = self.observations.flatten(0, 1)
 
         if self.privileged_observations is not None:
@@ -172,8 +210,11 @@ class RolloutStorage:
                 end = (i+1)*mini_batch_size
                 batch_idx = indices[start:end]
 
-                obs_batch = observations[batch_idx]
-                critic_observations_batch = critic_observations[batch_idx]
+                if self.lean:
+                    obs_batch = self._get_observations(batch_idx // self.num_envs, batch_idx % self.num_envs)
+                else:
+                    obs_batch = observations[batch_idx]
+                critic_observations_batch = critic_observations[batch_idx] if self.privileged_observations is not None else obs_batch
                 actions_batch = actions[batch_idx]
                 target_values_batch = values[batch_idx]
                 returns_batch = returns[batch_idx]
@@ -189,7 +230,11 @@ class RolloutStorage:
     # for RNNs only
     def reccurent_mini_batch_generator(self, num_mini_batches, num_epochs=8):
 
-        padded_obs_trajectories, trajectory_masks = split_and_pad_trajectories(self.observations, self.dones)
+        observations = self.observations
+        if self.lean:
+            steps, env_ids = torch.meshgrid(torch.arange(self.num_transitions_per_env, device=self.device), torch.arange(self.num_envs, device=self.device))
+            observations = self._get_observations(steps.flatten(), env_ids.flatten()).view(self.num_transitions_per_env, self.num_envs, -1)
+        padded_obs_trajectories, trajectory_masks = split_and_pad_trajectories(observations, self.dones)
         if self.privileged_observations is not None: 
             padded_critic_obs_trajectories, _ = split_and_pad_trajectories(self.privileged_observations, self.dones)
         else: 
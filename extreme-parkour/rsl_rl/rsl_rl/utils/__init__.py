@@ -28,4 +28,5 @@
 #
 # Copyright (c) 2021 ETH Zurich, Nikita Rudin
 
-from .utils import split_and_pad_trajectories, unpad_trajectories
\ No newline at end of file
+from .utils import split_and_pad_trajectories, unpad_trajectories, compute_gae, EpisodeStatistics
+from .checkpoint_writer import CheckpointWriter
\ No newline at end of file
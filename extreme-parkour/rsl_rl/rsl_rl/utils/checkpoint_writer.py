@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: Copyright (c) 2021 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: BSD-3-Clause
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Copyright (c) 2021 ETH Zurich, Nikita Rudin
+
+
+import os
+import re
+import queue
+import threading
+
+import torch
+
+def to_cpu(obj):
+    """ Copies all tensors in a (nested) state dict to the CPU, so that training can keep updating the originals. """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+class CheckpointWriter:
+    """ Writes checkpoints in a background thread, so that training doesn't wait on the disk.
+    Each checkpoint is written to a temporary file and renamed, so a checkpoint named model_<it>.pt is always complete.
+    After each write, only the last keep_last checkpoints in the directory are kept, and the ones at iterations
+    that are multiples of keep_interval (0 = none).
+    A keep_last below 1 keeps every checkpoint.
+    """
+    def __init__(self, keep_last=-1, keep_interval=0):
+        self.keep_last = keep_last
+        self.keep_interval = keep_interval
+        # At most one snapshot waits while another one is written, saving blocks until the older one is done
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def save(self, state_dict, path):
+        self._raise_error()
+        self.queue.put((to_cpu(state_dict), path))
+
+    def flush(self):
+        """ Waits until all checkpoints are written. """
+        self.queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Failed to write checkpoint") from error
+
+    def _write_loop(self):
+        while True:
+            state_dict, path = self.queue.get()
+            try:
+                tmp_path = f"{path}.tmp"
+                torch.save(state_dict, tmp_path)
+                os.replace(tmp_path, path)
+                self._remove_old_checkpoints(os.path.dirname(path))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _remove_old_checkpoints(self, log_dir):
+        if self.keep_last < 1:
+            return
+        checkpoints = {}
+        for file in os.listdir(log_dir):
+            match = re.fullmatch(r"model_(\d+)\.pt", file)
+            if match is not None:
+                checkpoints[int(match.group(1))] = file
+        its = sorted(checkpoints.keys())
+        for it in its[:-self.keep_last]:
+            if self.keep_interval > 0 and it % self.keep_interval == 0:
+                continue
+            os.remove(os.path.join(log_dir, checkpoints[it]))
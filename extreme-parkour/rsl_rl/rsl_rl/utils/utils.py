@@ -68,4 +68,62 @@ def unpad_trajectories(trajectories, masks):
     """ Does the inverse operation of  split_and_pad_trajectories()
     """
     # Need to transpose before and after the masking to have proper reshaping
-    return trajectories.transpose(1, 0)[masks.transpose(1, 0)].view(-1, trajectories.shape[0], trajectories.shape[-1]).transpose(1, 0)
\ No newline at end of file
+    return trajectories.transpose(1, 0)[masks.transpose(1, 0)].view(-1, trajectories.shape[0], trajectories.shape[-1]).transpose(1, 0)
+
+def compute_gae(rewards, values, dones, last_values, gamma, lam):
+    """ Computes the returns of generalized advantage estimation in a few batched ops, instead of looping backwards in time.
+    The advantage of step t is the sum of the TD errors of steps s >= t in the same episode, discounted by (gamma * lam)^(s - t),
+    so it is one product with a [time, time, number of envs] discount matrix (memory grows with the square of the rollout length).
+    Assumes that the inputs have the following dimension order: [time, number of envs, 1], and last_values: [number of envs, 1]
+    """
+    num_steps = rewards.shape[0]
+    not_dones = 1.0 - dones.float()
+    next_values = torch.cat((values[1:], last_values.unsqueeze(0)), dim=0)
+    deltas = rewards + not_dones * gamma * next_values - values
+
+    # Steps t and s are in the same episode if no episode ended before s, from t on, i.e. both have the same number of dones before them
+    dones_before = torch.cumsum(dones.long(), dim=0) - dones.long()
+    same_episode = dones_before[..., 0].unsqueeze(1) == dones_before[..., 0].unsqueeze(0)
+    steps = torch.arange(num_steps, device=rewards.device)
+    offsets = steps.unsqueeze(0) - steps.unsqueeze(1)
+    discounts = (gamma * lam) ** offsets.clamp(min=0).float() * (offsets >= 0)
+    advantages = torch.einsum("tsn,sn->tn", discounts.unsqueeze(-1) * same_episode, deltas[..., 0])
+    return advantages.unsqueeze(-1) + values
+
+class EpisodeStatistics:
+    """ Keeps running sums of per-episode statistics (e.g. reward, length) and the sums of the last maxlen finished episodes,
+    all on the device, so that updating them every step does not sync with the host. Equivalent to extending one
+    deque(maxlen=maxlen) per statistic with the sums of the envs done at each step (in order of env id).
+    """
+    def __init__(self, names, num_envs, maxlen=100, device='cpu'):
+        self.names = list(names)
+        self.maxlen = maxlen
+        self.device = device
+        self.current = torch.zeros(len(self.names), num_envs, dtype=torch.float, device=self.device)
+        # The extra column is a scratch slot for envs that are not done (or that are overwritten in the same step)
+        self.finished = torch.zeros(len(self.names), maxlen + 1, dtype=torch.float, device=self.device)
+        self.num_finished = torch.zeros(1, dtype=torch.long, device=self.device)
+
+    def update(self, dones, **increments):
+        for i, name in enumerate(self.names):
+            self.current[i] += increments[name]
+
+        dones = dones > 0
+        done_ranks = torch.cumsum(dones.long(), dim=0) - 1
+        num_dones = done_ranks[-1:] + 1
+        # Only the last maxlen done envs are kept, like a deque, so that their slots don't collide
+        kept = dones & (done_ranks >= num_dones - self.maxlen)
+        slots = torch.where(kept, (self.num_finished + done_ranks) % self.maxlen, torch.full_like(done_ranks, self.maxlen))
+        self.finished[:, slots] = self.current
+        self.num_finished += num_dones
+        self.current *= ~dones
+
+    def get(self):
+        """ Returns the sums of the last (up to maxlen) finished episodes for each statistic, oldest first. """
+        num_finished = self.num_finished.item()
+        finished = self.finished[:, :self.maxlen].cpu()
+        if num_finished > self.maxlen:
+            finished = torch.roll(finished, -(num_finished % self.maxlen), dims=1)
+        else:
+            finished = finished[:, :num_finished]
+        return {name: values for name, values in zip(self.names, finished.tolist())}